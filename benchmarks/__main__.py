@@ -0,0 +1,124 @@
+"""Run the jobmonitor benchmarks.
+
+Run from the repository root with
+
+    python -m benchmarks [--save NAME] [--compare NAME]
+
+See `python -m benchmarks --help` for all options.
+"""
+import json
+import optparse
+import sys
+
+from . import harness, load, micro, startup
+
+
+def parse_args(argv):
+    parser = optparse.OptionParser(usage='python -m benchmarks [options]')
+    parser.add_option('--micro-only', action='store_true', default=False,
+                      help='only run the micro-benchmarks')
+    parser.add_option('--load-only', action='store_true', default=False,
+                      help='only run the load test')
+    parser.add_option('--startup-only', action='store_true', default=False,
+                      help='only run the startup benchmarks')
+    parser.add_option('--iterations', type='int', default=10000,
+                      help='calls per micro-benchmark repetition '
+                           '(default: %default)')
+    parser.add_option('--startup-repeat', type='int', default=5,
+                      help='interpreters started per startup benchmark '
+                           '(default: %default)')
+    parser.add_option('--clients', type='int', default=10,
+                      help='simulated browser clients (default: %default)')
+    parser.add_option('--duration', type='float', default=10.0,
+                      help='seconds to run the load test for '
+                           '(default: %default)')
+    parser.add_option('--poll-rate', type='float', default=0.05,
+                      help='seconds between polls of a job '
+                           '(default: %default)')
+    parser.add_option('--job-time', type='float', default=0.1,
+                      help='seconds each simulated job takes '
+                           '(default: %default)')
+    parser.add_option('--workers', type='int', default=4,
+                      help='simulated workers (default: %default)')
+    parser.add_option('--long-poll', type='float', default=0,
+                      help='wait parameter of polls, needs --redis-url '
+                           '(default: %default)')
+    parser.add_option('--redis-url',
+                      help='Redis server to use (default: fakeredis)')
+    parser.add_option('--save', metavar='NAME',
+                      help='save the results as the named baseline')
+    parser.add_option('--compare', metavar='NAME',
+                      help='compare the results to the named baseline, '
+                           'exiting with status 1 on a regression')
+    parser.add_option('--tolerance', type='float',
+                      default=harness.DEFAULT_TOLERANCE,
+                      help='fractional slowdown counted as a regression '
+                           '(default: %default)')
+    parser.add_option('--json', action='store_true', default=False,
+                      help='print the results as JSON')
+    options, args = parser.parse_args(argv)
+    if args:
+        parser.error('Unexpected arguments: {0}'.format(' '.join(args)))
+    if options.long_poll and options.redis_url is None:
+        parser.error('--long-poll needs --redis-url, as fakeredis has no '
+                     'pub/sub')
+    return options
+
+
+def format_results(results):
+    lines = []
+    for name in sorted(results):
+        stats = ', '.join(
+            '{0}={1:.4g}'.format(key, value)
+            if isinstance(value, float) else '{0}={1}'.format(key, value)
+            for key, value in sorted(results[name].items())
+        )
+        lines.append('{0:<40} {1}'.format(name, stats))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    options = parse_args(sys.argv[1:] if argv is None else argv)
+    results = {}
+    only = (options.micro_only, options.load_only, options.startup_only)
+    if options.micro_only or not any(only):
+        results.update(micro.run(options.iterations, options.redis_url))
+    if options.load_only or not any(only):
+        results.update(load.run(
+            clients=options.clients,
+            duration=options.duration,
+            poll_rate=options.poll_rate,
+            job_time=options.job_time,
+            workers=options.workers,
+            long_poll_wait=options.long_poll,
+            redis_url=options.redis_url
+        ))
+    if options.startup_only or not any(only):
+        results.update(startup.run(options.startup_repeat))
+    if options.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    else:
+        print(format_results(results))
+    if options.save:
+        harness.save_baseline(options.save, results)
+        print('Saved baseline `{0}`'.format(options.save))
+    if options.compare:
+        rows, regressions = harness.compare(
+            results, harness.load_baseline(options.compare),
+            options.tolerance
+        )
+        print('\nCompared to baseline `{0}`:'.format(options.compare))
+        for name, key, before, after, change in rows:
+            print('{0:<40} {1:<20} {2:>12.4g} -> {3:>12.4g} ({4:+.1%})'.format(
+                name, key, before, after, change
+            ))
+        if regressions:
+            print('\n{0} statistics regressed by more than {1:.0%}'.format(
+                len(regressions), options.tolerance
+            ))
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
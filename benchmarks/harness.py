@@ -0,0 +1,152 @@
+"""harness
+Timing, statistics, and baselines shared by the benchmarks.
+"""
+import contextlib
+import json
+import math
+import os
+import platform
+import time
+
+import fakeredis
+import mock
+
+import jobmonitor
+from tests.test_jobs_blueprint import mocked_resolve_connection
+
+# Where baselines are saved by `--save` and read by `--compare`
+BASELINE_DIRECTORY = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'baselines'
+)
+
+# Fractional slowdown of a benchmark, relative to its baseline, reported as
+# a regression
+DEFAULT_TOLERANCE = 0.2
+
+
+def percentile(values, p):
+    """Return the p-th percentile of the values, by the nearest rank."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = int(math.ceil(p / 100.0 * len(ordered))) - 1
+    return ordered[min(max(rank, 0), len(ordered) - 1)]
+
+
+def summarize(latencies, elapsed):
+    """Return the statistics of the latencies, in seconds, of requests made
+    over elapsed seconds."""
+    return dict(
+        count=len(latencies),
+        p50_ms=percentile(latencies, 50) * 1e3 if latencies else None,
+        p99_ms=percentile(latencies, 99) * 1e3 if latencies else None,
+        requests_per_second=len(latencies) / elapsed if elapsed else None
+    )
+
+
+def time_calls(func, iterations, repeat=5):
+    """Return the statistics of calling func iterations times, repeat times.
+
+    The per-call time of each repetition is measured, and the median and
+    fastest are reported, in microseconds.
+    """
+    per_call = []
+    for _ in range(repeat):
+        start = time.time()
+        for _ in range(iterations):
+            func()
+        per_call.append((time.time() - start) / iterations)
+    median = percentile(per_call, 50)
+    return dict(
+        iterations=iterations,
+        median_us=median * 1e6,
+        best_us=min(per_call) * 1e6,
+        calls_per_second=1 / median if median else None
+    )
+
+
+@contextlib.contextmanager
+def patched_redis(redis_url=None):
+    """Run the body with rq and jobmonitor connected to Redis.
+
+    If redis_url is None, fakeredis is used, patched in as the tests do.
+    """
+    if redis_url is not None:
+        os.environ['REDIS_URL'] = redis_url
+        yield
+        return
+    with mock.patch('redis.StrictRedis', fakeredis.FakeStrictRedis), \
+            mock.patch('rq.queue.resolve_connection',
+                       mocked_resolve_connection), \
+            mock.patch('rq.job.resolve_connection',
+                       mocked_resolve_connection):
+        yield
+
+
+def create_app():
+    """Return a jobmonitor app configured for benchmarking."""
+    app = jobmonitor.create_app()
+    app.config['TESTING'] = True
+    return app
+
+
+def environment():
+    """Return a description of the machine the benchmarks ran on."""
+    return dict(
+        python=platform.python_version(),
+        implementation=platform.python_implementation(),
+        machine=platform.machine(),
+        system=platform.system()
+    )
+
+
+def baseline_path(name):
+    return os.path.join(BASELINE_DIRECTORY, '{0}.json'.format(name))
+
+
+def save_baseline(name, results):
+    """Save the results as the named baseline."""
+    if not os.path.isdir(BASELINE_DIRECTORY):
+        os.makedirs(BASELINE_DIRECTORY)
+    with open(baseline_path(name), 'w') as f:
+        json.dump(dict(environment=environment(), results=results), f,
+                  indent=2, sort_keys=True)
+
+
+def load_baseline(name):
+    """Return the results of the named baseline."""
+    with open(baseline_path(name)) as f:
+        return json.load(f)['results']
+
+
+# Statistics where larger values are better, the rest being timings
+THROUGHPUT_KEYS = ('calls_per_second', 'requests_per_second')
+TIMING_KEYS = ('median_us', 'median_ms', 'p50_ms', 'p99_ms')
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Return a list of (benchmark, statistic, baseline, current, change)
+    tuples for every statistic in both results, and a list of those that
+    regressed by more than tolerance.
+
+    The change is the fractional slowdown, so positive values are worse.
+    """
+    rows = []
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        for key in TIMING_KEYS + THROUGHPUT_KEYS:
+            before = baseline[name].get(key)
+            after = results[name].get(key)
+            if not before or not after:
+                continue
+            if key in THROUGHPUT_KEYS:
+                change = before / after - 1
+            else:
+                change = after / before - 1
+            row = (name, key, before, after, change)
+            rows.append(row)
+            if change > tolerance:
+                regressions.append(row)
+    return rows, regressions
@@ -0,0 +1,140 @@
+"""load
+A load generator simulating browser clients running the submit and poll loop
+of jobmonitor.js against the jobs API.
+
+The app is driven in-process through Werkzeug's test client, one thread per
+client, so the results measure the app and Redis rather than a web server.
+Simulated worker threads complete the jobs after a fixed run time.
+"""
+import json
+import threading
+import time
+
+from rq.utils import utcnow
+
+from jobmonitor import results, start_worker
+from jobmonitor.jobs import PENDING_STATUSES
+
+from . import harness
+
+# The host part of the job URIs sent by the app, stripped before polling
+URI_PREFIX = 'http://localhost'
+
+
+class Recorder(object):
+    """Thread-safe store of request latencies per route."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = 0
+
+    def record(self, route, latency, ok=True):
+        with self._lock:
+            self.latencies.setdefault(route, []).append(latency)
+            if not ok:
+                self.errors += 1
+
+
+def worker(app, stop, job_time):
+    """Complete queued jobs, job_time seconds after they are taken."""
+    queues = [app.queues[name] for name in app.config['QUEUES']]
+    while not stop.is_set():
+        job = None
+        for queue in queues:
+            job = queue.dequeue()
+            if job is not None:
+                break
+        if job is None:
+            time.sleep(0.001)
+            continue
+        job.set_status('started')
+        time.sleep(job_time)
+        job._result = results.encode(dict(bins=list(range(100))))
+        job.set_status('finished')
+        job.ended_at = utcnow()
+        job.save()
+        try:
+            start_worker.publish_job_status(app.redis, job)
+        except AttributeError:
+            # fakeredis does not support publishing
+            pass
+
+
+def client(app, recorder, deadline, poll_rate, long_poll_wait):
+    """Submit a job and poll it until it completes, until the deadline."""
+    http = app.test_client()
+    data = json.dumps(dict(task_name='benchmark', args=dict(n=1)))
+    while time.time() < deadline:
+        start = time.time()
+        rv = http.post('/jobs', data=data, content_type='application/json')
+        recorder.record('POST /jobs', time.time() - start,
+                        rv.status_code in (200, 201))
+        if rv.status_code not in (200, 201):
+            continue
+        job = json.loads(rv.data.decode('utf-8'))['job']
+        uri = job['uri'][len(URI_PREFIX):]
+        if long_poll_wait:
+            uri += '?wait={0}'.format(long_poll_wait)
+        while job['status'] in PENDING_STATUSES and time.time() < deadline:
+            time.sleep(poll_rate)
+            start = time.time()
+            rv = http.get(uri)
+            recorder.record('GET /jobs/<id>', time.time() - start,
+                            rv.status_code == 200)
+            if rv.status_code != 200:
+                break
+            job = json.loads(rv.data.decode('utf-8'))['job']
+
+
+def run(clients=10, duration=10.0, poll_rate=0.05, job_time=0.1,
+        workers=4, long_poll_wait=0, redis_url=None):
+    """Run the load test, returning the latency statistics of each route.
+
+    Keyword arguments:
+    clients -- Number of simulated browser clients
+    duration -- Seconds to run for
+    poll_rate -- Seconds between polls of a job, as settings.pollRate
+    job_time -- Seconds a simulated worker takes to run each job
+    workers -- Number of simulated workers
+    long_poll_wait -- `wait` parameter of polls, as settings.longPollWait,
+                      which needs a real Redis server for pub/sub
+    redis_url -- Redis server to use, or None for fakeredis
+    """
+    with harness.patched_redis(redis_url):
+        app = harness.create_app()
+        app.add_job_resolver(lambda name: 'str')
+        recorder = Recorder()
+        stop = threading.Event()
+        worker_threads = [
+            threading.Thread(target=worker, args=(app, stop, job_time))
+            for _ in range(workers)
+        ]
+        for thread in worker_threads:
+            thread.daemon = True
+            thread.start()
+        start = time.time()
+        deadline = start + duration
+        threads = [
+            threading.Thread(target=client, args=(
+                app, recorder, deadline, poll_rate, long_poll_wait
+            ))
+            for _ in range(clients)
+        ]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+        stop.set()
+        for thread in worker_threads:
+            thread.join()
+    stats = {}
+    all_latencies = []
+    for route, latencies in recorder.latencies.items():
+        stats['load {0}'.format(route)] = harness.summarize(latencies,
+                                                            elapsed)
+        all_latencies.extend(latencies)
+    stats['load all'] = harness.summarize(all_latencies, elapsed)
+    stats['load all']['errors'] = recorder.errors
+    return stats
@@ -0,0 +1,98 @@
+"""micro
+Micro-benchmarks of the functions on the request path.
+"""
+from jobmonitor import catchall, jobs
+from jobmonitor.FlaskWithJobResolvers import StaticJobResolver
+
+from . import harness
+
+
+def benchmark_serialize_job(app, iterations):
+    """Serialise a finished job with a histogram result."""
+    with app.test_request_context():
+        job = app.queues['default'].enqueue('str', args=('foo',))
+        job._result = dict(bins=[float(i) for i in range(1000)])
+        return harness.time_calls(lambda: jobs.serialize_job(job),
+                                  iterations)
+
+
+def benchmark_resolve_job(app, iterations, resolvers, cached):
+    """Resolve a task name handled by the last of many resolvers."""
+    for i in range(resolvers):
+        app.add_job_resolver(
+            lambda name, i=i: 'jobs.{0}'.format(name)
+            if name.startswith('task{0}_'.format(i)) else None
+        )
+    task_name = 'task{0}_foo'.format(resolvers - 1)
+    if cached:
+        return harness.time_calls(lambda: app.resolve_job(task_name),
+                                  iterations)
+
+    def resolve():
+        app.clear_job_resolver_cache()
+        app.resolve_job(task_name)
+    return harness.time_calls(resolve, iterations)
+
+
+def benchmark_resolve_static_job(app, iterations, resolvers):
+    """Resolve a task name held by the last of many static resolvers."""
+    for i in range(resolvers):
+        app.add_job_resolver(StaticJobResolver(
+            dict(('task{0}_{1}'.format(i, j), 'jobs.foo') for j in range(10))
+        ))
+    task_name = 'task{0}_0'.format(resolvers - 1)
+
+    def resolve():
+        app.clear_job_resolver_cache()
+        app.resolve_job(task_name)
+    return harness.time_calls(resolve, iterations)
+
+
+def deep_default_children(depth):
+    paths = ['level{0}'.format(i) for i in range(depth + 1)]
+    return dict(zip(paths, paths[1:]))
+
+
+def benchmark_default_child_path(app, iterations, depth):
+    """Resolve the deepest default child of a chain of default children."""
+    app.config['DEFAULT_CHILDREN'] = deep_default_children(depth)
+    with app.test_request_context():
+        return harness.time_calls(
+            lambda: catchall.default_child_path('level0'), iterations
+        )
+
+
+def benchmark_route_table(app, iterations, depth):
+    """Look a page up in the route table, as serve_page does."""
+    app.config['DEFAULT_CHILDREN'] = deep_default_children(depth)
+    with app.test_request_context():
+        return harness.time_calls(
+            lambda: catchall.route_table().pages.get('level0'), iterations
+        )
+
+
+def run(iterations=10000, redis_url=None):
+    """Run every micro-benchmark, returning a dictionary of the results."""
+    results = {}
+    with harness.patched_redis(redis_url):
+        results['serialize_job'] = benchmark_serialize_job(
+            harness.create_app(), iterations // 10
+        )
+        for resolvers in (1, 10, 100):
+            results['resolve_job_{0}_resolvers'.format(resolvers)] = \
+                benchmark_resolve_job(harness.create_app(), iterations,
+                                      resolvers, cached=False)
+            results['resolve_job_{0}_static_resolvers'.format(resolvers)] = \
+                benchmark_resolve_static_job(harness.create_app(),
+                                             iterations, resolvers)
+        results['resolve_job_cached'] = benchmark_resolve_job(
+            harness.create_app(), iterations, 100, cached=True
+        )
+        for depth in (1, 10):
+            results['default_child_path_depth_{0}'.format(depth)] = \
+                benchmark_default_child_path(harness.create_app(),
+                                             iterations, depth)
+            results['route_table_depth_{0}'.format(depth)] = \
+                benchmark_route_table(harness.create_app(), iterations,
+                                      depth)
+    return results
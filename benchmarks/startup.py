@@ -0,0 +1,77 @@
+"""startup
+Benchmarks of the time taken to import jobmonitor and create the app.
+
+Each repetition runs in a fresh interpreter, so that nothing is already
+imported, and only the statements being measured are timed, not the start
+of the interpreter itself. The number of modules loaded is reported with
+the timings, as a measure of the memory each server process starts with.
+"""
+import json
+import os
+import subprocess
+import sys
+
+from . import harness
+
+# Repository root, put on the path of the interpreters so that they import
+# this tree's jobmonitor
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Run by each interpreter, with the statements being measured in place of
+# {code}, printing their run time and the number of loaded modules as JSON
+SCRIPT = '''
+import json, sys, time
+start = time.time()
+{code}
+elapsed = time.time() - start
+sys.stdout.write(json.dumps(dict(seconds=elapsed, modules=len(sys.modules))))
+'''
+
+# The first request to a lazy app loads the jobs API, and is answered
+# without touching Redis, as the result format is refused
+FIRST_REQUEST = '''
+app = jobmonitor.create_app(lazy=True)
+app.test_client().get('/jobs/job/result?format=none')
+'''
+
+# Statements timed by each benchmark
+BENCHMARKS = {
+    'startup import': 'import jobmonitor',
+    'startup create_app': 'import jobmonitor; jobmonitor.create_app()',
+    'startup create_app lazy':
+        'import jobmonitor; jobmonitor.create_app(lazy=True)',
+    'startup lazy first request': 'import jobmonitor' + FIRST_REQUEST
+}
+
+
+def measure(code):
+    """Run the code in a new interpreter, returning the seconds it took and
+    the number of modules loaded once it finished."""
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [ROOT] + [p for p in [env.get('PYTHONPATH')] if p]
+    )
+    # The preloaded app would be built on import
+    env.pop('JOBMONITOR_PRELOAD', None)
+    output = subprocess.check_output(
+        [sys.executable, '-c', SCRIPT.format(code=code)], cwd=ROOT, env=env
+    )
+    stats = json.loads(output.decode('utf-8'))
+    return stats['seconds'], stats['modules']
+
+
+def run(repeat=5):
+    """Run each startup benchmark repeat times, returning the median and
+    best times in milliseconds, and the number of loaded modules."""
+    results = {}
+    for name, code in sorted(BENCHMARKS.items()):
+        times = []
+        for _ in range(repeat):
+            seconds, modules = measure(code)
+            times.append(seconds)
+        results[name] = dict(
+            median_ms=harness.percentile(times, 50)*1e3,
+            best_ms=min(times)*1e3,
+            modules=modules
+        )
+    return results
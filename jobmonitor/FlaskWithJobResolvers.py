@@ -1,10 +1,80 @@
+import threading
+
 from flask import Flask
+from werkzeug.utils import import_string
+
+from . import metrics, profiling
+from .lru import LRUCache
+
+try:
+    string_types = (str, unicode)
+except NameError:
+    string_types = (str,)
 
 
 class ExistingJobResolverError(Exception):
     pass
 
 
+class ResolvedJob(object):
+    """A job name along with options for how the job should be run.
+
+    A job resolver can return one of these rather than a job name string, to
+    route the task to a particular queue or give it its own timeout, or to
+    keep its result for longer:
+
+        def reprocessing_resolver(task_name):
+            return ResolvedJob('foo.{0}'.format(task_name), queue='low',
+                               timeout=600, result_ttl=86400)
+
+    Keyword arguments:
+    name -- Dotted import-like path to the method the job runs
+    queue -- Name of the queue to enqueue the job on, or None to let the
+             client choose (default: None)
+    timeout -- Seconds the job may run for, or None for the queue's default
+               (default: None)
+    result_ttl -- Seconds the result of the finished job is kept for, or None
+                  for JOB_RESULT_TTL (default: None)
+    failure_ttl -- Seconds the failed job is kept for, or None for
+                   JOB_FAILURE_TTL (default: None)
+    split -- A jobmonitor.fanout.Split, to run the job as chunks on several
+             workers, or None to run it as a single job (default: None)
+    """
+    def __init__(self, name, queue=None, timeout=None, result_ttl=None,
+                 failure_ttl=None, split=None):
+        self.name = name
+        self.queue = queue
+        self.timeout = timeout
+        self.result_ttl = result_ttl
+        self.failure_ttl = failure_ttl
+        self.split = split
+
+    def __repr__(self):
+        return ('ResolvedJob({0!r}, queue={1!r}, timeout={2!r}, '
+                'result_ttl={3!r}, failure_ttl={4!r}, split={5!r})').format(
+            self.name, self.queue, self.timeout, self.result_ttl,
+            self.failure_ttl, self.split
+        )
+
+
+class StaticJobResolver(object):
+    """A job resolver for a fixed mapping of task names to job names.
+
+    The application looks task names up in the mapping directly, rather than
+    calling the resolver, merging the mappings of consecutively added static
+    resolvers in to a single dictionary.
+    The mapping is copied when the resolver is added to the application, so
+    later changes to it are ignored.
+
+        app.add_job_resolver(StaticJobResolver({'bar': 'foo.bar'}))
+    """
+    def __init__(self, job_names):
+        self.job_names = dict(job_names)
+
+    def __call__(self, name):
+        return self.job_names.get(name)
+
+
 class FlaskWithJobResolvers(Flask):
     """A Flask app that manages the resolution of task names in to job names.
 
@@ -30,6 +100,14 @@ class FlaskWithJobResolvers(Flask):
 
         app.add_job_resolver(module_resolver)
 
+    Resolvers can also be added by their dotted import-like path, or
+    `module:name`, in which case they are only imported when the app first
+    resolves a task name, so that an app doesn't import all of its job
+    modules just to start:
+
+        app.add_job_resolver('foo.resolvers:module_resolver')
+
+    A resolver added by its path is removed by the same path.
     You cannot add the same resolver twice.
     To remove it, do
 
@@ -43,19 +121,99 @@ class FlaskWithJobResolvers(Flask):
     This would return 'foo.bar', if the module_resolver was added to the app.
     Resolvers are interrogated in the order they were added, i.e. the most
     recently added resolver will be called last, the least recent first.
+
+    Resolved names are kept in a least recently used cache of
+    JOB_RESOLVER_CACHE_SIZE task names, which is cleared whenever a resolver
+    is added or removed.
+    If the result of a resolver can change for other reasons, clear the cache
+    with
+
+        app.clear_job_resolver_cache()
+
+    Resolvers can also return a ResolvedJob, giving the queue the job should
+    be enqueued on and its timeout along with the job name.
+    The ResolvedJob of a task is returned by
+
+        app.resolve_job_spec('bar')
+
+    Resolvers can avoid being called at all in two ways.
+    A StaticJobResolver maps a fixed set of task names, and is looked up as a
+    dictionary.
+    A resolver with a `task_prefix` attribute is only called for task names
+    that start with that prefix:
+
+        module_resolver.task_prefix = 'ba'
+
+    Blueprints can be registered lazily, by their import path, so that they
+    and everything they import are only loaded once the app handles its
+    first request:
+
+        app.register_lazy_blueprint('foo.views:bar')
+
+    Calling preload loads all lazy blueprints and resolvers straight away,
+    as for servers building the app once before forking their workers.
     """
     def __init__(self, *args, **kwargs):
         super(FlaskWithJobResolvers, self).__init__(*args, **kwargs)
         self._job_resolvers = []
+        # Resolvers in the order they are interrogated, with consecutive
+        # static resolvers merged in to single dictionaries, or None if
+        # resolvers added by their path have yet to be imported
+        self._job_resolver_chain = []
+        # Map of the paths of imported resolvers to the resolvers
+        self._imported_job_resolvers = {}
+        # Created on first use, once the configuration has been loaded
+        self._job_name_cache = None
+        # List of (import path, options) tuples of the blueprints to register
+        # on the first request
+        self._lazy_blueprints = []
+        # Set once all lazy blueprints have been registered
+        self._lazy_blueprints_loaded = True
+        # Held while importing lazy blueprints and resolvers
+        self._lazy_lock = threading.Lock()
+        profiling.init_app(self)
+
+    def register_lazy_blueprint(self, import_name, **options):
+        """Register the blueprint at the import path, such as
+        `foo.views:bar`, with the options of register_blueprint, when the app
+        handles its first request."""
+        with self._lazy_lock:
+            self._lazy_blueprints.append((import_name, options))
+            self._lazy_blueprints_loaded = False
+
+    def load_lazy_blueprints(self):
+        """Import and register the lazy blueprints, if any are left.
+
+        Requests arriving meanwhile wait for the registration to finish, and
+        a blueprint failing to import is tried again by the next request.
+        """
+        with self._lazy_lock:
+            while self._lazy_blueprints:
+                import_name, options = self._lazy_blueprints[0]
+                self.register_blueprint(import_string(import_name), **options)
+                self._lazy_blueprints.pop(0)
+            self._lazy_blueprints_loaded = True
+
+    def request_context(self, environ):
+        # Blueprints must be registered before the request's URL is matched
+        if not self._lazy_blueprints_loaded:
+            self.load_lazy_blueprints()
+        return super(FlaskWithJobResolvers, self).request_context(environ)
+
+    def preload(self):
+        """Load the lazy blueprints and the resolvers added by their path
+        now, rather than on first use."""
+        self.load_lazy_blueprints()
+        self._job_resolver_chain_or_load()
 
     def job_resolvers(self):
-        return self._job_resolvers
+        return list(self._job_resolvers)
 
     def add_job_resolver(self, job_resolver):
-        for r in self.job_resolvers():
-            if job_resolver == r:
-                raise ExistingJobResolverError
+        if job_resolver in self._job_resolvers:
+            raise ExistingJobResolverError
         self._job_resolvers.append(job_resolver)
+        self._job_resolvers_changed()
 
     def remove_job_resolver(self, job_resolver):
         """Remove job_resolver from the list of job resolvers.
@@ -63,9 +221,67 @@ class FlaskWithJobResolvers(Flask):
         Keyword arguments:
         job_resolver -- Function reference of the job resolver to be removed.
         """
-        for i, r in enumerate(self.job_resolvers()):
-            if job_resolver == r:
-                del self._job_resolvers[i]
+        self._job_resolvers = [
+            r for r in self._job_resolvers if r != job_resolver
+        ]
+        self._job_resolvers_changed()
+
+    def _job_resolvers_changed(self):
+        """Rebuild the resolver chain and clear the cache.
+
+        If a resolver added by its path has not been imported, the chain is
+        built once it is, by _job_resolver_chain_or_load.
+        """
+        self.clear_job_resolver_cache()
+        if any(isinstance(r, string_types) and
+               r not in self._imported_job_resolvers
+               for r in self._job_resolvers):
+            self._job_resolver_chain = None
+            return
+        chain = []
+        for r in self._job_resolvers:
+            if isinstance(r, string_types):
+                r = self._imported_job_resolvers[r]
+            if not isinstance(r, StaticJobResolver):
+                chain.append(r)
+            elif chain and isinstance(chain[-1], dict):
+                # Earlier resolvers take precedence
+                for task_name, job_name in r.job_names.items():
+                    chain[-1].setdefault(task_name, job_name)
+            else:
+                chain.append(dict(r.job_names))
+        self._job_resolver_chain = chain
+
+    def _job_resolver_chain_or_load(self):
+        """Return the resolver chain, importing the resolvers added by their
+        path first if it has yet to be built."""
+        chain = self._job_resolver_chain
+        if chain is not None:
+            return chain
+        with self._lazy_lock:
+            for r in self._job_resolvers:
+                if isinstance(r, string_types) and \
+                        r not in self._imported_job_resolvers:
+                    self._imported_job_resolvers[r] = import_string(r)
+            self._job_resolvers_changed()
+            return self._job_resolver_chain
+
+    def _job_names(self):
+        """Return the cache of task names to job names."""
+        if self._job_name_cache is None:
+            self._job_name_cache = LRUCache(
+                self.config.get('JOB_RESOLVER_CACHE_SIZE', 1024)
+            )
+        return self._job_name_cache
+
+    def clear_job_resolver_cache(self):
+        """Forget all cached task name resolutions."""
+        if self._job_name_cache is not None:
+            self._job_name_cache.clear()
+
+    def job_resolver_stats(self):
+        """Return the size, hits, and misses of the resolution cache."""
+        return self._job_names().stats()
 
     def resolve_job(self, name):
         """Attempt to resolve the task name in to a job name.
@@ -76,8 +292,40 @@ class FlaskWithJobResolvers(Flask):
         Keyword arguments:
         name -- Name of the task to be resolved.
         """
-        for r in self.job_resolvers():
-            resolved_name = r(name)
-            if resolved_name is not None:
-                return resolved_name
+        resolved = self.resolve_job_spec(name)
+        return None if resolved is None else resolved.name
+
+    def resolve_job_spec(self, name):
+        """Attempt to resolve the task name in to a ResolvedJob.
+
+        Resolvers returning a job name string give a ResolvedJob with the
+        default options.
+        If no job resolver can resolve the task, return None.
+        Unresolved task names are not cached.
+
+        Keyword arguments:
+        name -- Name of the task to be resolved.
+        """
+        with metrics.JOB_RESOLUTION_DURATION.time(), \
+                profiling.section('resolve_job'):
+            return self._resolve_job_spec(name)
+
+    def _resolve_job_spec(self, name):
+        cache = self._job_names()
+        resolved = cache.get(name)
+        if resolved is not None:
+            return resolved
+        for r in self._job_resolver_chain_or_load():
+            if isinstance(r, dict):
+                resolved = r.get(name)
+            else:
+                prefix = getattr(r, 'task_prefix', None)
+                if prefix is not None and not name.startswith(prefix):
+                    continue
+                resolved = r(name)
+            if resolved is not None:
+                if not isinstance(resolved, ResolvedJob):
+                    resolved = ResolvedJob(resolved)
+                cache.set(name, resolved)
+                return resolved
         return None
@@ -1,19 +1,65 @@
-from jobmonitor import FlaskWithJobResolvers
+import os
 
+# Set in the environment to build the app served by wsgi when this package is
+# imported, as by `gunicorn --preload jobmonitor:wsgi`
+PRELOAD_ENVIRONMENT_VARIABLE = 'JOBMONITOR_PRELOAD'
+
+# The app served by wsgi, built on first use or by preload
+_app = None
+
+
+def create_app(lazy=False):
+    """Return a new jobmonitor app.
+
+    If lazy is True, the jobs API, and with it rq and redis, is only imported
+    once the app handles its first request, so that the app is quick to
+    create.
+    """
+    # Imported here, so that workers importing this package don't load Flask
+    from .FlaskWithJobResolvers import FlaskWithJobResolvers
 
-def create_app():
     # Define the app and load its configuration from config.py
-    app = FlaskWithJobResolvers.FlaskWithJobResolvers(__name__)
+    app = FlaskWithJobResolvers(__name__)
     app.config.from_object('jobmonitor.config')
 
     # Add jobs API and generic views
     from .catchall import catchall
-    from .jobs import jobs
+    from .metrics import metrics
     app.register_blueprint(catchall)
-    app.register_blueprint(jobs)
+    if lazy:
+        app.register_lazy_blueprint('jobmonitor.jobs:jobs')
+    else:
+        from .jobs import jobs
+        app.register_blueprint(jobs)
+    app.register_blueprint(metrics)
+
+    return app
+
+
+def preload(app=None):
+    """Make the app, else a new jobmonitor app, the one served by wsgi, with
+    everything it would load on first use loaded now, and return it.
 
+    Servers calling this before forking their workers, such as gunicorn with
+    --preload, build the app once, and the workers share it copy-on-write.
+    Redis connections are only opened by the workers, on first use.
+    """
+    global _app
+    if app is None:
+        app = create_app()
+    app.preload()
+    _app = app
     return app
 
 
 def wsgi(*args, **kwargs):
-    return create_app()(*args, **kwargs)
+    """Serve the request with the app made by preload, else with a lazy
+    jobmonitor app created on the first request."""
+    global _app
+    if _app is None:
+        _app = create_app(lazy=True)
+    return _app(*args, **kwargs)
+
+
+if os.getenv(PRELOAD_ENVIRONMENT_VARIABLE):
+    preload()
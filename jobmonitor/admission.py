@@ -0,0 +1,166 @@
+"""admission
+Admission control of job submissions.
+
+Every submission to POST /jobs and POST /jobs/batch is checked against the
+configured limits, in a single Redis transaction per shard, before any job
+is enqueued:
+
+- CLIENT_RATE_LIMIT: jobs each client may submit per RATE_LIMIT_PERIOD
+  seconds;
+- TASK_RATE_LIMIT: jobs of each job name that may be submitted per
+  RATE_LIMIT_PERIOD seconds, by all clients together;
+- QUEUE_DEPTH_MAX: jobs a queue may hold;
+- CLIENT_INFLIGHT_MAX: jobs each client may have queued or running.
+
+A limit of None is not checked, and with no limits set, submissions cost no
+Redis commands at all. Rejected submissions get a 429 response with a
+Retry-After header, and do not count towards the rates.
+
+Rates are token buckets refilled all at once at the start of each period,
+i.e. counters of the jobs submitted in fixed windows of RATE_LIMIT_PERIOD
+seconds, so each check is a couple of commands in the transaction.
+The rates are counted on the primary shard, whereas queues and the pending
+jobs of clients are spread over all shards, as described in
+jobmonitor.sharding, so their counts are summed over the shards.
+Clients are identified by their address, or behind proxies by the
+CLIENT_ID_HEADER of their requests, such as X-Forwarded-For. As clients can
+send the header themselves, the address used is the one added by the
+CLIENT_ID_PROXIES trusted proxies in front of the app, counting from the
+right, and the header must only be one that those proxies set.
+"""
+import math
+import time
+
+import rq
+
+from . import start_worker
+
+# Prefix of the keys counting the jobs submitted in each window
+RATE_PREFIX = 'jobmonitor:rate:'
+
+# Seconds a job counts as in flight for, should its worker never finish it
+INFLIGHT_TTL = 24 * 60 * 60
+
+
+def client_id(request, header=None, proxies=1):
+    """Return the ID of the client making the request.
+
+    This is the address added to the header by the outermost of the trusted
+    proxies, the address proxies from the right of the header, if the header
+    is given and holds that many addresses, else the remote address of the
+    request. Addresses further left are sent by the client, so can't be
+    trusted, as with werkzeug's ProxyFix.
+    """
+    if header is not None and proxies > 0:
+        value = request.headers.get(header)
+        if value:
+            addresses = [a.strip() for a in value.split(',')]
+            if len(addresses) >= proxies and addresses[-proxies]:
+                return addresses[-proxies]
+    return request.remote_addr or 'unknown'
+
+
+def rate_key(kind, name, window):
+    """Return the key counting the jobs submitted by the client, or of the
+    job name, in the window."""
+    return '{0}{1}:{2}:{3}'.format(RATE_PREFIX, kind, name, window)
+
+
+def check(shards, config, client, calls, now=None):
+    """Return None if the client may submit the calls, else a (reason,
+    message, retry after) tuple.
+
+    Admitted calls are counted against the rate limits of the client and of
+    their job names.
+
+    Keyword arguments:
+    shards -- sharding.Shards the queues and jobs are stored in
+    config -- Application configuration holding the limits
+    client -- ID of the client, as from client_id
+    calls -- List of (ResolvedJob, keyword arguments dictionary) tuples
+    now -- Current time, in seconds since the epoch (default: time.time())
+    """
+    if now is None:
+        now = time.time()
+    period = config['RATE_LIMIT_PERIOD']
+    window = int(now // period)
+    window_retry = int(math.ceil(period - now % period))
+    retry = config['ADMISSION_RETRY_AFTER']
+    # Number of calls per job name and per queue
+    names = {}
+    queues = {}
+    for resolved, _ in calls:
+        names[resolved.name] = names.get(resolved.name, 0) + 1
+        queues[resolved.queue] = queues.get(resolved.queue, 0) + 1
+    pipelines = shards.pipelines(transaction=True)
+    # Checks in the order of their commands, each a (replies, limit, amount,
+    # reason, message, retry after, rate key) tuple, where replies is a list
+    # of (shard index, reply index) tuples, and the sum of the replies is the
+    # count after the rate key was incremented by amount, or the count
+    # before the amount is added, for counts that are only read
+    checks = []
+    # Number of commands in the pipeline of each shard
+    counts = [0] * len(shards)
+    limit = config['CLIENT_RATE_LIMIT']
+    if limit is not None:
+        key = rate_key('client', client, window)
+        pipelines.primary.incr(key, len(calls))
+        pipelines.primary.expire(key, period)
+        checks.append(([(0, counts[0])], limit, len(calls), 'client_rate',
+                       'At most {0} jobs can be submitted every {1} '
+                       'seconds'.format(limit, period), window_retry, key))
+        counts[0] += 2
+    limit = config['TASK_RATE_LIMIT']
+    if limit is not None:
+        for name, n in sorted(names.items()):
+            key = rate_key('task', name, window)
+            pipelines.primary.incr(key, n)
+            pipelines.primary.expire(key, period)
+            checks.append(([(0, counts[0])], limit, n, 'task_rate',
+                           'Job `{0}` is submitted too often'.format(name),
+                           window_retry, key))
+            counts[0] += 2
+    limit = config['QUEUE_DEPTH_MAX']
+    if limit is not None:
+        for name, n in sorted(queues.items()):
+            replies = []
+            for index in range(len(shards)):
+                pipelines.on(index).llen(
+                    rq.Queue.redis_queue_namespace_prefix + name
+                )
+                replies.append((index, counts[index]))
+                counts[index] += 1
+            checks.append((replies, limit, n, 'queue_depth',
+                           'Queue `{0}` is full'.format(name), retry, None))
+    limit = config['CLIENT_INFLIGHT_MAX']
+    if limit is not None:
+        key = start_worker.inflight_key(client)
+        replies = []
+        for index in range(len(shards)):
+            pipelines.on(index).zremrangebyscore(key, '-inf',
+                                                 now - INFLIGHT_TTL)
+            pipelines.on(index).zcard(key)
+            replies.append((index, counts[index] + 1))
+            counts[index] += 2
+        checks.append((replies, limit, len(calls), 'client_inflight',
+                       'At most {0} jobs can be pending at once'.format(limit),
+                       retry, None))
+    if not checks:
+        return None
+    shard_replies = [list(replies) for replies in pipelines.execute()]
+    rejection = None
+    for replies, limit, amount, reason, message, retry_after, key in checks:
+        count = sum(shard_replies[index][i] for index, i in replies)
+        if key is None:
+            count += amount
+        if count > limit:
+            rejection = (reason, message, retry_after)
+            break
+    if rejection is not None:
+        # Rejected calls don't use up the rates
+        pipeline = shards.primary.pipeline()
+        for _, _, amount, _, _, _, key in checks:
+            if key is not None:
+                pipeline.decr(key, amount)
+        pipeline.execute()
+    return rejection
@@ -0,0 +1,252 @@
+"""assets
+Fingerprinted, precompressed copies of static assets.
+
+Every file in a source directory is copied to a build directory under a name
+containing a hash of its content, such as
+
+    javascripts/lib/d3.min.js -> javascripts/lib/d3.min.0123456789ab.js
+
+so that the copy never changes, and can be cached by browsers forever.
+Text files are also written gzip-compressed, with a `.gz` suffix, and brotli
+compressed, with a `.br` suffix, if the brotli package is installed, so that
+they need not be compressed on each request.
+The build directory is content-addressed, so building again only writes the
+files that changed.
+
+The catchall blueprint builds the assets in ASSETS_DIRECTORY when the app
+starts, in to a temporary directory that is removed when the process exits,
+unless ASSETS_BUILD_DIRECTORY is set. Each server process not forked from
+one that built the assets then writes a copy of its own, so to build them
+once, ahead of time, for example during a deployment, run
+
+    python -m jobmonitor.assets BUILD_DIRECTORY
+
+and set ASSETS_BUILD_DIRECTORY to BUILD_DIRECTORY.
+"""
+import atexit
+import hashlib
+import json
+import optparse
+import os
+import shutil
+import sys
+import tempfile
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Name of the file in the build directory mapping source to built files
+MANIFEST_NAME = 'manifest.json'
+
+# Files with these extensions are worth compressing
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.json', '.map', '.svg', '.html',
+                           '.txt', '.ico')
+
+# Content encodings of the compressed variants, in order of preference, and
+# the suffixes of their files
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# Assets built by get_assets, keyed by source and build directory
+_assets = {}
+
+
+def _gzip(data):
+    # zlib leaves the mtime of the gzip header zero, so the output depends
+    # only on the input, and unlike GzipFile(mtime=0) it works on Python 2.6
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _compressors(use_brotli):
+    compressors = {'gzip': _gzip}
+    if use_brotli and brotli is not None:
+        compressors['br'] = brotli.compress
+    return compressors
+
+
+def fingerprint(path, data):
+    """Return path with a hash of data inserted before the extension."""
+    root, ext = os.path.splitext(path)
+    return '{0}.{1}{2}'.format(root, hashlib.md5(data).hexdigest()[:12], ext)
+
+
+def _write(path, data):
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    # Write to a temporary file first, so that other processes building the
+    # same directory never see a partial file
+    fd, temporary = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.chmod(temporary, 0o644)
+    os.rename(temporary, path)
+
+
+def source_stamp(source, exclude=()):
+    """Return a value that changes whenever a file in source, outside of
+    the exclude directories, is added, removed, or modified."""
+    source = os.path.abspath(source)
+    exclude = set(os.path.abspath(d) for d in exclude)
+    stamp = []
+    for dirpath, dirnames, filenames in os.walk(source):
+        dirnames[:] = [d for d in dirnames
+                       if os.path.join(dirpath, d) not in exclude]
+        for name in filenames:
+            st = os.stat(os.path.join(dirpath, name))
+            stamp.append((dirpath, name, st.st_mtime, st.st_size))
+    return hash(tuple(sorted(stamp)))
+
+
+def _remove_build_directory(directory, pid):
+    # Processes forked from the one that built the assets share them, so
+    # leave them to that process
+    if os.getpid() == pid:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def build(source, destination, exclude=(), use_brotli=True):
+    """Build the fingerprinted and compressed assets, returning the manifest.
+
+    The manifest maps the path of each file relative to source, with forward
+    slashes, to a dictionary with the `path` of its fingerprinted copy,
+    relative to destination, and the list of `encodings` it has compressed
+    variants for.
+    It is also written to MANIFEST_NAME in destination.
+    Keyword arguments:
+    source -- Directory holding the assets
+    destination -- Directory to write the built assets to
+    exclude -- Directories inside source to skip
+    use_brotli -- Write brotli variants, if the brotli package is installed
+    """
+    source = os.path.abspath(source)
+    exclude = set(os.path.abspath(d) for d in exclude)
+    compressors = _compressors(use_brotli)
+    manifest = {}
+    for dirpath, dirnames, filenames in os.walk(source):
+        dirnames[:] = [d for d in dirnames
+                       if os.path.join(dirpath, d) not in exclude]
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            with open(path, 'rb') as f:
+                data = f.read()
+            logical = os.path.relpath(path, source).replace(os.sep, '/')
+            built = fingerprint(logical, data)
+            target = os.path.join(destination, *built.split('/'))
+            encodings = []
+            if os.path.splitext(name)[1] in COMPRESSIBLE_EXTENSIONS:
+                encodings = [e for e, _ in ENCODINGS if e in compressors]
+            if not os.path.exists(target):
+                _write(target, data)
+            for encoding, suffix in ENCODINGS:
+                if encoding in encodings and \
+                        not os.path.exists(target + suffix):
+                    _write(target + suffix, compressors[encoding](data))
+            manifest[logical] = dict(path=built, encodings=encodings)
+    _write(os.path.join(destination, MANIFEST_NAME),
+           json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+    return manifest
+
+
+class Assets(object):
+    """Built assets, looked up by their source path or built path."""
+    def __init__(self, source, destination, manifest, stamp=None):
+        self.source = os.path.abspath(source)
+        self.destination = destination
+        self.manifest = manifest
+        # The source_stamp of the source when the assets were built
+        self.stamp = stamp
+        # Changes whenever any asset does
+        self.version = hashlib.md5(
+            json.dumps(manifest, sort_keys=True).encode('utf-8')
+        ).hexdigest()
+        # Map of built paths to their encodings
+        self.built = dict(
+            (entry['path'], entry['encodings']) for entry in manifest.values()
+        )
+
+    def built_path(self, path):
+        """Return the fingerprinted path of the source path, or None."""
+        entry = self.manifest.get(path)
+        return entry['path'] if entry is not None else None
+
+    def variant(self, built_path, accept_encodings):
+        """Return the file to send for the built path, and its encoding.
+
+        The first encoding in ENCODINGS the client accepts is chosen, else
+        the uncompressed file is sent with an encoding of None.
+        Raise KeyError if the built path is unknown.
+        Keyword arguments:
+        built_path -- Fingerprinted path, as from built_path
+        accept_encodings -- Accept-Encoding header, parsed by werkzeug
+        """
+        encodings = self.built[built_path]
+        filename = os.path.join(self.destination, *built_path.split('/'))
+        for encoding, suffix in ENCODINGS:
+            if encoding in encodings and accept_encodings[encoding] > 0:
+                return filename + suffix, encoding
+        return filename, None
+
+    def has_variants(self, built_path):
+        """Return True if the built path has compressed variants."""
+        return bool(self.built.get(built_path))
+
+
+def get_assets(source, destination=None, exclude=(), use_brotli=True,
+               rebuild=False):
+    """Return the Assets built from source in to destination.
+
+    The assets are built on the first call for a given source and
+    destination, and the same instance returned on subsequent calls, unless
+    rebuild is True and a file in source has changed since, as by
+    source_stamp.
+    If destination is None, a temporary directory is used, which is removed
+    when the process exits.
+    """
+    key = (os.path.abspath(source), destination)
+    assets = _assets.get(key)
+    stamp = None
+    if assets is not None and rebuild:
+        stamp = source_stamp(source, exclude)
+        if stamp == assets.stamp:
+            return assets
+    if assets is None or rebuild:
+        if stamp is None:
+            stamp = source_stamp(source, exclude)
+        if assets is not None:
+            build_directory = assets.destination
+        elif destination is None:
+            build_directory = tempfile.mkdtemp(prefix='jobmonitor-assets-')
+            atexit.register(_remove_build_directory, build_directory,
+                            os.getpid())
+        else:
+            build_directory = destination
+        manifest = build(source, build_directory, exclude, use_brotli)
+        assets = Assets(source, build_directory, manifest, stamp)
+        _assets[key] = assets
+    return assets
+
+
+def main(argv=None):
+    """Build the assets in the jobmonitor static directory."""
+    from . import config
+    parser = optparse.OptionParser(usage='%prog [options] BUILD_DIRECTORY')
+    parser.add_option('--source', default=config.ASSETS_DIRECTORY,
+                      help='directory of assets to build (default: %default)')
+    parser.add_option('--no-brotli', dest='brotli', action='store_false',
+                      default=True, help='do not write brotli variants')
+    options, args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    if len(args) != 1:
+        parser.error('A single build directory is required')
+    exclude = []
+    if options.source == config.ASSETS_DIRECTORY:
+        exclude.append(config.FILES_DIRECTORY)
+    manifest = build(options.source, args[0], exclude, options.brotli)
+    print('Built {0} assets in {1}'.format(len(manifest), args[0]))
+
+
+if __name__ == '__main__':
+    main()
@@ -9,46 +9,381 @@ from flask import (
     # Set and access variables global to the app instance and views
     g,
     # Raise HTTP error code exceptions
-    abort
+    abort,
+    # The request context
+    request,
+    # Check whether there is a request, for calls made outside of one
+    has_request_context,
+    # Build responses from rendered templates
+    make_response,
+    # Send built asset files
+    send_file,
+    # Generate URLs
+    url_for
 )
+import collections
+import datetime
+import hashlib
+import mimetypes
+import os
 # So we can catch Jinja2 exception
 from jinja2.exceptions import TemplateNotFound
+# Find the templates a template extends, includes, and imports
+from jinja2 import meta
+from . import assets
+from .lru import LRUCache
 
 catchall = Blueprint('catchall', __name__,
                      template_folder='templates', static_folder='static')
 
+# Prefix of the Redis keys holding rendered pages, when PAGE_CACHE_REDIS is on
+PAGE_CACHE_PREFIX = 'jobmonitor:page:'
+
+# A rendered page, with the validators sent with it
+CachedPage = collections.namedtuple('CachedPage',
+                                    ['body', 'etag', 'last_modified'])
+
+
+class DefaultChildCycleError(ValueError):
+    """Raised when following DEFAULT_CHILDREN from a path leads back to it."""
+    pass
+
+
+def resolve_default_children(default_children):
+    """Return a dictionary mapping each parent path to its deepest default
+    child path.
+
+    As an example, if the path `parent` should show the page `parent/child`
+    by default, and `parent/child` should show `parent/child/grandchild`,
+    both `parent` and `parent/child` map to `parent/child/grandchild`.
+    Raise DefaultChildCycleError if a chain of default children is circular.
+    Keyword arguments:
+    default_children -- Mapping of parent paths to their default children
+    """
+    resolved = {}
+    for path in default_children:
+        chain = [path]
+        seen = set(chain)
+        child = path
+        while child in default_children:
+            child = default_children[child]
+            if child in resolved:
+                child = resolved[child]
+                break
+            if child in seen:
+                raise DefaultChildCycleError(
+                    'Default child paths form a cycle: {0}'.format(
+                        ' -> '.join(chain + [child])
+                    )
+                )
+            chain.append(child)
+            seen.add(child)
+        for parent in chain:
+            if parent in default_children:
+                resolved[parent] = child
+    return resolved
+
+
+def list_page_templates(app):
+    """Return the names of all templates the app can render as pages."""
+    return [t for t in app.jinja_env.list_templates() if t.endswith('.html')]
+
+
+class RouteTable(object):
+    """Map of every servable path to the page it shows.
+
+    A path is servable if it, or its deepest default child, has a
+    `<path>.html` template, so serving a page takes a single lookup, and
+    paths without a page are rejected without searching for a template.
+    """
+    def __init__(self, default_children, templates, page_cache_size=0):
+        # Keep a copy of the configuration the table was built from, to
+        # detect changes, including those made in place
+        self.default_children = dict(default_children)
+        # Rendered pages, keyed by template name and template versions
+        self.page_cache = LRUCache(page_cache_size)
+        # File names of the templates each page is rendered from
+        self.template_files = {}
+        pages = set(t[:-len('.html')] for t in templates)
+        self.pages = dict((page, page) for page in pages)
+        for parent, child in resolve_default_children(
+                default_children).items():
+            if child in pages:
+                self.pages[parent] = child
+            else:
+                self.pages.pop(parent, None)
+
+
+def route_table():
+    """Return the app's RouteTable, building it on first use.
+
+    The table is rebuilt if DEFAULT_CHILDREN changes in the config, whether
+    it is replaced or edited in place, and on every request in debug mode,
+    so that new templates are picked up.
+    """
+    app = current_app._get_current_object()
+    table = getattr(app, 'route_table', None)
+    default_children = app.config['DEFAULT_CHILDREN']
+    if (table is None or app.debug or
+            table.default_children != default_children):
+        table = RouteTable(default_children, list_page_templates(app),
+                           app.config['PAGE_CACHE_SIZE'])
+        app.route_table = table
+    return table
+
 
 def default_child_path(path):
-    """Return the default child of the parent path ,if it exists, else path.
+    """Return the default child of the parent path, if it exists, else path.
 
     As an example, if the path `parent` show show the page `parent/child` by
     default, this method will return `parent/child` given `parent`.
     If `parent/child` should show `parent/child/grandchild` by default,
     this method will return `parent/child/grandchild` given `parent`.
-    If no default child path exists, then `path` is returned.
+    If no default child path exists, or it has no page, then `path` is
+    returned.
     Keyword arguments:
     path -- The parent path to resolve in to its deepest default child path.
     """
+    return route_table().pages.get(path, path)
+
+
+def template_files(env, name, seen=None):
+    """Return the file names of the template and of every template it
+    extends, includes, or imports."""
+    if seen is None:
+        seen = set()
+    seen.add(name)
+    source, filename, _ = env.loader.get_source(env, name)
+    files = [filename]
+    for ref in meta.find_referenced_templates(env.parse(source)):
+        # Templates chosen at render time can't be found, and are not tracked
+        if ref is not None and ref not in seen:
+            files.extend(template_files(env, ref, seen))
+    return files
+
+
+def template_versions(files):
+    """Return the modification times of the template files."""
+    versions = []
+    for filename in files:
+        try:
+            versions.append(os.path.getmtime(filename))
+        except (OSError, TypeError):
+            versions.append(None)
+    return tuple(versions)
+
+
+def page_cache_enabled():
+    return current_app.config['PAGE_CACHE'] and not current_app.debug
+
+
+def cached_page(template):
+    """Return the rendered template as a CachedPage, from the page cache if
+    possible.
+
+    Pages are cached in the RouteTable, and in Redis for PAGE_CACHE_TTL
+    seconds if PAGE_CACHE_REDIS is True, keyed by the template name and the
+    modification times of the files it is rendered from, so that a page is
+    rendered again once Jinja would reload one of its templates.
+    The key also includes the version of the fingerprinted assets, whose
+    URLs the page holds.
+    Pages must only depend on the template and g.active_page, which the
+    template name determines.
+    """
+    app = current_app._get_current_object()
+    table = route_table()
+    use_redis = app.config['PAGE_CACHE_REDIS'] and hasattr(app, 'redis')
+    built = static_assets()
+    assets_version = built.version if built is not None else None
+    files = table.template_files.get(template)
+    if files is not None:
+        key = (template, template_versions(files), assets_version)
+        page = table.page_cache.get(key)
+        if page is not None:
+            return page
+        if use_redis:
+            page = fetch_cached_page(app.redis, key)
+            if page is not None:
+                table.page_cache.set(key, page)
+                return page
+    # The templates may have changed, so find their files again
+    files = template_files(app.jinja_env, template)
+    table.template_files[template] = files
+    key = (template, template_versions(files), assets_version)
+    body = render_template(template)
+    page = CachedPage(
+        body,
+        hashlib.sha1(body.encode('utf-8')).hexdigest(),
+        datetime.datetime.utcnow().replace(microsecond=0)
+    )
+    table.page_cache.set(key, page)
+    if use_redis:
+        store_cached_page(app.redis, key, page,
+                          app.config['PAGE_CACHE_TTL'])
+    return page
+
+
+def page_cache_key(key):
+    """Return the Redis key of the page cache key."""
+    return PAGE_CACHE_PREFIX + hashlib.sha1(
+        repr(key).encode('utf-8')
+    ).hexdigest()
+
+
+def fetch_cached_page(connection, key):
+    """Return the CachedPage stored in Redis under the key, or None."""
+    body, etag, last_modified = connection.hmget(
+        page_cache_key(key), ['body', 'etag', 'last_modified']
+    )
+    if body is None:
+        return None
+    return CachedPage(
+        body.decode('utf-8'),
+        etag.decode('utf-8'),
+        datetime.datetime.utcfromtimestamp(int(last_modified))
+    )
+
+
+def store_cached_page(connection, key, page, ttl):
+    """Store the CachedPage in Redis under the key for ttl seconds."""
+    epoch = datetime.datetime(1970, 1, 1)
+    redis_key = page_cache_key(key)
+    pipeline = connection.pipeline()
+    pipeline.hmset(redis_key, dict(
+        body=page.body.encode('utf-8'),
+        etag=page.etag,
+        last_modified=int((page.last_modified - epoch).total_seconds())
+    ))
+    pipeline.expire(redis_key, ttl)
+    pipeline.execute()
+
+
+def cached_response(template):
+    """Return a response with the cached page, and its ETag and
+    Last-Modified validators."""
+    page = cached_page(template)
+    response = make_response(page.body)
+    response.set_etag(page.etag)
+    response.last_modified = page.last_modified
+    # Browsers must check the page is unchanged before showing a cached copy
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def static_assets(app=None):
+    """Return the Assets built from ASSETS_DIRECTORY, or None if
+    ASSETS_FINGERPRINT is False.
+
+    In debug mode the assets are checked for changes on the first call of
+    each request, and built again if any changed, so that changes are
+    picked up.
+    """
+    if app is None:
+        app = current_app._get_current_object()
+    config = app.config
+    if not config['ASSETS_FINGERPRINT']:
+        return None
+    rebuild = False
+    if app.debug and has_request_context() and \
+            not getattr(g, 'assets_checked', False):
+        g.assets_checked = rebuild = True
+    return assets.get_assets(
+        config['ASSETS_DIRECTORY'],
+        config['ASSETS_BUILD_DIRECTORY'],
+        exclude=[config['FILES_DIRECTORY']],
+        use_brotli=config['ASSETS_BROTLI'],
+        rebuild=rebuild
+    )
+
+
+@catchall.app_template_global()
+def asset_url(filename, blueprint=None):
+    """Return the URL of the static file.
+
+    Files in ASSETS_DIRECTORY are served fingerprinted by serve_asset, and
+    others by the static endpoint, as url_for would.
+    Keyword arguments:
+    filename -- Path of the file in the static folder
+    blueprint -- Name of the blueprint whose static folder holds the file,
+                 an empty string for the current blueprint, which is the app
+                 if the request has none, or None for the app (default: None)
+    """
+    if blueprint is None:
+        endpoint = 'static'
+        name = None
+    else:
+        name = blueprint or request.blueprint
+        # Like url_for('.static'), fall back to the app's static folder
+        endpoint = 'static' if name is None else '{0}.static'.format(name)
+    built = static_assets()
+    if built is not None:
+        if name is None:
+            folder = current_app.static_folder
+        else:
+            folder = current_app.blueprints[name].static_folder
+        if os.path.abspath(folder) == built.source:
+            built_path = built.built_path(filename)
+            if built_path is not None:
+                return url_for('catchall.serve_asset', filename=built_path)
+    return url_for(endpoint, filename=filename)
+
+
+@catchall.record_once
+def check_default_children(state):
+    """Fail at startup, rather than on a request, if DEFAULT_CHILDREN is
+    circular."""
+    resolve_default_children(state.app.config['DEFAULT_CHILDREN'])
+
+
+@catchall.record_once
+def build_assets(state):
+    """Build the fingerprinted assets before the first request."""
+    static_assets(state.app)
+
+
+@catchall.route('/assets/<path:filename>')
+def serve_asset(filename):
+    """Send the fingerprinted asset, compressed if the client accepts it.
+
+    Fingerprinted files never change, so browsers may cache them for
+    ASSETS_MAX_AGE seconds without checking for updates.
+    """
+    built = static_assets()
+    if built is None:
+        abort(404)
     try:
-        # Recurse until we find a path with no default child
-        child_path = default_child_path(
-            current_app.config['DEFAULT_CHILDREN'][path]
-        )
+        path, encoding = built.variant(filename, request.accept_encodings)
     except KeyError:
-        child_path = path
-    return child_path
+        abort(404)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    response = send_file(path, mimetype=mimetype, conditional=True)
+    response.headers['Cache-Control'] = (
+        'public, max-age={0}, immutable'.format(
+            current_app.config['ASSETS_MAX_AGE']
+        )
+    )
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    if built.has_variants(filename):
+        response.headers['Vary'] = 'Accept-Encoding'
+    return response
 
 
 @catchall.route('/', defaults={'path': ''})
 @catchall.route('/<path:path>')
 def serve_page(path):
-    # Find the default child page
-    child_path = default_child_path(path)
+    # Find the default child page, 404'ing if there is no template for it
+    child_path = route_table().pages.get(path)
+    if child_path is None:
+        abort(404)
     # Expose the child path value
     g.active_page = child_path
-    # Try find a template called path.html, else 404
+    # The template may have been removed since the table was built
     try:
-        return render_template('{0}.html'.format(child_path))
+        template = '{0}.html'.format(child_path)
+        if page_cache_enabled():
+            return cached_response(template).make_conditional(request)
+        return render_template(template)
     except TemplateNotFound:
         abort(404)
 
@@ -57,4 +392,6 @@ def serve_page(path):
 @catchall.errorhandler(404)
 def page_not_found(e):
     g.active_page = '404'
+    if page_cache_enabled():
+        return cached_response('errors/404.html'), 404
     return render_template('errors/404.html'), 404
@@ -17,9 +17,154 @@ ASSETS_DIRECTORY = '{0}/static'.format(
 # Where ROOT files are stored
 FILES_DIRECTORY = '{0}/files'.format(ASSETS_DIRECTORY)
 
+# Serve the assets in ASSETS_DIRECTORY, other than FILES_DIRECTORY, under
+# content-hashed names, precompressed, and cached by browsers indefinitely?
+ASSETS_FINGERPRINT = True
+# Where the fingerprinted assets are built, None uses a temporary directory
+# per server process, removed when the process exits
+# Build them ahead of time with `python -m jobmonitor.assets DIRECTORY`
+ASSETS_BUILD_DIRECTORY = None
+# Also build brotli compressed assets, if the brotli package is installed?
+ASSETS_BROTLI = True
+# Seconds browsers may cache fingerprinted assets for
+ASSETS_MAX_AGE = 365 * 24 * 60 * 60
+
 # Mappings of parent paths to their default children
 DEFAULT_CHILDREN = {
     '': 'examples',
     'examples': 'examples/table',
     'examples/tabs': 'examples/tabs/tab1'
 }
+
+# Cache rendered pages, which must then depend only on their path?
+PAGE_CACHE = False
+# Number of rendered pages to keep in memory in each server process
+PAGE_CACHE_SIZE = 128
+# Also share rendered pages between server processes in Redis?
+PAGE_CACHE_REDIS = False
+# Seconds rendered pages are kept in Redis for
+PAGE_CACHE_TTL = 3600
+
+# Redis server holding the job queues, None uses REDIS_URL from the
+# environment, falling back to redis://localhost:6379
+REDIS_URL = None
+# List of Redis servers to spread jobs over by their ID, each holding all of
+# the queues, with the first also holding the admission and deduplication
+# keys, as described in jobmonitor.sharding; None uses REDIS_URL alone
+REDIS_SHARD_URLS = None
+# Redis server holding job results, rather than the job hashes, which must be
+# given to the workers as JOBMONITOR_RESULT_REDIS_URL
+RESULT_REDIS_URL = None
+
+# A Redis connection pool per server is shared by all requests in a server
+# process
+# Maximum number of open Redis connections in each pool
+REDIS_MAX_CONNECTIONS = 50
+# Seconds a request waits for a free connection when all are in use
+REDIS_POOL_TIMEOUT = 20
+# Seconds to wait for Redis to answer a command, None waits forever
+REDIS_SOCKET_TIMEOUT = 5
+
+# Names of the queues jobs are submitted to, from the highest priority to the
+# lowest, which is the order workers take jobs from them in
+# Clients choose a queue with the `priority` of a task, unless the task's job
+# resolver routes it to a queue
+QUEUES = ['high', 'default', 'low']
+# Queue of tasks without a priority that are not routed by their resolver
+DEFAULT_QUEUE = 'default'
+
+# Maximum number of seconds GET /jobs/<job_id>?wait=<seconds> may wait for
+JOB_WAIT_MAX = 30
+# Wake requests waiting on jobs from a single subscription shared by the
+# process? Otherwise, each waiting request holds one Redis connection from
+# the pool until it returns
+JOB_WAIT_SHARED_SUBSCRIPTION = True
+# Maximum number of seconds a /jobs/<job_id>/events stream stays open for
+JOB_EVENTS_TIMEOUT = 300
+# Seconds between keep-alive comments sent on an idle events stream
+JOB_EVENTS_KEEPALIVE = 15
+
+# Number of jobs returned by GET /jobs when no limit is requested
+JOBS_PAGE_SIZE = 100
+# Maximum number of jobs GET /jobs may return at once
+JOBS_PAGE_SIZE_MAX = 1000
+
+# Seconds browsers and proxies may cache a finished job, which never changes
+JOB_CACHE_MAX_AGE = 3600
+
+# Seconds the results of finished jobs are kept for, unless their job
+# resolver gives a result_ttl, None keeping them for rq's default of 500
+# seconds, and -1 forever
+JOB_RESULT_TTL = None
+# Seconds failed jobs are kept for, unless their job resolver gives a
+# failure_ttl, None keeping them until they are removed from the failed queue
+JOB_FAILURE_TTL = None
+# Cancel jobs submitted through the API that nobody has polled with
+# GET /jobs/<job_id> for this many seconds, None disabling this
+# This must be longer than the poll interval of clients, JOB_WAIT_MAX, and
+# JOB_EVENTS_KEEPALIVE
+JOB_IDLE_TIMEOUT = None
+# Seconds cancelled jobs are kept for, so that clients see their status
+# This is read by the workers as well as the app
+JOB_CANCELLED_TTL = 60
+
+# Seconds the results of the chunks of a split job are kept for, should its
+# merge job never run, see jobmonitor.fanout
+JOB_CHUNK_RESULT_TTL = 24 * 60 * 60
+
+# Maximum number of jobs POST /jobs/batch may submit at once
+JOBS_BATCH_SIZE_MAX = 100
+
+# Admission control of POST /jobs and POST /jobs/batch, see
+# jobmonitor.admission, where None disables a limit
+# Maximum number of jobs each client may submit per RATE_LIMIT_PERIOD
+CLIENT_RATE_LIMIT = None
+# Maximum number of jobs of each job name submitted per RATE_LIMIT_PERIOD
+TASK_RATE_LIMIT = None
+# Seconds over which the rates of submissions are counted
+RATE_LIMIT_PERIOD = 60
+# Maximum number of jobs a queue may hold
+QUEUE_DEPTH_MAX = None
+# Maximum number of queued and running jobs of each client
+CLIENT_INFLIGHT_MAX = None
+# Seconds clients are asked to wait before retrying a submission rejected by
+# QUEUE_DEPTH_MAX or CLIENT_INFLIGHT_MAX
+ADMISSION_RETRY_AFTER = 10
+# Request header identifying clients, such as X-Forwarded-For behind a proxy,
+# None using their remote address
+# This must be a header set by the proxies, as clients can send it themselves
+CLIENT_ID_HEADER = None
+# Number of trusted proxies adding to CLIENT_ID_HEADER, where the address
+# added by the outermost of them, this many from the right, is used
+CLIENT_ID_PROXIES = 1
+
+# Number of task name to job name resolutions to cache
+JOB_RESOLVER_CACHE_SIZE = 1024
+
+# Give a job submitted with the same task and arguments as a queued, started,
+# or finished job that job, rather than enqueueing a new one?
+JOB_DEDUPLICATION = False
+# Seconds for which a job can be reused by identical submissions
+JOB_DEDUPLICATION_TTL = 300
+# Stop reusing jobs once a file in FILES_DIRECTORY named by an argument of
+# the job is modified?
+JOB_DEDUPLICATION_MTIME = True
+
+# Record how long each request spends in Redis, resolving tasks, decoding
+# results, and encoding JSON?
+PROFILING = False
+# Log requests taking longer than this many seconds with their breakdown,
+# None disables the log
+SLOW_REQUEST_THRESHOLD = None
+# Send the breakdown of profiled requests in the X-Profile header?
+PROFILE_HEADER = False
+# Fraction of requests to run under cProfile, with the statistics dumped to
+# PROFILE_DIRECTORY, if it is not None
+PROFILE_SAMPLE_RATE = 0.0
+PROFILE_DIRECTORY = None
+
+# Serve Prometheus metrics at /metrics?
+METRICS = True
+
+# Number of rendered GET /jobs/<job_id>/result bodies to keep in memory
+RESULT_CACHE_SIZE = 64
@@ -0,0 +1,221 @@
+"""fanout
+Jobs split in to chunks that run in parallel on different workers, with a
+merge job combining the results of the chunks.
+
+A job resolver marks a job as splittable by giving its ResolvedJob a Split:
+
+    from jobmonitor.fanout import Split
+
+    def histogram_resolver(task_name):
+        if task_name == 'histogram':
+            return ResolvedJob('foo.histogram',
+                               split=Split('foo.add_histograms',
+                                           file_arg='filename'))
+
+Rather than a single job, the jobs API then enqueues one chunk job per
+worker, up to the Split's max_chunks, each calling the job with the same
+arguments plus a `start` and a `stop` argument giving the range of the input
+the chunk covers. These are byte ranges of the file named by the file_arg
+argument, else the ranges returned by the Split's ranges function, such as
+ranges of entries.
+The merge job is called with the list of the chunks' results, in order, once
+the last chunk finishes.
+
+Chunks have IDs made of their parent's ID and their index, so that they
+are stored on the parent's shard, as described in jobmonitor.sharding.
+
+Clients only ever see the merge job, as the parent of the chunks: it is
+started once any chunk has started, its progress is the fraction of the
+chunks that have finished, and it fails, or is cancelled, as soon as any
+chunk does, which cancels the other chunks.
+"""
+import rq
+from rq.compat import as_text
+from rq.job import get_current_job, unpickle
+from rq.utils import import_attribute, utcformat, utcnow
+
+from jobmonitor import progress, results, sharding, start_worker
+
+# Dotted path of the function the merge job runs
+MERGE_FUNCTION = 'jobmonitor.fanout.merge_chunks'
+
+
+class Split(object):
+    """How a job is split in to chunks, and how their results are merged.
+
+    One of file_arg or ranges must be given.
+
+    Keyword arguments:
+    merge -- Dotted import-like path to the method called with the list of
+             chunk results, returning the result of the job
+    file_arg -- Name of the argument holding the name of a file in
+                FILES_DIRECTORY, which is split in to byte ranges
+                (default: None)
+    ranges -- Method called with the job's arguments and the number of
+              chunks, returning a list of (start, stop) tuples for the
+              chunks to cover (default: None)
+    max_chunks -- Maximum number of chunks to split the job in to
+                  (default: 64)
+    range_args -- Names of the arguments the start and stop of a chunk's
+                  range are passed as (default: ('start', 'stop'))
+    """
+    def __init__(self, merge, file_arg=None, ranges=None, max_chunks=64,
+                 range_args=('start', 'stop')):
+        if (file_arg is None) == (ranges is None):
+            raise ValueError('Exactly one of file_arg or ranges must be given')
+        self.merge = merge
+        self.file_arg = file_arg
+        self.ranges = ranges
+        self.max_chunks = max_chunks
+        self.range_args = tuple(range_args)
+
+    def __repr__(self):
+        return ('Split({0!r}, file_arg={1!r}, ranges={2!r}, '
+                'max_chunks={3!r})').format(
+            self.merge, self.file_arg, self.ranges, self.max_chunks
+        )
+
+
+def fanout_key(job_id):
+    """Return the key of the hash holding the IDs of the merge job's
+    chunks, and counting those that have finished."""
+    return 'jobmonitor:fanout:{0}'.format(job_id)
+
+
+def worker_count(connection):
+    """Return the number of registered rq workers, at least 1."""
+    return max(1, connection.scard(rq.Worker.redis_workers_keys))
+
+
+def byte_ranges(size, chunks):
+    """Return a list of at most chunks (start, stop) tuples covering size
+    bytes in ranges of nearly equal length."""
+    chunks = max(1, min(chunks, size))
+    step, extra = divmod(size, chunks)
+    ranges = []
+    start = 0
+    for i in range(chunks):
+        stop = start + step + (1 if i < extra else 0)
+        ranges.append((start, stop))
+        start = stop
+    return ranges
+
+
+def merge_chunks(merge):
+    """Return the result of the merge method called with the list of the
+    results of the current job's chunks, in order, deleting the chunks.
+
+    This is the function merge jobs run.
+    """
+    job = get_current_job(rq.get_current_connection())
+    key = fanout_key(job.id)
+    chunk_ids = as_text(job.connection.hget(key, 'chunks') or '')
+    chunk_ids = [chunk_id for chunk_id in chunk_ids.split(',') if chunk_id]
+    store = start_worker.result_connection()
+    stored = sharding.fetch_results(job.connection, chunk_ids, store)
+    merged = import_attribute(merge)([
+        results.decode(unpickle(value) if value else None) for value in stored
+    ])
+    job.connection.delete(key, *[rq.job.Job.key_for(chunk_id)
+                                 for chunk_id in chunk_ids])
+    if store is not None and chunk_ids:
+        store.delete(*[sharding.result_key(chunk_id)
+                       for chunk_id in chunk_ids])
+    return merged
+
+
+def cancel_chunks(connection, parent_id, queue_key):
+    """Cancel the chunks of the queued merge job, returning False if it is
+    not the merge job of a split job.
+
+    The merge job is never on its queue until its chunks finish, so its
+    chunks are taken off the queue instead, and those already taken by a
+    worker are cancelled along with their parent.
+    """
+    key = fanout_key(parent_id)
+    chunk_ids = as_text(connection.hget(key, 'chunks') or '')
+    chunk_ids = [chunk_id for chunk_id in chunk_ids.split(',') if chunk_id]
+    if not chunk_ids:
+        return False
+    start_worker.request_cancel(connection, parent_id)
+    pipeline = connection.pipeline()
+    # Chunks cancelled from now on don't mark the parent again
+    pipeline.hsetnx(key, 'failed', 1)
+    for chunk_id in chunk_ids:
+        pipeline.lrem(queue_key, 1, chunk_id)
+    removed = pipeline.execute()[1:]
+    for chunk_id, count in zip(chunk_ids, removed):
+        if count:
+            start_worker.mark_cancelled(connection, chunk_id)
+    return True
+
+
+def chunk_started(connection, job):
+    """Mark the parent of the chunk job as started, if it is queued."""
+    parent_id = job.meta['parent']
+    parent_key = rq.job.Job.key_for(parent_id)
+    if as_text(connection.hget(parent_key, 'status')) != rq.job.Status.QUEUED:
+        return
+    connection.hset(parent_key, 'status', rq.job.Status.STARTED)
+    connection.publish(start_worker.job_channel(parent_id),
+                       rq.job.Status.STARTED)
+
+
+def chunk_completed(connection, job, status):
+    """Record the completion of the chunk job with the status on its parent.
+
+    The progress of the parent is the fraction of its chunks that have
+    finished, and it is enqueued once they all have.
+    If the chunk did not finish, the parent is marked as failed, or
+    cancelled, and its other chunks are cancelled.
+    """
+    parent_id = job.meta['parent']
+    key = fanout_key(parent_id)
+    if status == rq.job.Status.FINISHED:
+        pipeline = connection.pipeline()
+        pipeline.hincrby(key, 'remaining', -1)
+        pipeline.hget(key, 'total')
+        remaining, total = pipeline.execute()
+        total = int(total or 0)
+        if not total:
+            # The parent has gone, so there's nothing to merge
+            return
+        progress.publish_progress(
+            connection, parent_id, (total - remaining) / float(total),
+            '{0} of {1} chunks finished'.format(total - remaining, total)
+        )
+        if remaining == 0:
+            enqueue_parent(connection, parent_id)
+        return
+    # Only the first chunk to fail marks the parent
+    if not connection.hsetnx(key, 'failed', 1):
+        return
+    # Cancelling the parent cancels the chunks that have yet to complete
+    start_worker.request_cancel(connection, parent_id)
+    if status == start_worker.CANCELLED:
+        parent_status = start_worker.CANCELLED
+        start_worker.mark_cancelled(connection, parent_id)
+    else:
+        parent_status = rq.job.Status.FAILED
+        parent_key = rq.job.Job.key_for(parent_id)
+        failure_ttl = connection.hget(key, 'failure_ttl')
+        pipeline = connection.pipeline()
+        pipeline.hmset(parent_key, dict(status=parent_status,
+                                        ended_at=utcformat(utcnow())))
+        if failure_ttl is not None:
+            pipeline.expire(parent_key, int(failure_ttl))
+        pipeline.execute()
+    client = connection.hget(key, 'client')
+    if client is not None:
+        connection.zrem(start_worker.inflight_key(as_text(client)), parent_id)
+    connection.publish(start_worker.job_channel(parent_id), parent_status)
+
+
+def enqueue_parent(connection, parent_id):
+    """Push the merge job on to the queue it was created for."""
+    origin = as_text(connection.hget(rq.job.Job.key_for(parent_id), 'origin'))
+    queue = start_worker.Queue(origin, connection=connection)
+    pipeline = connection.pipeline()
+    pipeline.rpush(queue.key, parent_id)
+    pipeline.sadd(queue.redis_queues_keys, queue.key)
+    pipeline.execute()
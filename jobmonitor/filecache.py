@@ -0,0 +1,221 @@
+"""filecache
+A per-process cache of the data files jobs read, and of the objects loaded
+from them.
+
+Jobs running against the same few large files in FILES_DIRECTORY would
+otherwise open and parse them again every time. Instead, a job can ask for
+a file's contents or for an object loaded from it:
+
+    from jobmonitor import filecache
+
+    def histogram(filename, branch):
+        data = filecache.mapped(filename)
+        tree = filecache.load(filename, open_tree)
+        ...
+
+Entries are keyed by the file's path, and are reloaded when its
+modification time or size changes. The least recently used entries are
+evicted once the cache holds more than JOBMONITOR_FILE_CACHE_ENTRIES
+entries, or once the loaded objects take more than
+JOBMONITOR_FILE_CACHE_BYTES bytes. Both limits are environment variables,
+defaulting to 64 entries and 512 MiB.
+Memory-mapped files don't count towards the byte limit, as their pages
+belong to the operating system's page cache.
+
+The cache lasts as long as the process. rq workers fork a new process for
+each job by default, so the cache only helps workers that run jobs
+in-process, as start_worker.InProcessWorker does.
+"""
+import collections
+import mmap
+import os
+import threading
+
+from . import config
+
+# Key under which the contents of a file are cached by mapped
+MAPPED = 'mapped'
+
+
+def files_directory():
+    """Return the directory relative file names are resolved against.
+
+    This is the JOBMONITOR_FILES_DIRECTORY environment variable if it's set,
+    else FILES_DIRECTORY.
+    """
+    return os.path.abspath(os.getenv('JOBMONITOR_FILES_DIRECTORY') or
+                           config.FILES_DIRECTORY)
+
+
+def resolve_path(filename):
+    """Return the absolute path of the file named relative to
+    files_directory().
+
+    Raise ValueError if the path is outside of files_directory().
+    """
+    directory = files_directory()
+    path = os.path.abspath(os.path.join(directory, filename))
+    if not path.startswith(directory + os.sep):
+        raise ValueError('File `{0}` is outside of `{1}`'.format(
+            filename, directory
+        ))
+    return path
+
+
+def map_file(path):
+    """Return the contents of the file, memory-mapped read-only if possible,
+    and the number of bytes of memory they take.
+
+    Files that cannot be memory-mapped, such as empty files, are read in to
+    memory instead.
+    """
+    with open(path, 'rb') as f:
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), 0
+        except (ValueError, EnvironmentError):
+            data = f.read()
+            return data, len(data)
+
+
+class FileCache(object):
+    """A least recently used cache of values loaded from files.
+
+    Each entry holds the modification time and size of the file when it was
+    loaded, and is reloaded once either changes.
+    """
+    def __init__(self, max_entries=64, max_bytes=512 * 2 ** 20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._lock = threading.Lock()
+        # Map of (path, loader key) to (version, value, nbytes), ordered from
+        # the least to the most recently used
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, path, key, loader):
+        """Return the value loader(path) returns, loading it if it isn't
+        cached or the file has changed since it was.
+
+        Keyword arguments:
+        path -- Absolute path of the file
+        key -- Name of the loader, so different loaders of the same file are
+               cached separately
+        loader -- Function returning a (value, nbytes) tuple for the path,
+                  where nbytes is the memory taken by the value
+        """
+        stat = os.stat(path)
+        version = (stat.st_mtime, stat.st_size)
+        with self._lock:
+            entry = self._entries.pop((path, key), None)
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+                self._entries[(path, key)] = entry
+                return entry[1]
+            self.misses += 1
+            if entry is not None:
+                self.nbytes -= entry[2]
+        # Load outside of the lock, as it may be slow
+        value, nbytes = loader(path)
+        with self._lock:
+            previous = self._entries.pop((path, key), None)
+            if previous is not None:
+                self.nbytes -= previous[2]
+            if nbytes <= self.max_bytes and self.max_entries > 0:
+                self._entries[(path, key)] = (version, value, nbytes)
+                self.nbytes += nbytes
+                self._evict()
+        return value
+
+    def _evict(self):
+        """Remove the least recently used entries until within the limits."""
+        while len(self._entries) > self.max_entries or \
+                self.nbytes > self.max_bytes:
+            _, (_, _, nbytes) = self._entries.popitem(last=False)
+            self.nbytes -= nbytes
+
+    def clear(self):
+        """Remove all entries from the cache.
+
+        The hit and miss counters are not reset.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """Return a dictionary of the cache's size and hit/miss counters."""
+        return dict(
+            size=len(self._entries),
+            max_entries=self.max_entries,
+            nbytes=self.nbytes,
+            max_bytes=self.max_bytes,
+            hits=self.hits,
+            misses=self.misses
+        )
+
+
+# The cache of this process
+cache = FileCache(
+    int(os.getenv('JOBMONITOR_FILE_CACHE_ENTRIES') or 64),
+    int(os.getenv('JOBMONITOR_FILE_CACHE_BYTES') or 512 * 2 ** 20)
+)
+
+
+def mapped(filename):
+    """Return the contents of the file in files_directory(), memory-mapped
+    if possible, as by map_file.
+
+    The result supports slicing and len like a byte string.
+    """
+    return cache.get(resolve_path(filename), MAPPED, map_file)
+
+
+def loader_key(loader):
+    """Return the name identifying the values cached by the loader, its
+    module and name.
+
+    Raise ValueError if the loader has no such stable name, as for lambdas,
+    nested functions, and functools.partial objects, whose values must be
+    cached under a key given to load.
+    """
+    module = getattr(loader, '__module__', None)
+    name = getattr(loader, '__qualname__', getattr(loader, '__name__', None))
+    if module is None or name is None or '<' in name:
+        raise ValueError(
+            'Loader {0!r} has no stable name, so needs a key'.format(loader)
+        )
+    return '{0}.{1}'.format(module, name)
+
+
+def load(filename, loader, nbytes=None, key=None):
+    """Return loader(path) for the file in files_directory().
+
+    The memory taken by the loaded value is nbytes(value), if nbytes is
+    given, else the size of the file.
+
+    Keyword arguments:
+    filename -- Name of the file, relative to files_directory()
+    loader -- Function taking the absolute path of the file and returning
+              the object loaded from it
+    nbytes -- Function returning the memory taken by a loaded value, in
+              bytes (default: None)
+    key -- Name identifying the values returned by the loader, which is
+           required for loaders without a stable name, such as lambdas
+           (default: the loader's module and name, as from loader_key)
+    """
+    def load_value(path):
+        value = loader(path)
+        if nbytes is None:
+            return value, os.path.getsize(path)
+        return value, nbytes(value)
+    if key is None:
+        key = loader_key(loader)
+    else:
+        # Keep explicit keys apart from those of named loaders and mapped
+        key = 'key:{0}'.format(key)
+    return cache.get(resolve_path(filename), key, load_value)
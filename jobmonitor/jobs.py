@@ -3,8 +3,8 @@ from flask import (
     Blueprint,
     # The request context
     request,
-    # JSON encode Python dictionaries
-    jsonify,
+    # JSON encode Python dictionaries, timed by the jsonify below
+    jsonify as flask_jsonify,
     # Generate URLs
     url_for,
     # Raise HTTP error code exceptions
@@ -12,37 +12,1108 @@ from flask import (
     # Global object to store the rq.Queue
     g,
     # The app handling the current request
-    current_app
+    current_app,
+    # Encode JSON outside of a response
+    json,
+    # Build streaming responses
+    Response,
+    stream_with_context
 )
 
+import hashlib
+import os
+import threading
+import time
+import uuid
 # Job queues
+import redis
 import rq
-from . import start_worker
+from rq.compat import as_text, string_types
+from rq.exceptions import NoSuchJobError
+from rq.job import unpickle, Status
+from rq.utils import utcformat, utcnow
+from . import (admission, fanout, metrics, notifier, profiling, progress,
+               results, sharding, start_worker)
+from .FlaskWithJobResolvers import ResolvedJob
+from .lru import LRUCache
 
 jobs = Blueprint('jobs', __name__)
 
 
+class InvalidTaskError(Exception):
+    """Raised when a task submitted by the client cannot be enqueued."""
+    pass
+
+
+# Statuses of jobs that have not yet completed
+PENDING_STATUSES = ('queued', 'started')
+
+# Statuses of jobs a duplicate submission can be attached to
+REUSABLE_STATUSES = PENDING_STATUSES + ('finished',)
+
+# Prefix of the Redis keys mapping task fingerprints to job IDs
+DEDUPLICATION_PREFIX = 'jobmonitor:dedup:'
+
+# Seconds between checks of a pub/sub subscription for new messages
+WAIT_INTERVAL = 0.05
+
+# Fields of the job hash in Redis that can be requested when listing jobs
+JOB_FIELDS = ('status', 'result', 'created_at', 'enqueued_at', 'ended_at')
+
+# Fields sent when listing jobs, if none are requested
+DEFAULT_LIST_FIELDS = ('id', 'uri', 'status')
+
+# Fields of the job hash that change whenever the job's representation does
+VERSION_FIELDS = ('status', 'ended_at')
+
+
+def jsonify(*args, **kwargs):
+    """Return flask.jsonify(*args, **kwargs), timed by the profiler."""
+    with profiling.section('jsonify'):
+        return flask_jsonify(*args, **kwargs)
+
+
+def decode_result(value):
+    """Return the result decoded by results.decode, timed by the profiler.
+    """
+    with profiling.section('decode_result'):
+        return results.decode(value)
+
+
+def reported_status(status, ended_at):
+    """Return the status of the job to send to clients.
+
+    rq saves a job as finished before its result and completion time, so a
+    finished job without a completion time is reported as started until
+    they are saved.
+    """
+    status = as_text(status)
+    if status == Status.FINISHED and not ended_at:
+        return Status.STARTED
+    return status
+
+
 # TODO finalise response format, i.e. what metadata we send with each response
-def serialize_job(job):
-    """Return a dictionary representing the job."""
+def serialize_job(job, partial=None):
+    """Return a dictionary representing the job.
+
+    Keyword arguments:
+    job -- The rq.job.Job to represent
+    partial -- Latest partial result of the job, as from fetch_job_partial,
+               sent as the `partial` of the job if given (default: None)
+    """
+    status = reported_status(job.get_status(), job.ended_at)
     d = dict(
         id=job.get_id(),
         uri=url_for('jobs.get_job', job_id=job.get_id(), _external=True),
-        status=job.get_status(),
-        result=job.result
+        status=status,
+        result=decode_result(job.result) if status == Status.FINISHED
+        else None
+    )
+    if partial is not None:
+        d['partial'] = dict(partial, result=decode_result(partial['result']))
+    return d
+
+
+def fetch_job_partial(job):
+    """Return the latest partial result of the job, or None.
+
+    Only started jobs can publish partial results, so the partials of other
+    jobs are not fetched.
+    """
+    if job.get_status() != Status.STARTED:
+        return None
+    return progress.fetch_partial(current_app.shards.for_job(job.id), job.id)
+
+
+def fetch_job_hashes(shards, job_ids, fields):
+    """Return a dictionary of the fields of each job's hash, fetched in a
+    single pipeline per shard.
+
+    The list is in the same order as job_ids, with jobs that no longer exist
+    left out.
+
+    Keyword arguments:
+    shards -- sharding.Shards the jobs are stored in
+    job_ids -- List of job IDs to fetch
+    fields -- List of hash fields to fetch for each job, from JOB_FIELDS
+    """
+    # The status is always fetched, as every job has one
+    fields = ['status'] + [f for f in fields if f != 'status']
+    pipelines = shards.pipelines()
+    for job_id in job_ids:
+        pipelines.for_job(job_id).hmget(rq.job.Job.key_for(job_id), fields)
+    replies = pipelines.execute()
+    hashes = []
+    for job_id in job_ids:
+        values = next(replies[shards.index(job_id)])
+        if values[0] is None:
+            continue
+        h = dict(zip(fields, values))
+        h['id'] = job_id
+        hashes.append(h)
+    return hashes
+
+
+def fetch_job_results(shards, hashes):
+    """Add the `result` field to each job hash, fetched in a single pipeline
+    per shard, or from the result store, as by sharding.Shards.fetch_results.
+    """
+    stored = shards.fetch_results([h['id'] for h in hashes])
+    for h, result in zip(hashes, stored):
+        h['result'] = result
+    return hashes
+
+
+def make_etag(*parts):
+    """Return an opaque entity tag identifying the parts."""
+    value = ':'.join(
+        as_text(p) if isinstance(p, bytes) else '{0}'.format(p) for p in parts
     )
+    return hashlib.sha1(value.encode('utf-8')).hexdigest()
+
+
+def not_modified(etag):
+    """Return an empty 304 response with the ETag."""
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def set_cache_headers(response, etag, finished):
+    """Set the ETag and Cache-Control headers of the response.
+
+    Finished jobs never change, so may be cached for JOB_CACHE_MAX_AGE
+    seconds, whereas anything else must be revalidated before reuse.
+    """
+    response.set_etag(etag)
+    if finished:
+        response.headers['Cache-Control'] = 'public, max-age={0}'.format(
+            current_app.config['JOB_CACHE_MAX_AGE']
+        )
+    else:
+        response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def serialize_job_hash(job_hash, fields):
+    """Return a dictionary representing the job with only the given fields.
+
+    Keyword arguments:
+    job_hash -- Dictionary of job hash fields, as from fetch_job_hashes
+    fields -- List of fields to include, from JOB_FIELDS plus 'id' and 'uri'
+    """
+    job_id = job_hash['id']
+    d = dict(id=job_id)
+    for field in fields:
+        if field == 'uri':
+            d['uri'] = url_for('jobs.get_job', job_id=job_id, _external=True)
+        elif field == 'result':
+            result = job_hash.get('result')
+            d['result'] = decode_result(unpickle(result)) if result else None
+        elif field != 'id':
+            d[field] = as_text(job_hash.get(field))
     return d
 
 
+def resolve_task(data):
+    """Return the ResolvedJob and arguments of the task described by data.
+
+    The queue of the ResolvedJob is the one chosen by the job resolver, else
+    the queue named by the task's priority, else DEFAULT_QUEUE.
+    Raise InvalidTaskError, with a message for the client, if the data does
+    not describe a task that can be enqueued.
+
+    Keyword arguments:
+    data -- Dictionary with a `task_name` key, and optional `args` and
+            `priority` keys, where the priority is the name of a queue
+    """
+    # Try read the task name and load the task
+    try:
+        task_name = data['task_name']
+    except (KeyError, TypeError):
+        raise InvalidTaskError('No task name provided')
+    if not isinstance(task_name, string_types):
+        raise InvalidTaskError('Task name must be a string')
+    # Try to resolve the task name in to job name
+    resolved = current_app.resolve_job_spec(task_name)
+    if resolved is None:
+        raise InvalidTaskError('Invalid task name `{0}`'.format(task_name))
+    # Pass empty arguments if none were provided
+    args = data.get('args', {})
+    if not isinstance(args, dict):
+        raise InvalidTaskError('Task arguments must be an object')
+    priority = data.get('priority')
+    if priority is not None and priority not in current_app.queues:
+        raise InvalidTaskError('Invalid priority `{0}`'.format(priority))
+    queue = resolved.queue or priority or current_app.config['DEFAULT_QUEUE']
+    if queue not in current_app.queues:
+        raise InvalidTaskError(
+            'Task `{0}` is routed to unknown queue `{1}`'.format(
+                task_name, queue
+            )
+        )
+    if resolved.split is not None and resolved.split.file_arg is not None:
+        split_file_path(resolved.split, args)
+    # Copy the resolution, as it is cached by the app
+    return ResolvedJob(resolved.name, queue, resolved.timeout,
+                       resolved.result_ttl, resolved.failure_ttl,
+                       resolved.split), args
+
+
+def split_file_path(split, args):
+    """Return the absolute path of the file the split job's file_arg names.
+
+    Raise InvalidTaskError if the argument does not name a file in
+    FILES_DIRECTORY.
+    """
+    filename = args.get(split.file_arg)
+    if not isinstance(filename, string_types):
+        raise InvalidTaskError(
+            'Argument `{0}` must name a file'.format(split.file_arg)
+        )
+    files_directory = os.path.abspath(current_app.config['FILES_DIRECTORY'])
+    path = os.path.abspath(os.path.join(files_directory, filename))
+    if not path.startswith(files_directory + os.sep) or \
+            not os.path.isfile(path):
+        raise InvalidTaskError('No file named `{0}`'.format(filename))
+    return path
+
+
+def deduplication_key(jname, args):
+    """Return the Redis key identifying jobs that call jname with args.
+
+    The key is a hash of the job name and the arguments, with dictionaries
+    ordered by key.
+    If JOB_DEDUPLICATION_MTIME is True, the modification time of any file in
+    FILES_DIRECTORY named by an argument is included, so that jobs are not
+    reused once their input file changes.
+    """
+    mtimes = {}
+    if current_app.config['JOB_DEDUPLICATION_MTIME']:
+        files_directory = os.path.abspath(
+            current_app.config['FILES_DIRECTORY']
+        )
+        for value in args.values():
+            if not isinstance(value, string_types):
+                continue
+            path = os.path.abspath(os.path.join(files_directory, value))
+            if path.startswith(files_directory + os.sep) and \
+                    os.path.isfile(path):
+                mtimes[value] = os.path.getmtime(path)
+    fingerprint = json.dumps([jname, args, mtimes], sort_keys=True)
+    return DEDUPLICATION_PREFIX + hashlib.sha1(
+        fingerprint.encode('utf-8')
+    ).hexdigest()
+
+
+def find_duplicate_jobs(shards, keys):
+    """Return the job each deduplication key refers to, and its status.
+
+    The list holds an (ID, status) tuple for each key, in the same order as
+    keys, where the ID is None for unset keys, and the status is None unless
+    the job is queued, started, or finished, and so can be reused.
+    The keys are stored on the primary shard, and the jobs on their own.
+    """
+    job_ids = [as_text(job_id) for job_id in shards.primary.mget(keys)]
+    pipelines = shards.pipelines()
+    for job_id in job_ids:
+        if job_id is not None:
+            pipelines.for_job(job_id).hget(rq.job.Job.key_for(job_id),
+                                           'status')
+    replies = pipelines.execute()
+    found = []
+    for job_id in job_ids:
+        if job_id is None:
+            status = None
+        else:
+            status = as_text(next(replies[shards.index(job_id)]))
+        if status not in REUSABLE_STATUSES:
+            status = None
+        found.append((job_id, status))
+    return found
+
+
+def claim_deduplication_keys(connection, keys, job_ids, stale_ids, ttl):
+    """Point each deduplication key at its new job ID for ttl seconds,
+    unless another submission claimed it first, and return the ID of the
+    job each key now points to.
+
+    A key is claimed only if it is unset, or still holds its stale ID, the
+    job it pointed to when it was found unusable, so that identical
+    submissions made at the same time are given a single job.
+    """
+    with connection.pipeline() as pipeline:
+        while True:
+            try:
+                pipeline.watch(*keys)
+                current = [as_text(job_id) for job_id in pipeline.mget(keys)]
+                claimed = [job_id is None or job_id == stale
+                           for job_id, stale in zip(current, stale_ids)]
+                pipeline.multi()
+                for key, job_id, claim in zip(keys, job_ids, claimed):
+                    if claim:
+                        pipeline.set(key, job_id, ex=ttl)
+                pipeline.execute()
+            except redis.WatchError:
+                continue
+            return [job_id if claim else other for job_id, claim, other
+                    in zip(job_ids, claimed, current)]
+
+
+def submit_jobs(queues, calls, client=None):
+    """Enqueue a job for each call, reusing identical jobs when enabled.
+
+    If JOB_DEDUPLICATION is True, a call with the same job name and arguments
+    as a queued, started, or finished job from the last JOB_DEDUPLICATION_TTL
+    seconds is given that job, rather than a new one.
+    Return a list of (job ID, status, created) tuples, in the same order as
+    calls, where created is False for reused jobs.
+
+    Keyword arguments:
+    queues -- Dictionary of queue names to the rq.Queue instances to use
+    calls -- List of (ResolvedJob, keyword arguments dictionary) tuples
+    client -- ID of the client the new jobs count as pending for, as by
+              enqueue_jobs (default: None)
+    """
+    if current_app.config['JOB_DEDUPLICATION']:
+        submitted = submit_unique_jobs(queues, calls, client)
+    else:
+        submitted = [(job.id, Status.QUEUED, True)
+                     for job in enqueue_jobs(queues, calls, client=client)]
+    for (resolved, _), (_, _, created) in zip(calls, submitted):
+        metrics.JOBS_SUBMITTED.inc(queue=resolved.queue,
+                                   reused='false' if created else 'true')
+    return submitted
+
+
+def submit_unique_jobs(queues, calls, client=None):
+    """Enqueue a job for each call that has no identical job, as by
+    submit_jobs with JOB_DEDUPLICATION enabled."""
+    shards = current_app.shards
+    keys = [deduplication_key(resolved.name, args)
+            for resolved, args in calls]
+    found = find_duplicate_jobs(shards, keys)
+    # Identical calls in the same submission share a job
+    first_index = {}
+    new_keys = []
+    for i, key in enumerate(keys):
+        if found[i][1] is None and key not in first_index:
+            first_index[key] = i
+            new_keys.append(key)
+    # The keys are claimed before the jobs are enqueued, so that only the
+    # first of concurrent identical submissions enqueues a job
+    claimed = {}
+    if new_keys:
+        job_ids = [str(uuid.uuid4()) for _ in new_keys]
+        winners = claim_deduplication_keys(
+            shards.primary, new_keys, job_ids,
+            [found[first_index[key]][0] for key in new_keys],
+            current_app.config['JOB_DEDUPLICATION_TTL']
+        )
+        new_calls = []
+        new_ids = []
+        for key, job_id, winner in zip(new_keys, job_ids, winners):
+            claimed[key] = (winner, winner == job_id)
+            if winner == job_id:
+                new_calls.append(calls[first_index[key]])
+                new_ids.append(job_id)
+        enqueue_jobs(queues, new_calls, client=client, job_ids=new_ids)
+    submitted = []
+    for i, key in enumerate(keys):
+        if key in claimed:
+            job_id, created = claimed[key]
+            submitted.append((job_id, Status.QUEUED,
+                              created and first_index[key] == i))
+        else:
+            submitted.append(found[i] + (False,))
+    return submitted
+
+
+def enqueue_jobs(queues, calls, client=None, job_ids=None):
+    """Enqueue a job for each call in a single Redis transaction per shard.
+
+    Mirrors rq.Queue.enqueue_call, but with one round trip for all jobs on
+    each shard, where each job is pushed on to its queue on its own shard.
+    Calls whose ResolvedJob has a split are enqueued as chunk jobs, and
+    give their merge job, as by enqueue_split_job.
+    Return the list of created jobs, in the same order as calls.
+
+    Keyword arguments:
+    queues -- Dictionary of queue names to the rq.Queue instances to use
+    calls -- List of (ResolvedJob, keyword arguments dictionary) tuples,
+             where each ResolvedJob names the queue to use
+    client -- ID of the client the jobs count as pending for, until they
+              complete, as by jobmonitor.admission (default: None)
+    job_ids -- List of the IDs to give the jobs, one per call
+               (default: new IDs)
+    """
+    if job_ids is None:
+        job_ids = [None] * len(calls)
+    shards = current_app.shards
+    jobs = []
+    # Number of workers on each shard, counted when first needed
+    workers = {}
+    pipelines = shards.pipelines(transaction=True)
+    for (resolved, kwargs), job_id in zip(calls, job_ids):
+        queue = queues[resolved.queue]
+        if resolved.split is None:
+            job = create_job_hash(pipelines, queue, resolved, resolved.name,
+                                  kwargs, client=client, job_id=job_id)
+            pipeline = pipelines.for_job(job.id)
+            pipeline.rpush(queue.key, job.id)
+            pipeline.sadd(queue.redis_queues_keys, queue.key)
+        else:
+            job = enqueue_split_job(pipelines, queue, resolved, kwargs,
+                                    workers, client, job_id)
+        jobs.append(job)
+    pipelines.execute()
+    return jobs
+
+
+def create_job_hash(pipelines, queue, resolved, name, kwargs, parent_id=None,
+                    client=None, job_id=None):
+    """Save a queued job calling name with kwargs on its shard, without
+    pushing it on to the queue, and return it.
+
+    The result and failure TTLs of the job are taken from the ResolvedJob,
+    else from JOB_RESULT_TTL and JOB_FAILURE_TTL, and the job is given
+    JOB_IDLE_TIMEOUT, as understood by start_worker.Worker.
+    Chunks of a split job, with a parent_id, keep their results for
+    JOB_CHUNK_RESULT_TTL, and are polled through their parent.
+    Jobs with a client are added to the client's pending jobs.
+    The job is given a new ID, unless job_id is given.
+    """
+    config = current_app.config
+    if parent_id is None:
+        result_ttl = resolved.result_ttl
+        if result_ttl is None:
+            result_ttl = config['JOB_RESULT_TTL']
+    else:
+        result_ttl = config['JOB_CHUNK_RESULT_TTL']
+    job = queue.job_class.create(name, kwargs=kwargs,
+                                 connection=queue.connection,
+                                 result_ttl=result_ttl,
+                                 status=Status.QUEUED)
+    if job_id is not None:
+        job.set_id(job_id)
+    job.connection = current_app.shards.for_job(job.id)
+    pipeline = pipelines.for_job(job.id)
+    job.origin = queue.name
+    job.enqueued_at = utcnow()
+    job.timeout = (resolved.timeout or queue._default_timeout or
+                   queue.DEFAULT_TIMEOUT)
+    failure_ttl = resolved.failure_ttl
+    if failure_ttl is None:
+        failure_ttl = config['JOB_FAILURE_TTL']
+    if failure_ttl is not None:
+        job.meta['failure_ttl'] = failure_ttl
+    idle_timeout = config['JOB_IDLE_TIMEOUT']
+    if idle_timeout is not None:
+        job.meta['idle_timeout'] = idle_timeout
+        if parent_id is None:
+            pipeline.set(start_worker.poll_key(job.id), time.time(),
+                         ex=idle_timeout)
+    if parent_id is not None:
+        job.meta['parent'] = parent_id
+    if client is not None:
+        job.meta['client'] = client
+        pipeline.zadd(start_worker.inflight_key(client), time.time(), job.id)
+    job.save(pipeline=pipeline)
+    return job
+
+
+def split_ranges(split, args, chunks):
+    """Return the (start, stop) ranges of the chunks of the split job."""
+    if split.ranges is not None:
+        return list(split.ranges(args, chunks))
+    size = os.path.getsize(split_file_path(split, args))
+    return fanout.byte_ranges(size, chunks)
+
+
+def enqueue_split_job(pipelines, queue, resolved, kwargs, workers,
+                      client=None, job_id=None):
+    """Enqueue the chunks of the split job, and return its merge job.
+
+    The job is split in to one chunk per worker on its shard, up to the
+    max_chunks of the split, and the merge job is enqueued by the worker
+    finishing the last chunk, as described in jobmonitor.fanout.
+    The chunks' IDs are the merge job's ID followed by their index, so that
+    they are stored on its shard.
+
+    Keyword arguments:
+    workers -- Dictionary of shard indexes to their number of workers, to
+               which the count of the job's shard is added if missing
+    job_id -- ID to give the merge job (default: a new ID)
+    """
+    split = resolved.split
+    parent = create_job_hash(pipelines, queue, resolved,
+                             fanout.MERGE_FUNCTION, dict(merge=split.merge),
+                             client=client, job_id=job_id)
+    pipeline = pipelines.for_job(parent.id)
+    index = current_app.shards.index(parent.id)
+    if index not in workers:
+        workers[index] = fanout.worker_count(parent.connection)
+    ranges = split_ranges(split, kwargs,
+                          min(workers[index], split.max_chunks))
+    start_arg, stop_arg = split.range_args
+    chunk_ids = []
+    for i, (start, stop) in enumerate(ranges):
+        chunk_kwargs = dict(kwargs)
+        chunk_kwargs[start_arg] = start
+        chunk_kwargs[stop_arg] = stop
+        chunk = create_job_hash(pipelines, queue, resolved, resolved.name,
+                                chunk_kwargs, parent.id,
+                                job_id='{0}.{1}'.format(parent.id, i))
+        pipeline.rpush(queue.key, chunk.id)
+        chunk_ids.append(chunk.id)
+    if not chunk_ids:
+        # Nothing to split, so the merge job can run straight away
+        pipeline.rpush(queue.key, parent.id)
+    pipeline.sadd(queue.redis_queues_keys, queue.key)
+    key = fanout.fanout_key(parent.id)
+    fields = dict(total=len(chunk_ids), remaining=len(chunk_ids),
+                  chunks=','.join(chunk_ids))
+    if 'failure_ttl' in parent.meta:
+        fields['failure_ttl'] = parent.meta['failure_ttl']
+    if client is not None:
+        fields['client'] = client
+    pipeline.hmset(key, fields)
+    pipeline.expire(key, current_app.config['JOB_CHUNK_RESULT_TTL'])
+    return parent
+
+
+def record_poll(pipeline, job_id):
+    """Add a command to the pipeline recording that the job was polled, if
+    JOB_IDLE_TIMEOUT is set.
+
+    Only jobs given an idle timeout when they were enqueued have their polls
+    recorded, and so can be cancelled once idle.
+    """
+    timeout = current_app.config['JOB_IDLE_TIMEOUT']
+    if timeout is not None:
+        pipeline.set(start_worker.poll_key(job_id), time.time(), ex=timeout,
+                     xx=True)
+
+
+def fetch_job_version(job_id, poll=False):
+    """Return the status, completion time, and partial result number of the
+    job, in a single round trip to its shard.
+
+    The status is None if the job does not exist, and is as by
+    reported_status otherwise, and the partial result number is None unless
+    the job is pending and has published a partial.
+    If poll is True, the poll is also recorded, as by record_poll.
+    """
+    return fetch_job_versions([job_id], poll)[0]
+
+
+def fetch_job_versions(job_ids, poll=False):
+    """Return a (status, completion time, partial result number) tuple for
+    each job, as by fetch_job_version, in a single round trip per shard.
+
+    The list is in the same order as job_ids.
+    """
+    shards = current_app.shards
+    pipelines = shards.pipelines()
+    for job_id in job_ids:
+        pipeline = pipelines.for_job(job_id)
+        pipeline.hmget(rq.job.Job.key_for(job_id), VERSION_FIELDS)
+        pipeline.hget(start_worker.partial_key(job_id), 'sequence')
+    if poll:
+        for job_id in job_ids:
+            record_poll(pipelines.for_job(job_id), job_id)
+    replies = pipelines.execute()
+    versions = []
+    for job_id in job_ids:
+        shard_replies = replies[shards.index(job_id)]
+        (status, ended_at), sequence = next(shard_replies), next(shard_replies)
+        if status is not None:
+            status = reported_status(status, ended_at)
+        if status not in PENDING_STATUSES or sequence is None:
+            sequence = None
+        else:
+            sequence = int(sequence)
+        versions.append((status, ended_at, sequence))
+    return versions
+
+
+def fetch_changed_jobs(versions):
+    """Return the jobs whose version differs from the one given, and the
+    IDs of the jobs that do not exist, in two round trips per shard.
+
+    Each job is represented by its `id`, `uri`, `status`, and `result`, with
+    its `partial` if it is started and published one, as by serialize_job,
+    and its `version`, which is the ETag GET /jobs/<job_id> would give it.
+    Every job counts as polled, as by record_poll.
+
+    Keyword arguments:
+    versions -- List of (job ID, version) tuples, where the version is the
+                one the caller has, or None for all jobs it has not seen
+    """
+    job_ids = [job_id for job_id, _ in versions]
+    changed = []
+    missing = []
+    for (job_id, known), (status, ended_at, sequence) in zip(
+            versions, fetch_job_versions(job_ids, poll=True)):
+        if status is None:
+            missing.append(job_id)
+            continue
+        version = make_etag(job_id, status, ended_at, sequence)
+        if version != known:
+            changed.append(dict(id=job_id, status=as_text(status),
+                                version=version, sequence=sequence))
+    # Only the results of finished jobs and the partials of started jobs
+    # are fetched, as nothing else has either
+    shards = current_app.shards
+    finished = [h['id'] for h in changed if h['status'] == Status.FINISHED]
+    pipelines = shards.pipelines()
+    for h in changed:
+        pipeline = pipelines.for_job(h['id'])
+        if h['status'] == Status.FINISHED:
+            if shards.results is None:
+                pipeline.hget(rq.job.Job.key_for(h['id']), 'result')
+        elif h['sequence'] is not None:
+            pipeline.hgetall(start_worker.partial_key(h['id']))
+    replies = pipelines.execute()
+    if shards.results is not None:
+        stored = iter(sharding.fetch_results(None, finished, shards.results))
+    jobs = []
+    for h in changed:
+        partial = None
+        shard_replies = replies[shards.index(h['id'])]
+        if h['status'] == Status.FINISHED:
+            if shards.results is None:
+                h['result'] = next(shard_replies)
+            else:
+                h['result'] = next(stored)
+        elif h['sequence'] is not None:
+            partial = progress.parse_partial(next(shard_replies))
+        d = serialize_job_hash(h, ('id', 'uri', 'status', 'result'))
+        d['version'] = h['version']
+        if partial is not None:
+            d['partial'] = dict(partial,
+                                result=decode_result(partial['result']))
+        jobs.append(d)
+    return jobs, missing
+
+
+def changed_jobs_response(versions):
+    """Return the response listing the changed and missing jobs, as by
+    fetch_changed_jobs, or a 400 response if there are too many jobs.
+
+    With a `wait` query parameter, if none of the jobs changed, the response
+    is held for that many seconds, up to JOB_WAIT_MAX, until one does, as by
+    wait_for_jobs.
+    """
+    config = current_app.config
+    if len(versions) > config['JOBS_PAGE_SIZE_MAX']:
+        return jsonify(dict(
+            message='At most {0} jobs can be fetched at once'.format(
+                config['JOBS_PAGE_SIZE_MAX']
+            )
+        )), 400
+    wait = min(request.args.get('wait', 0, type=float),
+               config['JOB_WAIT_MAX'])
+    if wait > 0 and versions:
+        def fetch_changes():
+            changed, missing = fetch_changed_jobs(versions)
+            if changed or missing:
+                return changed, missing
+        changes = wait_for_jobs([job_id for job_id, _ in versions], wait,
+                                fetch_changes)
+        changed, missing = changes or ([], [])
+    else:
+        changed, missing = fetch_changed_jobs(versions)
+    response = jsonify(dict(jobs=changed, missing=missing))
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def wait_for_job(job_id, timeout, sequence=None, poll=False):
+    """Block until the job's status changes or it publishes a partial
+    result, or for timeout seconds.
+
+    The worker publishes the status of a job when it completes (see
+    start_worker.Worker), as does jobmonitor.progress for partial results,
+    so waiting costs no Redis round trips.
+    If JOB_WAIT_SHARED_SUBSCRIPTION is True, the app's notifier.JobNotifier
+    for the job's shard wakes the request, else the request subscribes to
+    the job's channel itself, holding a Redis connection while it waits.
+    Return True if a change was received, else False.
+
+    Keyword arguments:
+    job_id -- ID of the job to wait on
+    timeout -- Maximum number of seconds to wait
+    sequence -- Number of the last partial result of the job the caller has
+                seen, as from fetch_job_version (default: None)
+    poll -- Whether to record a poll of the job before waiting, as by
+            record_poll (default: False)
+    """
+    if current_app.config['JOB_WAIT_SHARED_SUBSCRIPTION']:
+        job_notifier = current_app.job_notifiers[
+            current_app.shards.index(job_id)
+        ]
+        job_notifier.start()
+        with job_notifier.subscription(job_id) as event:
+            # The job may have changed before we subscribed
+            status, _, latest = fetch_job_version(job_id, poll)
+            if as_text(status) not in PENDING_STATUSES or latest != sequence:
+                return True
+            # Event.wait returns None before Python 2.7
+            event.wait(timeout)
+            return event.is_set()
+    pubsub = current_app.shards.for_job(job_id).pubsub(
+        ignore_subscribe_messages=True
+    )
+    try:
+        pubsub.subscribe(start_worker.job_channel(job_id))
+        # The job may have changed before we subscribed
+        status, _, latest = fetch_job_version(job_id, poll)
+        if as_text(status) not in PENDING_STATUSES or latest != sequence:
+            return True
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if pubsub.get_message() is not None:
+                return True
+            time.sleep(WAIT_INTERVAL)
+        return False
+    finally:
+        pubsub.close()
+
+
+def wait_for_jobs(job_ids, timeout, check):
+    """Return check(), called once subscribed to the channels of the jobs,
+    if it returns anything but None, else block until any of the jobs has a
+    message, or for timeout seconds, and return check() again, or None if
+    no job had a message.
+
+    The jobs are waited on as by wait_for_job, with a single subscription
+    per shard when JOB_WAIT_SHARED_SUBSCRIPTION is False.
+    """
+    shards = current_app.shards
+    groups = {}
+    for job_id in job_ids:
+        groups.setdefault(shards.index(job_id), []).append(job_id)
+    if current_app.config['JOB_WAIT_SHARED_SUBSCRIPTION']:
+        event = threading.Event()
+        try:
+            for index, ids in groups.items():
+                job_notifier = current_app.job_notifiers[index]
+                job_notifier.start()
+                for job_id in ids:
+                    job_notifier.add(job_id, event)
+            # The jobs may have changed before we subscribed
+            result = check()
+            if result is not None:
+                return result
+            event.wait(timeout)
+            return check() if event.is_set() else None
+        finally:
+            for index, ids in groups.items():
+                for job_id in ids:
+                    current_app.job_notifiers[index].remove(job_id, event)
+    pubsubs = []
+    try:
+        for index, ids in groups.items():
+            pubsub = shards.connections[index].pubsub(
+                ignore_subscribe_messages=True
+            )
+            pubsubs.append(pubsub)
+            pubsub.subscribe(*[start_worker.job_channel(job_id)
+                               for job_id in ids])
+        # The jobs may have changed before we subscribed
+        result = check()
+        if result is not None:
+            return result
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if any(pubsub.get_message() is not None for pubsub in pubsubs):
+                return check()
+            time.sleep(WAIT_INTERVAL)
+        return None
+    finally:
+        for pubsub in pubsubs:
+            pubsub.close()
+
+
+def fetch_job(job_id):
+    """Return the job from its shard, or None if it doesn't exist.
+
+    Fetching the job unpickles its result, from the result store if there is
+    one, so the time taken is recorded by the profiler.
+    """
+    shards = current_app.shards
+    with profiling.section('fetch_job'):
+        try:
+            job = g.queue.job_class.fetch(job_id,
+                                          connection=shards.for_job(job_id))
+        except NoSuchJobError:
+            return None
+        if shards.results is not None and \
+                job.get_status() == Status.FINISHED:
+            [stored] = sharding.fetch_results(None, [job_id], shards.results)
+            job._result = unpickle(stored) if stored else None
+        return job
+
+
+def server_sent_event(data):
+    """Return data as the JSON payload of a Server-Sent Event message."""
+    return 'data: {0}\n\n'.format(json.dumps(data))
+
+
+def create_connection_pool(app, url):
+    """Return the connection pool of the Redis server at the URL, sized by
+    the app's configuration."""
+    return start_worker.create_connection_pool(
+        url,
+        max_connections=app.config['REDIS_MAX_CONNECTIONS'],
+        timeout=app.config['REDIS_POOL_TIMEOUT'],
+        socket_timeout=app.config['REDIS_SOCKET_TIMEOUT']
+    )
+
+
+def create_connection(pool):
+    """Return a connection from the pool, profiled by jobmonitor.profiling.
+    """
+    return profiling.instrument_redis(start_worker.create_connection(pool))
+
+
+def use_shards(app, shards):
+    """Store the app's jobs on the shards, a sharding.Shards.
+
+    The queues and app.redis are those of the primary shard, and each shard
+    has its own notifier.JobNotifier.
+    """
+    app.shards = shards
+    app.redis = shards.primary
+    app.queues = dict(
+        (name, rq.Queue(name, connection=app.redis))
+        for name in app.config['QUEUES']
+    )
+    # Started by the first request to wait on a job of their shard
+    app.job_notifiers = [notifier.JobNotifier(connection)
+                         for connection in shards]
+    app.job_notifier = app.job_notifiers[0]
+
+
+@jobs.record_once
+def initialise_connection(state):
+    """Create the Redis connection pools and queues shared by all requests.
+
+    Jobs are stored on the Redis servers of REDIS_SHARD_URLS, if it is set,
+    else on the one at REDIS_URL, with their results on the server at
+    RESULT_REDIS_URL if it is set, as described in jobmonitor.sharding.
+    """
+    app = state.app
+    urls = app.config['REDIS_SHARD_URLS'] or [app.config['REDIS_URL']]
+    pools = [create_connection_pool(app, url) for url in urls]
+    # The pool of the primary shard, as reported by GET /jobs/stats
+    app.redis_pool = pools[0]
+    connections = [create_connection(pool) for pool in pools]
+    result_url = app.config['RESULT_REDIS_URL']
+    results = None
+    if result_url is not None:
+        results = create_connection(create_connection_pool(app, result_url))
+    use_shards(app, sharding.Shards(connections, results))
+    app.result_cache = LRUCache(app.config['RESULT_CACHE_SIZE'])
+
+
 @jobs.before_request
 def initialise_queue():
-    g.queue = rq.Queue(connection=start_worker.create_connection())
+    """Make the default queue of the primary shard the request's queue.
+
+    Jobs are fetched from their own shard, as by fetch_job, whichever queue
+    this is.
+    """
+    g.queue = current_app.queues[current_app.config['DEFAULT_QUEUE']]
+
+
+def fetch_queue_page(shards, key, offset, limit):
+    """Return the IDs of a page of the jobs in the queue with the key, and
+    the number of jobs in the queue.
+
+    The queue on each shard follows that of the shard before it, so with a
+    single shard the page is that of its queue, fetched along with the queue
+    length in one round trip.
+    Otherwise, the lengths of the queue on every shard are fetched with the
+    page of the primary's queue, and the rest of the page is fetched from
+    the other shards if it doesn't fit.
+    """
+    pipelines = shards.pipelines()
+    pipelines.primary.lrange(key, offset, offset + limit - 1)
+    for index in range(len(shards)):
+        pipelines.on(index).llen(key)
+    replies = pipelines.execute()
+    job_ids = next(replies[0])
+    lengths = [next(r) for r in replies]
+    # Position of the first job of each shard's queue in the whole queue
+    start = lengths[0]
+    pipelines = shards.pipelines()
+    for index, length in enumerate(lengths[1:], 1):
+        first = max(offset, start)
+        last = min(offset + limit, start + length)
+        if first < last:
+            pipelines.on(index).lrange(key, first - start, last - start - 1)
+        start += length
+    for replies in pipelines.execute()[1:]:
+        for page in replies:
+            job_ids = job_ids + page
+    return [as_text(job_id) for job_id in job_ids], sum(lengths)
+
+
+@jobs.route('/jobs/stats', methods=['GET'])
+def get_stats():
+    """Return connection pool and resolver cache usage, and the number of
+    jobs in each queue, on all shards."""
+    shards = current_app.shards
+    names = sorted(current_app.queues)
+    pipelines = shards.pipelines()
+    for index in range(len(shards)):
+        for name in names:
+            pipelines.on(index).llen(current_app.queues[name].key)
+    queues = dict((name, 0) for name in names)
+    for replies in pipelines.execute():
+        for name, length in zip(names, replies):
+            queues[name] += length
+    return jsonify(dict(
+        redis_pool=start_worker.connection_pool_stats(current_app.redis_pool),
+        job_resolver_cache=current_app.job_resolver_stats(),
+        queues=queues
+    ))
 
 
 @jobs.route('/jobs', methods=['GET'])
 def get_jobs():
-    jobs = [serialize_job(j) for j in g.queue.get_jobs()]
-    return jsonify({'jobs': jobs})
+    """Return a page of the jobs in a queue.
+
+    The queue is named by the `queue` query parameter, defaulting to
+    DEFAULT_QUEUE, and is listed across all shards, as by fetch_queue_page.
+    The page starts at the `offset` query parameter, defaulting to 0, and
+    contains at most `limit` jobs, defaulting to JOBS_PAGE_SIZE and capped by
+    JOBS_PAGE_SIZE_MAX.
+    The `fields` query parameter is a comma-separated list of the fields to
+    send for each job, defaulting to DEFAULT_LIST_FIELDS, so `result` is only
+    sent if requested.
+    The `next` URI fetches the following page, and is null on the last page.
+    The ETag of the response changes whenever a job is added to or removed
+    from the page, or changes status, and a matching If-None-Match gets a 304
+    without any results being fetched.
+
+    If the `ids` query parameter is given, the jobs with those
+    comma-separated IDs are sent instead, as by fetch_changed_jobs, leaving
+    out those whose version is given by the comma-separated `versions`
+    query parameter, in the same order as the IDs, and waiting for a change
+    for up to `wait` seconds, as by changed_jobs_response.
+    """
+    if 'ids' in request.args:
+        job_ids = request.args['ids'].split(',')
+        known = request.args.get('versions', '').split(',')
+        known += [''] * (len(job_ids) - len(known))
+        return changed_jobs_response([
+            (job_id, version or None)
+            for job_id, version in zip(job_ids, known) if job_id
+        ])
+    queue = current_app.queues.get(
+        request.args.get('queue', current_app.config['DEFAULT_QUEUE'])
+    )
+    if queue is None:
+        abort(404)
+    offset = request.args.get('offset', 0, type=int)
+    limit = min(
+        request.args.get('limit', current_app.config['JOBS_PAGE_SIZE'],
+                         type=int),
+        current_app.config['JOBS_PAGE_SIZE_MAX']
+    )
+    if offset < 0 or limit < 1:
+        return jsonify(dict(
+            message='Offset must be positive and limit greater than zero'
+        )), 400
+    if 'fields' in request.args:
+        fields = [f for f in request.args['fields'].split(',') if f]
+    else:
+        fields = DEFAULT_LIST_FIELDS
+    for field in fields:
+        if field not in JOB_FIELDS + ('id', 'uri'):
+            return jsonify(dict(
+                message='Invalid field `{0}`'.format(field)
+            )), 400
+    job_ids, total = fetch_queue_page(current_app.shards, queue.key, offset,
+                                      limit)
+    # Results are only fetched once the page is known to have changed
+    hash_fields = [f for f in fields if f in JOB_FIELDS and f != 'result']
+    hashes = fetch_job_hashes(
+        current_app.shards, job_ids,
+        hash_fields + [f for f in VERSION_FIELDS if f not in hash_fields]
+    )
+    versions = []
+    for h in hashes:
+        versions.extend([h['id']] + [h.get(f) for f in VERSION_FIELDS])
+    etag = make_etag(total, *versions)
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
+    if 'result' in fields:
+        fetch_job_results(current_app.shards, hashes)
+    jobs = [serialize_job_hash(h, fields) for h in hashes]
+    if offset + limit < total:
+        args = request.args.to_dict()
+        args.update(offset=offset + limit, limit=limit)
+        next_uri = url_for('jobs.get_jobs', _external=True, **args)
+    else:
+        next_uri = None
+    response = jsonify(dict(
+        jobs=jobs, offset=offset, limit=limit, total=total, next=next_uri
+    ))
+    return set_cache_headers(response, etag, finished=False)
+
+
+def admit(calls):
+    """Return the ID of the client submitting the calls, and a 429 response
+    if the submission is rejected by admission control, else None.
+
+    The client ID is None unless CLIENT_INFLIGHT_MAX is set, so that jobs
+    are only counted as pending for their client when that is limited.
+    """
+    config = current_app.config
+    client = admission.client_id(request, config['CLIENT_ID_HEADER'],
+                                 config['CLIENT_ID_PROXIES'])
+    rejection = admission.check(current_app.shards, config, client, calls)
+    if config['CLIENT_INFLIGHT_MAX'] is None:
+        client = None
+    if rejection is None:
+        return client, None
+    reason, message, retry_after = rejection
+    metrics.JOBS_REJECTED.inc(reason=reason)
+    response = jsonify(dict(message=message))
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return client, response
+
+
+@jobs.route('/jobs/status', methods=['POST'])
+def get_job_statuses():
+    """Return the jobs in the `jobs` object of the request that changed.
+
+    The object maps job IDs to the `version` of the job the client has, or
+    null for jobs it has not seen, and the response holds the `jobs` whose
+    version is different, as by fetch_changed_jobs, and the IDs of the jobs
+    that do not exist as `missing`.
+    Clients watching many jobs poll them all with one request, rather than
+    one request per job, and with a `wait` query parameter the request is
+    held until any of the jobs changes, as by changed_jobs_response.
+    """
+    data = request.get_json()
+    if not data:
+        abort(400)
+    versions = data.get('jobs') if isinstance(data, dict) else None
+    if not isinstance(versions, dict):
+        return jsonify(dict(message='No object of jobs provided')), 400
+    for job_id, version in versions.items():
+        if version is not None and not isinstance(version, string_types):
+            return jsonify(dict(
+                message='Invalid version of job `{0}`'.format(job_id)
+            )), 400
+    return changed_jobs_response(sorted(versions.items()))
 
 
 @jobs.route('/jobs', methods=['POST'])
@@ -51,32 +1122,294 @@ def create_job():
     # TODO when Flask 0.11 is released, use request.is_json instead
     if not data:
         abort(400)
-    # Try read the task name and load the task, returning a 400 error on fail
+    # Resolve the task in to a job, returning a 400 error on fail
     try:
-        task_name = data['task_name']
-    except KeyError:
-        return jsonify(dict(
-            message='No task name provided'
-        )), 400
-    # Try to resolve the task name in to job name, 400 if left unresolved
-    jname = current_app.resolve_job(task_name)
-    if jname is None:
+        resolved, args = resolve_task(data)
+    except InvalidTaskError as e:
+        return jsonify(dict(message=str(e))), 400
+    client, rejected = admit([(resolved, args)])
+    if rejected is not None:
+        return rejected
+    [(job_id, status, created)] = submit_jobs(current_app.queues,
+                                              [(resolved, args)], client)
+    if created:
+        # New jobs are known to be queued, so skip the Redis round trips
+        job = serialize_job_hash(dict(id=job_id, status=status),
+                                 ('id', 'uri', 'status', 'result'))
+        return jsonify(dict(job=job)), 201
+    # Send the existing job, which may have a result already
+    job = fetch_job(job_id)
+    if job is None:
+        abort(404)
+    d = serialize_job(job, fetch_job_partial(job))
+    return jsonify(dict(job=d)), 200
+
+
+@jobs.route('/jobs/batch', methods=['POST'])
+def create_jobs():
+    """Enqueue a job for each task in the `jobs` list of the request.
+
+    Every task is validated before any job is enqueued, and all valid tasks
+    are then enqueued in one Redis transaction, as by submit_jobs.
+    The response `jobs` list has an entry per task, in the same order, with
+    either a `job` key holding the new job or a `message` key describing why
+    the task is invalid.
+    If no task is valid, the status code is 400.
+    The valid tasks are admitted or rejected together, as by admit.
+    """
+    data = request.get_json()
+    if not data:
+        abort(400)
+    tasks = data.get('jobs') if isinstance(data, dict) else None
+    if not isinstance(tasks, list) or not tasks:
+        return jsonify(dict(message='No list of jobs provided')), 400
+    if len(tasks) > current_app.config['JOBS_BATCH_SIZE_MAX']:
         return jsonify(dict(
-            message='Invalid task name `{0}`'.format(task_name)
+            message='At most {0} jobs can be submitted at once'.format(
+                current_app.config['JOBS_BATCH_SIZE_MAX']
+            )
         )), 400
-    # Enqueue the task, passing empty arguments if none were provided
-    args = data.get('args', {})
-    job = g.queue.enqueue(jname, **args)
-    return jsonify(dict(job=serialize_job(job))), 201
+    items = []
+    calls = []
+    for task in tasks:
+        try:
+            calls.append(resolve_task(task))
+            items.append(None)
+        except InvalidTaskError as e:
+            items.append(dict(message=str(e)))
+    if not calls:
+        return jsonify(dict(jobs=items)), 400
+    client, rejected = admit(calls)
+    if rejected is not None:
+        return rejected
+    submitted = iter(submit_jobs(current_app.queues, calls, client))
+    for i, item in enumerate(items):
+        if item is None:
+            job_id, status, created = next(submitted)
+            job_hash = dict(id=job_id, status=status)
+            items[i] = dict(job=serialize_job_hash(job_hash,
+                                                   DEFAULT_LIST_FIELDS))
+    return jsonify(dict(jobs=items)), 201
 
 
 @jobs.route('/jobs/<job_id>', methods=['GET'])
 def get_job(job_id):
-    # Try to fetch the job, 404'ing if it's not found
-    job = g.queue.fetch_job(job_id)
+    """Return the job.
+
+    A started job that published a partial result sends the latest one as
+    its `partial`, as by serialize_job.
+    If the `wait` query parameter is given, a pending job is held for up to
+    that many seconds, capped by JOB_WAIT_MAX, until it completes or
+    publishes a partial result.
+    The ETag of the response is derived from the job's status, completion
+    time, and partial result number, and a matching If-None-Match gets a 304
+    without the job's result being fetched, so a client long-polling with its
+    last ETag gets a 304 if the job did not change while waiting.
+    Each request counts as a poll of the job, as by record_poll.
+    """
+    status, ended_at, sequence = fetch_job_version(job_id, poll=True)
+    if status is None:
+        abort(404)
+    wait = min(request.args.get('wait', 0, type=float),
+               current_app.config['JOB_WAIT_MAX'])
+    if wait > 0 and as_text(status) in PENDING_STATUSES:
+        if wait_for_job(job_id, wait, sequence):
+            status, ended_at, sequence = fetch_job_version(job_id)
+            if status is None:
+                abort(404)
+    etag = make_etag(job_id, status, ended_at, sequence)
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
+    job = fetch_job(job_id)
     if job is None:
         abort(404)
-    return jsonify(dict(job=serialize_job(job)))
+    partial = fetch_job_partial(job)
+    d = serialize_job(job, partial)
+    # Tag the job as it was fetched, in case it changed since it was checked
+    ended_at = utcformat(job.ended_at) if job.ended_at else None
+    sequence = partial['sequence'] if partial is not None else None
+    etag = make_etag(job_id, d['status'], ended_at, sequence)
+    return set_cache_headers(jsonify(dict(job=d)), etag,
+                             finished=d['status'] == Status.FINISHED)
+
+
+@jobs.route('/jobs/<job_id>', methods=['DELETE'])
+def delete_job(job_id):
+    """Cancel the job if it has not completed, else delete it.
+
+    A queued job is removed from its queue and its status set to
+    `cancelled`, to be deleted after JOB_CANCELLED_TTL seconds, and the
+    status is published on the job's channel, waking requests waiting on
+    the job.
+    The worker running a started job is asked to cancel it, which it does
+    within start_worker.CANCEL_CHECK_INTERVAL seconds, so the response has
+    the status code 202 and the job's status is still `started`.
+    Completed jobs are deleted along with their results, and the response
+    has the status code 204.
+    Cancelling the merge job of a split job cancels its chunks, as
+    described in jobmonitor.fanout, and a queued merge job, which is not on
+    its queue until its chunks finish, is cancelled by taking its chunks off
+    the queue.
+    """
+    connection = current_app.shards.for_job(job_id)
+    key = rq.job.Job.key_for(job_id)
+    status, origin, meta = connection.hmget(key, ['status', 'origin', 'meta'])
+    if status is None:
+        abort(404)
+    status = as_text(status)
+    uri = url_for('jobs.get_job', job_id=job_id, _external=True)
+    if status == Status.QUEUED:
+        queue_key = rq.Queue.redis_queue_namespace_prefix + as_text(origin)
+        if connection.lrem(queue_key, 1, job_id) or \
+                fanout.cancel_chunks(connection, job_id, queue_key):
+            start_worker.mark_cancelled(connection, job_id)
+            connection.publish(start_worker.job_channel(job_id),
+                               start_worker.CANCELLED)
+            client = unpickle(meta).get('client') if meta else None
+            if client is not None:
+                connection.zrem(start_worker.inflight_key(client), job_id)
+            job = dict(id=job_id, uri=uri, status=start_worker.CANCELLED)
+            return jsonify(dict(job=job)), 200
+        # A worker took the job before it could be removed
+        status = Status.STARTED
+    if status == Status.STARTED:
+        start_worker.request_cancel(connection, job_id)
+        job = dict(id=job_id, uri=uri, status=status)
+        return jsonify(dict(job=job)), 202
+    connection.delete(key, start_worker.partial_key(job_id),
+                      start_worker.poll_key(job_id))
+    if current_app.shards.results is not None:
+        current_app.shards.results.delete(sharding.result_key(job_id))
+    return Response(status=204)
+
+
+def render_result(value, format, compress):
+    """Return the body and Content-Encoding of a job result response.
+
+    Results already stored in the requested format and compression are sent
+    as they are, without decoding them.
+
+    Keyword arguments:
+    value -- Result of the job, as stored by rq
+    format -- Either `json` or `binary`, for the `arrays` codec
+    compress -- Whether to gzip-compress the body
+    """
+    encoded = isinstance(value, results.EncodedResult)
+    if format == 'binary':
+        if encoded and value.codec == 'arrays':
+            if compress and value.compression == 'gzip':
+                return value.data, 'gzip'
+            body = results.decompress(value)
+        else:
+            body = results.codecs['arrays'].encode(results.decode(value))
+    else:
+        body = json.dumps(results.decode(value)).encode('utf-8')
+    if compress:
+        return results.gzip(body), 'gzip'
+    return body, None
+
+
+@jobs.route('/jobs/<job_id>/result', methods=['GET'])
+def get_job_result(job_id):
+    """Return the result of a finished job.
+
+    The result is sent as JSON, or with `format=binary` in the `arrays`
+    format of jobmonitor.results.
+    The response is gzip-compressed if the client accepts it, and has an
+    ETag fixed by the job's completion time and the content coding, so a
+    client sending it back in If-None-Match gets a 304 without the result
+    being read.
+    The last RESULT_CACHE_SIZE bodies are cached, so repeated requests are
+    not serialised again.
+    Jobs are only finished once their completion time is saved, as by
+    reported_status, so a result is never sent before it is stored.
+    """
+    format = request.args.get('format', 'json')
+    if format not in ('json', 'binary'):
+        return jsonify(dict(
+            message='Invalid format `{0}`'.format(format)
+        )), 400
+    key = rq.job.Job.key_for(job_id)
+    status, ended_at = current_app.shards.for_job(job_id).hmget(
+        key, ['status', 'ended_at']
+    )
+    if status is None:
+        abort(404)
+    if reported_status(status, ended_at) != Status.FINISHED:
+        return jsonify(dict(
+            message='Job `{0}` has not finished'.format(job_id)
+        )), 404
+    compress = request.accept_encodings['gzip'] > 0
+    # The gzipped and identity bodies differ, so must have different ETags
+    etag = make_etag(job_id, ended_at, format,
+                     'gzip' if compress else 'identity')
+    if request.if_none_match.contains(etag):
+        return not_modified(etag)
+    cached = current_app.result_cache.get(etag)
+    if cached is None:
+        [stored] = current_app.shards.fetch_results([job_id])
+        value = unpickle(stored) if stored else None
+        try:
+            cached = render_result(value, format, compress)
+        except (TypeError, ValueError):
+            return jsonify(dict(
+                message='Result cannot be sent as `{0}`'.format(format)
+            )), 400
+        # Only stored results are cached, in case the result was missing
+        if stored:
+            current_app.result_cache.set(etag, cached)
+    body, encoding = cached
+    if format == 'binary':
+        mimetype = results.ArrayCodec.content_type
+    else:
+        mimetype = 'application/json'
+    response = set_cache_headers(Response(body, mimetype=mimetype), etag,
+                                 finished=True)
+    response.headers['Vary'] = 'Accept-Encoding'
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+@jobs.route('/jobs/<job_id>/events', methods=['GET'])
+def get_job_events(job_id):
+    """Stream the job as Server-Sent Events until it completes.
+
+    The job is sent once immediately, and again each time its status changes
+    or it publishes a partial result.
+    The job is counted as polled, as by record_poll, for as long as the
+    stream is open.
+    The stream is closed once the job completes, or after JOB_EVENTS_TIMEOUT
+    seconds, with a comment sent every JOB_EVENTS_KEEPALIVE seconds to keep
+    the connection open.
+    """
+    job = fetch_job(job_id)
+    if job is None:
+        abort(404)
+    timeout = current_app.config['JOB_EVENTS_TIMEOUT']
+    keepalive = current_app.config['JOB_EVENTS_KEEPALIVE']
+
+    def events(job):
+        deadline = time.time() + timeout
+        partial = fetch_job_partial(job)
+        d = serialize_job(job, partial)
+        yield server_sent_event(dict(job=d))
+        while d['status'] in PENDING_STATUSES and time.time() < deadline:
+            wait = min(keepalive, deadline - time.time())
+            sequence = partial['sequence'] if partial is not None else None
+            if not wait_for_job(job_id, wait, sequence, poll=True):
+                yield ': keepalive\n\n'
+                continue
+            job = fetch_job(job_id)
+            if job is None:
+                break
+            partial = fetch_job_partial(job)
+            d = serialize_job(job, partial)
+            yield server_sent_event(dict(job=d))
+
+    return Response(stream_with_context(events(job)),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache'})
 
 
 @jobs.errorhandler(400)
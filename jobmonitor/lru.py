@@ -0,0 +1,104 @@
+"""lru
+A thread-safe, size-limited cache that evicts the least recently used item.
+"""
+import threading
+
+# Indices of the previous link, next link, key, and value in a link
+PREV, NEXT, KEY, VALUE = 0, 1, 2, 3
+
+
+class LRUCache(object):
+    """A mapping of keys to values holding at most maxsize items.
+
+    When the cache is full, adding an item evicts the item that was least
+    recently retrieved or added.
+    Items are kept in a circular doubly linked list, ordered from the least
+    to the most recently used, so all operations take constant time.
+
+    The number of successful (hits) and unsuccessful (misses) calls to get
+    are counted, and returned by stats.
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._links = {}
+        # The root link sits between the most and least recently used items
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+
+    def __len__(self):
+        return len(self._links)
+
+    def __contains__(self, key):
+        return key in self._links
+
+    def _unlink(self, link):
+        link[PREV][NEXT] = link[NEXT]
+        link[NEXT][PREV] = link[PREV]
+
+    def _append(self, link):
+        """Insert link as the most recently used item."""
+        last = self._root[PREV]
+        link[PREV] = last
+        link[NEXT] = self._root
+        last[NEXT] = self._root[PREV] = link
+
+    def get(self, key, default=None):
+        """Return the value of key, marking it as the most recently used."""
+        with self._lock:
+            link = self._links.get(key)
+            if link is None:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._unlink(link)
+            self._append(link)
+            return link[VALUE]
+
+    def set(self, key, value):
+        """Store value under key, evicting the least recently used item if
+        the cache is full."""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            link = self._links.get(key)
+            if link is not None:
+                self._unlink(link)
+                link[VALUE] = value
+            else:
+                if len(self._links) >= self.maxsize:
+                    oldest = self._root[NEXT]
+                    self._unlink(oldest)
+                    del self._links[oldest[KEY]]
+                link = [None, None, key, value]
+                self._links[key] = link
+            self._append(link)
+
+    def pop(self, key, default=None):
+        """Remove key from the cache, returning its value."""
+        with self._lock:
+            link = self._links.pop(key, None)
+            if link is None:
+                return default
+            self._unlink(link)
+            return link[VALUE]
+
+    def clear(self):
+        """Remove all items from the cache.
+
+        The hit and miss counters are not reset.
+        """
+        with self._lock:
+            self._links.clear()
+            self._root[:] = [self._root, self._root, None, None]
+
+    def stats(self):
+        """Return a dictionary of the cache's size and hit/miss counters."""
+        return dict(
+            size=len(self._links),
+            maxsize=self.maxsize,
+            hits=self.hits,
+            misses=self.misses
+        )
@@ -0,0 +1,369 @@
+"""metrics
+Prometheus-style metrics of the jobs API, job resolution, Redis, the queues,
+and the workers, served at /metrics in the Prometheus text format.
+
+Metrics of the web application are held in memory by each server process,
+so a scrape sees the requests handled by the process that answers it.
+Job durations are recorded in Redis by the workers started by start_worker,
+and queue and worker states are read from Redis on each scrape, so these are
+the same whichever process answers.
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import (
+    # Blueprint creation
+    Blueprint,
+    # Build the plain text response
+    Response,
+    # The app handling the current request
+    current_app,
+    # Raise HTTP error code exceptions
+    abort,
+    # Store the request start time
+    g,
+    # The request context
+    request
+)
+
+# Histogram buckets, in seconds, of HTTP request durations
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10,
+                   30)
+# Histogram buckets, in seconds, of task name resolution durations
+RESOLUTION_BUCKETS = (1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 0.01, 0.05, 0.1)
+# Histogram buckets, in seconds, of job run durations
+JOB_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+# Redis hash holding the job duration histograms recorded by workers
+JOB_DURATION_KEY = 'jobmonitor:metrics:job_duration'
+
+INF = float('inf')
+
+
+def _format_value(value):
+    if value == INF:
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{0}="{1}"'.format(name, str(value).replace('\\', r'\\')
+                           .replace('\n', r'\n').replace('"', r'\"'))
+        for name, value in labels
+    ) + '}'
+
+
+class Metric(object):
+    """A named metric, with one value per combination of label values."""
+    type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError('Labels of {0} must be {1}'.format(
+                self.name, ', '.join(self.labelnames)
+            ))
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """Return a list of (name, labels, value) tuples, where labels is a
+        list of (name, value) tuples."""
+        with self._lock:
+            return [(self.name, list(zip(self.labelnames, key)), value)
+                    for key, value in sorted(self._values.items())]
+
+    def render(self):
+        """Return the metric in the Prometheus text format."""
+        lines = [
+            '# HELP {0} {1}'.format(self.name, self.documentation),
+            '# TYPE {0} {1}'.format(self.name, self.type)
+        ]
+        for name, labels, value in self.samples():
+            lines.append('{0}{1} {2}'.format(
+                name, _format_labels(labels), _format_value(value)
+            ))
+        return '\n'.join(lines) + '\n'
+
+
+class Counter(Metric):
+    """A metric that only goes up."""
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A metric that can be set to any value."""
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    """A metric counting observations in to buckets of their value.
+
+    The value of each label combination is a list of the cumulative count of
+    each bucket, followed by the sum of all observations.
+    """
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(),
+                 buckets=REQUEST_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (INF,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * len(self.buckets) + [0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-1] += value
+
+    def load(self, counts, total, **labels):
+        """Set the cumulative bucket counts and sum of the labels."""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = list(counts) + [total]
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds taken by the body of the with statement."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(time.time() - start, **labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, state in items:
+            labels = list(zip(self.labelnames, key))
+            for bound, count in zip(self.buckets, state):
+                samples.append((self.name + '_bucket',
+                                labels + [('le', _format_value(bound))],
+                                count))
+            samples.append((self.name + '_sum', labels, state[-1]))
+            samples.append((self.name + '_count', labels, state[-2]))
+        return samples
+
+
+class Registry(object):
+    """Metrics to render, and collectors that create metrics on a scrape.
+
+    A collector is a function taking the app and returning a list of
+    metrics.
+    """
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, func):
+        """Decorator adding func as a collector."""
+        self.collectors.append(func)
+        return func
+
+    def render(self, app):
+        """Return all metrics in the Prometheus text format."""
+        metrics = list(self.metrics)
+        for collector in self.collectors:
+            metrics.extend(collector(app))
+        return ''.join(m.render() for m in metrics)
+
+
+REGISTRY = Registry()
+
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    'jobmonitor_http_request_duration_seconds',
+    'Seconds taken to handle HTTP requests.',
+    ['endpoint', 'method']
+))
+REQUESTS = REGISTRY.register(Counter(
+    'jobmonitor_http_requests_total',
+    'HTTP requests handled.',
+    ['endpoint', 'method', 'status']
+))
+JOBS_SUBMITTED = REGISTRY.register(Counter(
+    'jobmonitor_jobs_submitted_total',
+    'Jobs submitted, and whether an existing job was reused.',
+    ['queue', 'reused']
+))
+JOBS_REJECTED = REGISTRY.register(Counter(
+    'jobmonitor_jobs_rejected_total',
+    'Job submissions rejected by admission control.',
+    ['reason']
+))
+JOB_RESOLUTION_DURATION = REGISTRY.register(Histogram(
+    'jobmonitor_job_resolution_seconds',
+    'Seconds taken to resolve task names in to jobs.',
+    buckets=RESOLUTION_BUCKETS
+))
+REDIS_ROUND_TRIPS = REGISTRY.register(Counter(
+    'jobmonitor_redis_round_trips_total',
+    'Commands and pipelines sent to Redis.'
+))
+
+
+def _job_duration_field(task, status, name):
+    return json.dumps([task, status, name])
+
+
+def record_job_duration(connection, task, status, duration):
+    """Add the duration of a job to the histograms in JOB_DURATION_KEY.
+
+    Keyword arguments:
+    connection -- Redis connection
+    task -- Name of the function the job ran
+    status -- Status the job ended with
+    duration -- Seconds the job ran for
+    """
+    pipeline = connection.pipeline(transaction=False)
+    for bound in JOB_BUCKETS + (INF,):
+        if duration <= bound:
+            pipeline.hincrby(JOB_DURATION_KEY, _job_duration_field(
+                task, status, _format_value(bound)
+            ))
+    pipeline.hincrby(JOB_DURATION_KEY,
+                     _job_duration_field(task, status, 'count'))
+    # The sum is kept in microseconds, as HINCRBY only adds integers
+    pipeline.hincrby(JOB_DURATION_KEY,
+                     _job_duration_field(task, status, 'sum_us'),
+                     int(round(duration * 1e6)))
+    pipeline.execute()
+
+
+@REGISTRY.collector
+def collect_job_durations(app):
+    histogram = Histogram(
+        'jobmonitor_job_duration_seconds',
+        'Seconds taken by workers to run jobs, by task and final status.',
+        ['task', 'status'],
+        buckets=JOB_BUCKETS
+    )
+    # Workers record the durations on their own shard
+    states = {}
+    for connection in app.shards:
+        for field, value in connection.hgetall(JOB_DURATION_KEY).items():
+            task, status, name = json.loads(field.decode('utf-8'))
+            state = states.setdefault((task, status), {})
+            state[name] = state.get(name, 0) + int(value)
+    for (task, status), state in states.items():
+        counts = [state.get(_format_value(bound), 0)
+                  for bound in histogram.buckets]
+        histogram.load(counts, state.get('sum_us', 0) / 1e6,
+                       task=task, status=status)
+    return [histogram]
+
+
+@REGISTRY.collector
+def collect_queues(app):
+    queued = Gauge('jobmonitor_queue_jobs', 'Jobs waiting in each queue.',
+                   ['queue'])
+    failed = Gauge('jobmonitor_failed_jobs', 'Jobs in the failed queue.')
+    workers = Gauge('jobmonitor_workers', 'rq workers in each state.',
+                    ['state'])
+    # Imported here, so that the app only loads rq along with the jobs API
+    import rq
+    names = sorted(app.queues)
+    failed_key = rq.get_failed_queue(connection=app.redis).key
+    lengths = dict((name, 0) for name in names)
+    failed_count = 0
+    counts = {}
+    # Every shard has its own queues and workers
+    for connection in app.shards:
+        pipeline = connection.pipeline(transaction=False)
+        for name in names:
+            pipeline.llen(app.queues[name].key)
+        pipeline.llen(failed_key)
+        pipeline.smembers(rq.Worker.redis_workers_keys)
+        values = pipeline.execute()
+        for name, length in zip(names, values):
+            lengths[name] += length
+        failed_count += values[-2]
+        pipeline = connection.pipeline(transaction=False)
+        for key in values[-1]:
+            pipeline.hget(key, 'state')
+        for state in pipeline.execute():
+            # Workers that died without cleaning up have no state
+            if state is not None:
+                state = state.decode('utf-8')
+                counts[state] = counts.get(state, 0) + 1
+    for name, length in lengths.items():
+        queued.set(length, queue=name)
+    failed.set(failed_count)
+    for state, count in counts.items():
+        workers.set(count, state=state)
+    return [queued, failed, workers]
+
+
+@REGISTRY.collector
+def collect_job_resolver_cache(app):
+    stats = app.job_resolver_stats()
+    hits = Counter('jobmonitor_job_resolver_cache_hits_total',
+                   'Task names resolved from the cache.')
+    hits.inc(stats['hits'])
+    misses = Counter('jobmonitor_job_resolver_cache_misses_total',
+                     'Task names not found in the cache.')
+    misses.inc(stats['misses'])
+    size = Gauge('jobmonitor_job_resolver_cache_size',
+                 'Task names in the cache.')
+    size.set(stats['size'])
+    return [hits, misses, size]
+
+
+metrics = Blueprint('metrics', __name__)
+
+
+@metrics.before_app_request
+def start_request_timer():
+    g.request_started = time.time()
+
+
+@metrics.after_app_request
+def record_request(response):
+    """Record the duration and status of requests to known endpoints."""
+    started = getattr(g, 'request_started', None)
+    if started is not None and request.endpoint is not None:
+        REQUEST_DURATION.observe(time.time() - started,
+                                 endpoint=request.endpoint,
+                                 method=request.method)
+        REQUESTS.inc(endpoint=request.endpoint, method=request.method,
+                     status=response.status_code)
+    return response
+
+
+@metrics.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Return all metrics in the Prometheus text format."""
+    if not current_app.config['METRICS']:
+        abort(404)
+    return Response(REGISTRY.render(current_app),
+                    content_type='text/plain; version=0.0.4; charset=utf-8')
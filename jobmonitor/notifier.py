@@ -0,0 +1,137 @@
+"""notifier
+A single pub/sub subscription, shared by every request in a process, that
+wakes requests waiting on jobs.
+
+Each waiting request would otherwise subscribe to its job's channel on a
+connection of its own, so the number of requests that can wait at once is
+limited by the size of the Redis connection pool. Instead, a background
+thread subscribes to the channels of all jobs (see start_worker.job_channel),
+and sets an Event for each request waiting on a job that has a message.
+
+Under gevent, with the threading module monkey-patched, the thread and the
+events are greenlets, so a single process can hold thousands of long polls
+open.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import redis
+from rq.compat import as_text
+
+from . import start_worker
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of the subscription for new messages
+POLL_INTERVAL = 0.05
+
+# Seconds to wait before subscribing again after losing the connection
+RECONNECT_INTERVAL = 1
+
+# Channel prefix of job channels, and the pattern matching all of them
+CHANNEL_PREFIX = start_worker.job_channel('')
+CHANNEL_PATTERN = CHANNEL_PREFIX + '*'
+
+
+class JobNotifier(object):
+    """Wakes waiters on the jobs that have messages on their channel.
+
+    The subscription is made by a daemon thread started on the first call to
+    start, and is kept for the lifetime of the process.
+
+        with notifier.subscription(job_id) as event:
+            # Check whether the job already changed
+            ...
+            event.wait(timeout)
+    """
+    def __init__(self, connection, poll_interval=None):
+        self.connection = connection
+        if poll_interval is None:
+            poll_interval = POLL_INTERVAL
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        # Map of job IDs to the list of events of their waiters
+        self._waiters = {}
+        self._thread = None
+
+    def start(self):
+        """Start the subscription thread, if it is not running."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self.run)
+            self._thread.daemon = True
+            self._thread.start()
+
+    def run(self):
+        """Subscribe to all job channels and wake waiters on messages,
+        subscribing again if the connection is lost."""
+        while True:
+            try:
+                self.listen()
+            except (redis.ConnectionError, redis.TimeoutError) as e:
+                logger.warning('Lost the job subscription: {0}'.format(e))
+                # Messages may have been missed, so everyone must check again
+                self.notify_all()
+                time.sleep(RECONNECT_INTERVAL)
+
+    def listen(self):
+        pubsub = self.connection.pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.psubscribe(CHANNEL_PATTERN)
+            while True:
+                message = pubsub.get_message()
+                if message is None:
+                    time.sleep(self.poll_interval)
+                    continue
+                channel = as_text(message['channel'])
+                self.notify(channel[len(CHANNEL_PREFIX):])
+        finally:
+            pubsub.close()
+
+    def notify(self, job_id):
+        """Wake everyone waiting on the job."""
+        with self._lock:
+            events = list(self._waiters.get(job_id, ()))
+        for event in events:
+            event.set()
+
+    def notify_all(self):
+        """Wake everyone waiting on any job."""
+        with self._lock:
+            events = [e for events in self._waiters.values() for e in events]
+        for event in events:
+            event.set()
+
+    def waiting(self):
+        """Return the number of waiters."""
+        with self._lock:
+            return sum(len(events) for events in self._waiters.values())
+
+    def add(self, job_id, event):
+        """Set the threading.Event whenever the job has a message, until it
+        is removed."""
+        with self._lock:
+            self._waiters.setdefault(job_id, []).append(event)
+
+    def remove(self, job_id, event):
+        """Stop setting the event for the job's messages, if it was added."""
+        with self._lock:
+            events = self._waiters.get(job_id, [])
+            if event in events:
+                events.remove(event)
+            if not events:
+                self._waiters.pop(job_id, None)
+
+    @contextmanager
+    def subscription(self, job_id):
+        """Return a threading.Event that is set when the job has a message,
+        for the duration of the with statement."""
+        event = threading.Event()
+        self.add(job_id, event)
+        try:
+            yield event
+        finally:
+            self.remove(job_id, event)
@@ -0,0 +1,189 @@
+"""profiling
+Per-request timing breakdowns, a slow request log, and sampled cProfile
+dumps.
+
+When PROFILING is True, or SLOW_REQUEST_THRESHOLD is set, each request gets a
+RequestProfile, which records the time spent in Redis and in named sections
+of the code, such as task resolution and JSON encoding.
+Requests taking longer than SLOW_REQUEST_THRESHOLD seconds are logged with
+their breakdown, and with PROFILE_HEADER the breakdown is sent in the
+X-Profile response header.
+A fraction PROFILE_SAMPLE_RATE of requests are also run under cProfile, with
+the statistics dumped to PROFILE_DIRECTORY, for reading with pstats.
+
+With all of these off, which is the default, the cost is a check for a
+profile on each timed call.
+"""
+import cProfile
+import logging
+import os
+import random
+import time
+from contextlib import contextmanager
+
+from flask import (
+    # The app context, which holds g
+    _app_ctx_stack,
+    # Store the profile of the current request
+    g,
+    # The request context
+    request
+)
+
+logger = logging.getLogger(__name__)
+
+
+class RequestProfile(object):
+    """The time spent by a request in Redis and in named sections.
+
+    Sections may be nested, and Redis commands are timed within them too, so
+    the timings can add up to more than the total.
+    """
+    def __init__(self):
+        self.start = time.time()
+        self.timings = {}
+        self.redis_commands = 0
+        self.redis_round_trips = 0
+        self.profiler = None
+
+    def add(self, name, seconds):
+        self.timings[name] = self.timings.get(name, 0) + seconds
+
+    def add_redis(self, seconds, commands=1):
+        self.add('redis', seconds)
+        self.redis_commands += commands
+        self.redis_round_trips += 1
+
+    def elapsed(self):
+        return time.time() - self.start
+
+    def summary(self):
+        """Return the breakdown as a string, with times in milliseconds."""
+        parts = ['total={0:.1f}ms'.format(self.elapsed() * 1e3)]
+        for name in sorted(self.timings):
+            parts.append('{0}={1:.1f}ms'.format(name,
+                                                self.timings[name] * 1e3))
+        parts.append('redis_commands={0}'.format(self.redis_commands))
+        parts.append('redis_round_trips={0}'.format(self.redis_round_trips))
+        return '; '.join(parts)
+
+
+def current_profile():
+    """Return the RequestProfile of the current request, or None."""
+    ctx = _app_ctx_stack.top
+    if ctx is None:
+        return None
+    return getattr(ctx.g, 'profile', None)
+
+
+@contextmanager
+def section(name):
+    """Add the time taken by the body of the with statement to the profile
+    of the current request, if there is one."""
+    profile = current_profile()
+    if profile is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        profile.add(name, time.time() - start)
+
+
+def instrument_redis(connection):
+    """Time the commands and pipelines sent by the Redis connection in the
+    profile of the current request, returning the connection."""
+    if hasattr(connection, 'execute_command'):
+        execute_command = connection.execute_command
+
+        def profiled_execute_command(*args, **options):
+            profile = current_profile()
+            if profile is None:
+                return execute_command(*args, **options)
+            start = time.time()
+            try:
+                return execute_command(*args, **options)
+            finally:
+                profile.add_redis(time.time() - start)
+        connection.execute_command = profiled_execute_command
+
+    pipeline = connection.pipeline
+
+    def profiled_pipeline(*args, **kwargs):
+        p = pipeline(*args, **kwargs)
+        execute = p.execute
+
+        def profiled_execute(*args, **kwargs):
+            profile = current_profile()
+            if profile is None:
+                return execute(*args, **kwargs)
+            commands = len(getattr(p, 'command_stack', ()))
+            start = time.time()
+            try:
+                return execute(*args, **kwargs)
+            finally:
+                profile.add_redis(time.time() - start, commands)
+        p.execute = profiled_execute
+        return p
+    connection.pipeline = profiled_pipeline
+    return connection
+
+
+def profile_filename(directory):
+    """Return a unique path for the cProfile dump of the current request."""
+    name = '{0:.6f}-{1}-{2}.prof'.format(
+        time.time(), request.method, (request.endpoint or 'none')
+    )
+    return os.path.join(directory, name)
+
+
+def init_app(app):
+    """Register the request hooks that profile requests to the app.
+
+    The hooks are registered by every FlaskWithJobResolvers, including apps
+    that don't load jobmonitor.config, so missing settings are treated as
+    off.
+    """
+    @app.before_request
+    def start_profile():
+        config = app.config
+        rate = config.get('PROFILE_SAMPLE_RATE', 0.0)
+        sample = rate > 0 and random.random() < rate
+        if not (config.get('PROFILING', False) or sample or
+                config.get('SLOW_REQUEST_THRESHOLD') is not None):
+            return
+        g.profile = RequestProfile()
+        if sample:
+            g.profile.profiler = cProfile.Profile()
+            g.profile.profiler.enable()
+
+    @app.after_request
+    def finish_profile(response):
+        profile = getattr(g, 'profile', None)
+        if profile is None:
+            return response
+        config = app.config
+        threshold = config.get('SLOW_REQUEST_THRESHOLD')
+        if threshold is not None and profile.elapsed() > threshold:
+            logger.warning('Slow request {0} {1}: {2}'.format(
+                request.method, request.full_path, profile.summary()
+            ))
+        if config.get('PROFILE_HEADER', False):
+            response.headers['X-Profile'] = profile.summary()
+        return response
+
+    # Flask skips after_request hooks when a view raises, but always runs the
+    # teardown hooks, so the profiler is removed from the thread here
+    @app.teardown_request
+    def stop_profiler(exc):
+        profile = getattr(g, 'profile', None)
+        if profile is None or profile.profiler is None:
+            return
+        profiler, profile.profiler = profile.profiler, None
+        profiler.disable()
+        directory = app.config.get('PROFILE_DIRECTORY')
+        if directory is not None:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            profiler.dump_stats(profile_filename(directory))
@@ -0,0 +1,142 @@
+"""progress
+Partial results published by running jobs.
+
+A long-running job can publish what it has computed so far, such as the
+histograms filled from the files read so far, along with how far through
+the job it is:
+
+    from jobmonitor.progress import publish_partial
+
+    def fill_histograms(paths):
+        histograms = ...
+        for i, path in enumerate(paths):
+            ...
+            publish_partial(histograms, progress=(i + 1.0)/len(paths),
+                            message='Read {0}'.format(path))
+        return histograms
+
+The latest partial result of each job is stored in a Redis hash, encoded
+as start_worker.Job encodes results, and clients waiting on the job are
+woken up on its start_worker.job_channel.
+The jobs API sends the partial with the job for as long as it is pending,
+and the worker deletes it once the job completes.
+"""
+import pickle
+import time
+
+from rq.compat import as_text
+from rq.job import get_current_job, unpickle
+from rq.utils import utcformat, utcnow
+
+from jobmonitor import results, start_worker
+
+# Seconds a partial result is kept after it was last published, in case the
+# worker dies before it can delete it
+PARTIAL_TTL = 3600
+
+# Minimum seconds between publications of partials by a job, by default
+MIN_INTERVAL = 0.5
+
+# Message published on the job's channel when a partial is published
+PROGRESS_MESSAGE = 'progress'
+
+# The job ID and time of the last publication in this process
+_last_published = (None, 0)
+
+
+def publish_partial(result, progress=None, message=None, min_interval=None,
+                    job=None):
+    """Store result as the latest partial result of the job.
+
+    Partials published less than min_interval seconds after the last one
+    are dropped, unless progress is 1, so that jobs may call this as often
+    as they like.
+    Return True if the partial was published, else False.
+    Raise RuntimeError if called outside of a job.
+
+    Keyword arguments:
+    result -- Partial result of the job, in any form a result may take
+    progress -- Fraction of the job that is complete, from 0 to 1
+    message -- Short description of what the job is doing, for the user
+    min_interval -- Minimum seconds since the last partial was published
+                    (default: MIN_INTERVAL)
+    job -- Job the partial belongs to (default: the job being performed)
+    """
+    global _last_published
+    if min_interval is None:
+        min_interval = MIN_INTERVAL
+    if job is None:
+        job = get_current_job()
+        if job is None:
+            raise RuntimeError('Partial results can only be published by jobs')
+    now = time.time()
+    last_id, last_time = _last_published
+    if last_id == job.id and now - last_time < min_interval and \
+            progress != 1:
+        return False
+    _last_published = (job.id, now)
+    encoded = results.encode(result, start_worker.Job.result_codec,
+                             start_worker.Job.result_compression)
+    fields = dict(
+        result=pickle.dumps(encoded, pickle.HIGHEST_PROTOCOL),
+        updated_at=utcformat(utcnow())
+    )
+    _store_partial(job.connection, job.id, fields, progress, message)
+    return True
+
+
+def publish_progress(connection, job_id, progress, message=None):
+    """Store the progress of the job, without a partial result, as for
+    jobs whose progress is tracked by something other than the job itself.
+    """
+    _store_partial(connection, job_id, dict(updated_at=utcformat(utcnow())),
+                   progress, message)
+
+
+def _store_partial(connection, job_id, fields, progress, message):
+    """Store the fields of the job's latest partial, with the progress
+    and message if given, and wake up clients waiting on the job."""
+    if progress is not None:
+        fields['progress'] = repr(float(progress))
+    if message is not None:
+        fields['message'] = message
+    key = start_worker.partial_key(job_id)
+    pipeline = connection.pipeline()
+    pipeline.hmset(key, fields)
+    pipeline.hincrby(key, 'sequence', 1)
+    pipeline.expire(key, PARTIAL_TTL)
+    pipeline.execute()
+    connection.publish(start_worker.job_channel(job_id), PROGRESS_MESSAGE)
+
+
+def partial_sequence(connection, job_id):
+    """Return the number of partials published by the job, or None."""
+    sequence = connection.hget(start_worker.partial_key(job_id), 'sequence')
+    return int(sequence) if sequence is not None else None
+
+
+def fetch_partial(connection, job_id):
+    """Return the latest partial of the job as a dictionary, or None.
+
+    The dictionary holds the encoded `result`, as stored by rq for final
+    results, the `progress` and `message` of the partial, which may be None,
+    the `updated_at` time, and the `sequence` number of the partial.
+    """
+    return parse_partial(connection.hgetall(start_worker.partial_key(job_id)))
+
+
+def parse_partial(h):
+    """Return the partial stored in the hash h, as by fetch_partial, or None
+    if the hash is empty."""
+    if not h:
+        return None
+    h = dict((as_text(k), v) for k, v in h.items())
+    progress = h.get('progress')
+    message = h.get('message')
+    return dict(
+        result=unpickle(h['result']) if 'result' in h else None,
+        progress=float(progress) if progress is not None else None,
+        message=as_text(message) if message is not None else None,
+        updated_at=as_text(h.get('updated_at')),
+        sequence=int(h.get('sequence', 0))
+    )
@@ -0,0 +1,274 @@
+"""results
+Compact, compressed encodings of job results.
+
+rq pickles the return value of a job in to Redis. Histogram results hold
+long lists of numbers, which are slow to pickle and unpickle and take a lot
+of memory, so workers started by start_worker encode results first, and the
+jobs API decodes them again with decode.
+
+An encoded result is an EncodedResult, holding the name of the codec that
+encoded it, the name of the compression applied to the codec's output, and
+the compressed bytes.
+The codecs are:
+
+* `arrays` (the default), which stores lists of numbers as packed binary
+  arrays, described below;
+* `json`, which stores the result as compact JSON;
+* `pickle`, which pickles the result, and is used for results the other
+  codecs cannot encode.
+
+More codecs can be added with register_codec.
+The compressions are `gzip` (the default), which can be sent over HTTP
+as-is, `zlib`, `lz4`, if the lz4 package is installed, and `none`.
+
+The `arrays` format is little-endian, with all sections 8-byte aligned:
+
+    'JMR1'                  4 bytes, magic number
+    skeleton length         uint32
+    skeleton                UTF-8 JSON, zero-padded to a multiple of 8 bytes
+    for each array:
+        type code           1 byte, 'd' for float64 or 'i' for int32
+        padding             3 bytes
+        length              uint32, number of items
+        items               zero-padded to a multiple of 8 bytes
+
+The skeleton is the result with each packed list replaced by the object
+{"__array__": n}, where n is the index of the array in the arrays section.
+"""
+import json
+import pickle
+import struct
+import sys
+import zlib
+from array import array
+
+try:
+    import lz4.frame as lz4
+except ImportError:
+    lz4 = None
+
+# Lists of numbers shorter than this are left in the skeleton
+MIN_ARRAY_LENGTH = 16
+
+MAGIC = b'JMR1'
+
+# Key of the objects in the skeleton that stand in for packed arrays
+ARRAY_KEY = '__array__'
+
+# Bytes per item of each array type code
+ITEM_SIZES = {'d': 8, 'i': 4}
+
+INT32_MIN, INT32_MAX = -2 ** 31, 2 ** 31 - 1
+
+try:
+    integer_types = (int, long)
+    string_types = (basestring,)
+except NameError:
+    integer_types = (int,)
+    string_types = (str,)
+
+
+class EncodedResult(object):
+    """A job result encoded by a codec and compressed."""
+    def __init__(self, codec, compression, data):
+        self.codec = codec
+        self.compression = compression
+        self.data = data
+
+    def __repr__(self):
+        return 'EncodedResult({0!r}, {1!r}, <{2} bytes>)'.format(
+            self.codec, self.compression, len(self.data)
+        )
+
+
+def _padding(length):
+    return b'\0' * (-length % 8)
+
+
+def _array_type(values):
+    """Return the array type code the values can be packed in, or None."""
+    if len(values) < MIN_ARRAY_LENGTH:
+        return None
+    typecode = 'i'
+    for v in values:
+        if isinstance(v, bool):
+            return None
+        if isinstance(v, integer_types):
+            if not INT32_MIN <= v <= INT32_MAX:
+                typecode = 'd'
+        elif isinstance(v, float):
+            typecode = 'd'
+        else:
+            return None
+    return typecode
+
+
+class ArrayCodec(object):
+    """Encode JSON-like results, packing lists of numbers in to arrays.
+
+    Values that would not decode to an equal value, such as tuples,
+    dictionaries with keys that are not strings, and dictionaries that
+    could be mistaken for packed arrays, raise a TypeError.
+    """
+    content_type = 'application/vnd.jobmonitor.result'
+
+    def encode(self, value):
+        arrays = []
+
+        def strip(v):
+            if isinstance(v, tuple):
+                raise TypeError('Tuples would be decoded as lists')
+            if isinstance(v, list):
+                typecode = _array_type(v)
+                if typecode is not None:
+                    arrays.append(array(typecode, v))
+                    return {ARRAY_KEY: len(arrays) - 1}
+                return [strip(i) for i in v]
+            if isinstance(v, dict):
+                for k in v:
+                    if not isinstance(k, string_types):
+                        raise TypeError('Keys must be strings')
+                    if k == ARRAY_KEY:
+                        raise TypeError('{0} is a reserved key'.format(k))
+                return dict((k, strip(i)) for k, i in v.items())
+            return v
+
+        skeleton = json.dumps(strip(value), separators=(',', ':'))
+        skeleton = skeleton.encode('utf-8')
+        parts = [MAGIC, struct.pack('<I', len(skeleton)), skeleton,
+                 _padding(len(skeleton))]
+        for a in arrays:
+            if sys.byteorder != 'little':
+                a.byteswap()
+            data = a.tostring() if hasattr(a, 'tostring') else a.tobytes()
+            parts.extend([
+                struct.pack('<c3xI', a.typecode.encode('ascii'), len(a)),
+                data,
+                _padding(len(data))
+            ])
+        return b''.join(parts)
+
+    def decode(self, data):
+        if data[:4] != MAGIC:
+            raise ValueError('Not an array-encoded result')
+        (length,) = struct.unpack_from('<I', data, 4)
+        skeleton = json.loads(data[8:8 + length].decode('utf-8'))
+        offset = 8 + length + len(_padding(length))
+        arrays = []
+        while offset < len(data):
+            typecode, count = struct.unpack_from('<c3xI', data, offset)
+            typecode = typecode.decode('ascii')
+            offset += 8
+            size = count * ITEM_SIZES[typecode]
+            a = array(str(typecode))
+            chunk = data[offset:offset + size]
+            if hasattr(a, 'frombytes'):
+                a.frombytes(chunk)
+            else:
+                a.fromstring(chunk)
+            if sys.byteorder != 'little':
+                a.byteswap()
+            arrays.append(a.tolist())
+            offset += size + len(_padding(size))
+
+        def restore(v):
+            if isinstance(v, list):
+                return [restore(i) for i in v]
+            if isinstance(v, dict):
+                if len(v) == 1 and ARRAY_KEY in v:
+                    return arrays[v[ARRAY_KEY]]
+                return dict((k, restore(i)) for k, i in v.items())
+            return v
+
+        return restore(skeleton)
+
+
+class JSONCodec(object):
+    """Encode JSON-like results as compact JSON."""
+    content_type = 'application/json'
+
+    def encode(self, value):
+        return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+    def decode(self, data):
+        return json.loads(data.decode('utf-8'))
+
+
+class PickleCodec(object):
+    """Encode any picklable result."""
+    content_type = 'application/octet-stream'
+
+    def encode(self, value):
+        return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def decode(self, data):
+        return pickle.loads(data)
+
+
+codecs = {
+    'arrays': ArrayCodec(),
+    'json': JSONCodec(),
+    'pickle': PickleCodec()
+}
+
+
+def register_codec(name, codec):
+    """Make codec available under name.
+
+    A codec has encode and decode methods, converting a result to bytes and
+    back, and a content_type attribute giving the MIME type of the bytes.
+    """
+    codecs[name] = codec
+
+
+def gzip(data):
+    """Return data compressed in the gzip format."""
+    # A window size of 16 + 15 bits gives the gzip container
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _no_compression(data):
+    return data
+
+
+compressions = {
+    'none': (_no_compression, _no_compression),
+    'gzip': (gzip, lambda data: zlib.decompress(data, 47)),
+    'zlib': (zlib.compress, zlib.decompress)
+}
+if lz4 is not None:
+    compressions['lz4'] = (lz4.compress, lz4.decompress)
+
+
+def encode(value, codec='arrays', compression='gzip'):
+    """Return value encoded by the codec, compressed, as an EncodedResult.
+
+    If the codec cannot encode the value, it is pickled instead.
+    If the compression is unavailable, gzip is used instead.
+    """
+    try:
+        data = codecs[codec].encode(value)
+    except (TypeError, ValueError):
+        codec = 'pickle'
+        data = codecs[codec].encode(value)
+    if compression not in compressions:
+        compression = 'gzip'
+    compress, _ = compressions[compression]
+    return EncodedResult(codec, compression, compress(data))
+
+
+def decompress(result):
+    """Return the uncompressed bytes of the EncodedResult."""
+    _, decompress = compressions[result.compression]
+    return decompress(result.data)
+
+
+def decode(value):
+    """Return the result held by value if it's an EncodedResult, else value.
+
+    Results stored before encoding was introduced are passed through.
+    """
+    if not isinstance(value, EncodedResult):
+        return value
+    return codecs[value.codec].decode(decompress(value))
@@ -0,0 +1,66 @@
+"""server
+Serve a jobmonitor app from a single process with gevent, so that long
+polls and event streams wait on greenlets rather than threads.
+
+Run with `python -m jobmonitor.server`, e.g.
+
+    python -m jobmonitor.server --port 5000 mymonitor:create_app
+
+serves the app returned by `mymonitor.create_app()`. With no app given,
+the base jobmonitor app is served.
+Requests waiting on jobs share the subscription of the app's
+notifier.JobNotifier, so each costs a greenlet, rather than a thread and a
+Redis connection.
+Running the app with `gunicorn -k gevent` has the same effect.
+
+The gevent package must be installed.
+"""
+import importlib
+import optparse
+import sys
+
+try:
+    from gevent import monkey, pywsgi
+except ImportError:
+    monkey = pywsgi = None
+
+
+def load_app(spec):
+    """Return the app named by the `module:function` spec, calling the
+    function to create it."""
+    module_name, _, attr = spec.partition(':')
+    module = importlib.import_module(module_name)
+    return getattr(module, attr or 'create_app')()
+
+
+def parse_args(argv):
+    """Return the options and app spec parsed from the command line."""
+    parser = optparse.OptionParser(
+        usage='python -m jobmonitor.server [options] [MODULE:FUNCTION]'
+    )
+    parser.add_option('--host', default='127.0.0.1',
+                      help='address to listen on (default: %default)')
+    parser.add_option('-p', '--port', type='int', default=5000,
+                      help='port to listen on (default: %default)')
+    options, args = parser.parse_args(argv)
+    if len(args) > 1:
+        parser.error('At most one app can be served')
+    spec = args[0] if args else 'jobmonitor:create_app'
+    return options, spec
+
+
+def main(argv=None):
+    options, spec = parse_args(sys.argv[1:] if argv is None else argv)
+    if monkey is None:
+        sys.exit('gevent must be installed to run jobmonitor.server')
+    # Make blocking calls, such as Redis commands and sleeps, cooperative
+    monkey.patch_all()
+    app = load_app(spec)
+    server = pywsgi.WSGIServer((options.host, options.port), app)
+    print('Serving {0} on http://{1}:{2}'.format(spec, options.host,
+                                                 options.port))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,177 @@
+"""sharding
+Jobs spread over several Redis servers, with their results optionally kept
+on a server of their own.
+
+With REDIS_SHARD_URLS set to a list of Redis URLs, each job is stored on one
+of them, its shard, chosen by a hash of its ID, along with everything else
+keyed by the job: its partial results, its cancel and poll keys, the
+in-flight entry of its client, and the messages published on its channel.
+Every shard holds each of the QUEUES, and a worker connects to a single
+shard (its REDIS_URL), taking jobs from that shard's queues only, so the
+queues and job hashes of a shard are only ever used by its own workers and
+by the app.
+Chunks of a job split by jobmonitor.fanout have IDs starting with their
+parent's ID, and so are stored on the parent's shard, as the worker
+finishing the last chunk enqueues the parent.
+
+The first shard is the primary, which also holds everything not keyed by a
+job, such as the admission rates and the deduplication keys.
+
+With RESULT_REDIS_URL set, or JOBMONITOR_RESULT_REDIS_URL for workers,
+workers store the results of jobs under result_key on that server, rather
+than in the job hashes, so that large results don't use up the memory of
+the shards taking the queue traffic.
+
+Commands on several shards are sent as one pipeline per shard, so a
+transaction is only atomic within each shard.
+"""
+import zlib
+
+from rq.job import Job
+
+# Prefix of the keys holding job results on the result store
+RESULT_PREFIX = 'jobmonitor:result:'
+
+
+def shard_key(job_id):
+    """Return the part of the job ID that chooses its shard.
+
+    This is the ID up to its first `.`, so that jobs whose IDs share that
+    prefix, such as the chunks of a split job and their parent, are stored
+    on the same shard.
+    """
+    return job_id.split('.', 1)[0]
+
+
+def shard_index(job_id, count):
+    """Return the index of the job's shard, out of count shards."""
+    key = shard_key(job_id).encode('utf-8')
+    return (zlib.crc32(key) & 0xffffffff) % count
+
+
+def result_key(job_id):
+    """Return the key of the job's result on the result store."""
+    return RESULT_PREFIX + job_id
+
+
+def fetch_results(connection, job_ids, store=None):
+    """Return the stored result of each job, as pickled by rq, in the same
+    order as job_ids, in a single round trip.
+
+    Keyword arguments:
+    connection -- Redis connection the jobs are stored in
+    job_ids -- List of job IDs
+    store -- Redis connection of the result store, if results are kept
+             there rather than in the job hashes (default: None)
+    """
+    if not job_ids:
+        return []
+    if store is not None:
+        return store.mget([result_key(job_id) for job_id in job_ids])
+    pipeline = connection.pipeline(transaction=False)
+    for job_id in job_ids:
+        pipeline.hget(Job.key_for(job_id), 'result')
+    return pipeline.execute()
+
+
+class Shards(object):
+    """The Redis connections jobs are spread over, and the result store.
+
+    Keyword arguments:
+    connections -- List of Redis connections, one per shard, the first being
+                   the primary
+    results -- Redis connection job results are stored in, or None if they
+               are stored in the job hashes (default: None)
+    """
+    def __init__(self, connections, results=None):
+        if not connections:
+            raise ValueError('At least one shard is required')
+        self.connections = list(connections)
+        self.results = results
+
+    def __len__(self):
+        return len(self.connections)
+
+    def __iter__(self):
+        return iter(self.connections)
+
+    @property
+    def primary(self):
+        """Connection of the primary shard."""
+        return self.connections[0]
+
+    def index(self, job_id):
+        """Return the index of the job's shard."""
+        if len(self.connections) == 1:
+            return 0
+        return shard_index(job_id, len(self.connections))
+
+    def for_job(self, job_id):
+        """Return the connection of the job's shard."""
+        return self.connections[self.index(job_id)]
+
+    def pipelines(self, transaction=False):
+        """Return a new Pipelines on these shards."""
+        return Pipelines(self, transaction)
+
+    def fetch_results(self, job_ids):
+        """Return the stored result of each job, as pickled by rq, in the
+        same order as job_ids, with a round trip per shard holding any of
+        the jobs, or a single round trip to the result store."""
+        if self.results is not None:
+            return fetch_results(None, job_ids, self.results)
+        groups = {}
+        for i, job_id in enumerate(job_ids):
+            groups.setdefault(self.index(job_id), []).append(i)
+        stored = [None] * len(job_ids)
+        for index, positions in groups.items():
+            values = fetch_results(self.connections[index],
+                                   [job_ids[i] for i in positions])
+            for i, value in zip(positions, values):
+                stored[i] = value
+        return stored
+
+
+class Pipelines(object):
+    """A pipeline per shard, created when first used, and sent together.
+
+        pipelines = shards.pipelines()
+        for job_id in job_ids:
+            pipelines.for_job(job_id).hget(Job.key_for(job_id), 'status')
+        replies = pipelines.execute()
+        statuses = [next(replies[shards.index(job_id)])
+                    for job_id in job_ids]
+    """
+    def __init__(self, shards, transaction=False):
+        self.shards = shards
+        self.transaction = transaction
+        self._pipelines = {}
+
+    def on(self, index):
+        """Return the pipeline of the shard with the index."""
+        try:
+            return self._pipelines[index]
+        except KeyError:
+            pipeline = self.shards.connections[index].pipeline(
+                transaction=self.transaction
+            )
+            self._pipelines[index] = pipeline
+            return pipeline
+
+    def for_job(self, job_id):
+        """Return the pipeline of the job's shard."""
+        return self.on(self.shards.index(job_id))
+
+    @property
+    def primary(self):
+        """Pipeline of the primary shard."""
+        return self.on(0)
+
+    def execute(self):
+        """Execute the pipeline of each shard, in order, and return a list
+        holding an iterator over the replies of each shard's pipeline."""
+        replies = []
+        for index in range(len(self.shards)):
+            pipeline = self._pipelines.get(index)
+            replies.append(iter(pipeline.execute() if pipeline else ()))
+        return replies
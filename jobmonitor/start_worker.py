@@ -3,37 +3,399 @@ Start a single rq worker to watch the queue database.
 A worker is only started if this file is called directly.
 """
 import os
+import signal
+import threading
+import time
 try:
     import urllib.parse as urlparse
 except ImportError:
     import urlparse
 import redis
 import rq
+from jobmonitor import metrics, results, sharding
+from jobmonitor.config import JOB_CANCELLED_TTL, QUEUES
 
-listen = ['default']
+# Workers take jobs from these queues in order, so earlier queues have priority
+listen = list(QUEUES)
+
+# Register the redis scheme once, so urlparse splits out the network location
+if 'redis' not in urlparse.uses_netloc:
+    urlparse.uses_netloc.append('redis')
+
+# Connection pools shared by every connection in this process, keyed by URL
+_connection_pools = {}
+
+# Status of jobs that were cancelled before they completed
+CANCELLED = 'cancelled'
+
+# Seconds between checks of whether a running job has been cancelled
+CANCEL_CHECK_INTERVAL = 1
+
+# Seconds a request to cancel a job is kept for, should no worker see it
+CANCEL_REQUEST_TTL = 3600
+
+
+class CountingConnection(redis.Connection):
+    """A Redis connection counting its round trips in
+    metrics.REDIS_ROUND_TRIPS.
+
+    A pipeline is sent at once, and so counts as a single round trip.
+    """
+    def send_packed_command(self, command):
+        metrics.REDIS_ROUND_TRIPS.inc()
+        return super(CountingConnection, self).send_packed_command(command)
 
 
-def create_connection():
-    """Return a redis.Redis instance connected to REDIS_URL."""
+def redis_url():
+    """Return the Redis URL defined in the environment, or the default."""
     # REDIS_URL is defined in .env and loaded into the environment by Honcho
-    redis_url = os.getenv('REDIS_URL')
     # If it's not defined, use the Redis default
-    if not redis_url:
-        redis_url = 'redis://localhost:6379'
-    urlparse.uses_netloc.append('redis')
-    url = urlparse.urlparse(redis_url)
-    return redis.StrictRedis(
-        host=url.hostname,
-        port=url.port,
-        db=0,
-        password=url.password
+    return os.getenv('REDIS_URL') or 'redis://localhost:6379'
+
+
+def result_redis_url():
+    """Return the URL of the Redis server job results are stored in, as
+    defined in the environment, or None if they are stored in the jobs."""
+    return os.getenv('JOBMONITOR_RESULT_REDIS_URL') or None
+
+
+def create_connection_pool(url=None, max_connections=50, timeout=20,
+                           socket_timeout=None):
+    """Return the process-wide redis.BlockingConnectionPool for the URL.
+
+    The pool is created on the first call for a given URL, and the same
+    instance is returned on all subsequent calls, so the pool size and
+    timeouts of the first call win.
+    When all max_connections connections are in use, a client will wait up to
+    timeout seconds for one to be released before raising
+    redis.ConnectionError.
+
+    Keyword arguments:
+    url -- Redis URL to connect to, whose path may name the database, as in
+           redis://localhost:6379/1 (default: redis_url())
+    max_connections -- Maximum number of open connections in the pool
+    timeout -- Seconds to wait for a free connection when the pool is full
+    socket_timeout -- Seconds to wait for a Redis command to respond
+    """
+    if url is None:
+        url = redis_url()
+    try:
+        return _connection_pools[url]
+    except KeyError:
+        pass
+    parsed = urlparse.urlparse(url)
+    pool = redis.BlockingConnectionPool(
+        connection_class=CountingConnection,
+        max_connections=max_connections,
+        timeout=timeout,
+        socket_timeout=socket_timeout,
+        host=parsed.hostname,
+        port=parsed.port or 6379,
+        db=int(parsed.path.strip('/') or 0),
+        password=parsed.password
+    )
+    _connection_pools[url] = pool
+    return pool
+
+
+def connection_pool_stats(pool):
+    """Return a dictionary describing the usage of the connection pool."""
+    # Free slots in the pool hold either an idle connection or None, where
+    # None means a connection can still be created
+    idle = len([c for c in list(pool.pool.queue) if c is not None])
+    created = len(pool._connections)
+    return dict(
+        max_connections=pool.max_connections,
+        created_connections=created,
+        idle_connections=idle,
+        in_use_connections=created - idle
     )
 
 
+def create_connection(connection_pool=None):
+    """Return a redis.StrictRedis instance connected to REDIS_URL.
+
+    Keyword arguments:
+    connection_pool -- Pool to take connections from
+                       (default: the process-wide pool for REDIS_URL)
+    """
+    if connection_pool is None:
+        connection_pool = create_connection_pool()
+    return redis.StrictRedis(connection_pool=connection_pool)
+
+
+def result_connection():
+    """Return a redis.StrictRedis instance connected to the result store at
+    result_redis_url(), or None if results are stored in the jobs."""
+    url = result_redis_url()
+    if url is None:
+        return None
+    return create_connection(create_connection_pool(url))
+
+
+def job_channel(job_id):
+    """Return the pub/sub channel job status changes are published on."""
+    return 'jobmonitor:job:{0}'.format(job_id)
+
+
+def partial_key(job_id):
+    """Return the key of the hash holding the job's latest partial result,
+    as published by jobmonitor.progress."""
+    return 'jobmonitor:partial:{0}'.format(job_id)
+
+
+def cancel_key(job_id):
+    """Return the key that is set to ask the worker running the job to
+    cancel it."""
+    return 'jobmonitor:cancel:{0}'.format(job_id)
+
+
+def poll_key(job_id):
+    """Return the key holding the time a client last polled the job, which
+    expires once the job has not been polled for its idle timeout."""
+    return 'jobmonitor:polled:{0}'.format(job_id)
+
+
+def inflight_key(client):
+    """Return the key of the sorted set of the client's pending jobs, scored
+    by the time they were submitted, as counted by jobmonitor.admission."""
+    return 'jobmonitor:inflight:{0}'.format(client)
+
+
+def request_cancel(connection, job_id):
+    """Ask the worker running the job to cancel it."""
+    connection.set(cancel_key(job_id), 1, ex=CANCEL_REQUEST_TTL)
+
+
+def mark_cancelled(connection, job_id):
+    """Set the status of the job to cancelled, deleting it after
+    JOB_CANCELLED_TTL seconds."""
+    pipeline = connection.pipeline()
+    pipeline.hset(rq.job.Job.key_for(job_id), 'status', CANCELLED)
+    pipeline.expire(rq.job.Job.key_for(job_id), JOB_CANCELLED_TTL)
+    pipeline.execute()
+
+
+def is_cancelled(connection, job):
+    """Return True if cancelling the job has been requested, or if the job
+    has an idle timeout and has not been polled within it.
+
+    Chunks of a job split by jobmonitor.fanout, which have a `parent` in
+    their meta, are also cancelled with their parent, and are polled
+    through it.
+    """
+    parent_id = job.meta.get('parent')
+    pipeline = connection.pipeline(transaction=False)
+    pipeline.exists(poll_key(parent_id or job.id))
+    pipeline.exists(cancel_key(job.id))
+    if parent_id is not None:
+        pipeline.exists(cancel_key(parent_id))
+    replies = pipeline.execute()
+    polled, requested = replies[0], replies[1:]
+    idle = job.meta.get('idle_timeout') is not None and not polled
+    return any(requested) or idle
+
+
+class JobCancelledError(Exception):
+    """Raised inside a running job when it is cancelled."""
+    pass
+
+
+class CancellationWatcher(threading.Thread):
+    """A thread that interrupts the job running in this process, by sending
+    the process SIGUSR1, once the job is cancelled.
+
+    Whether the job is cancelled is checked every CANCEL_CHECK_INTERVAL
+    seconds, as by is_cancelled, until stop is called.
+    The interrupt method must be installed as the SIGUSR1 handler.
+    """
+    def __init__(self, connection, job, interval=None):
+        super(CancellationWatcher, self).__init__()
+        self.daemon = True
+        self.connection = connection
+        self.job = job
+        if interval is None:
+            interval = CANCEL_CHECK_INTERVAL
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while True:
+            # Event.wait returns None before Python 2.7
+            self._stopped.wait(self.interval)
+            if self._stopped.is_set():
+                return
+            if is_cancelled(self.connection, self.job):
+                os.kill(os.getpid(), signal.SIGUSR1)
+                return
+
+    def interrupt(self, signum, frame):
+        """Raise JobCancelledError, unless the watcher has been stopped."""
+        if not self._stopped.is_set():
+            raise JobCancelledError(
+                'Job {0} was cancelled'.format(self.job.id)
+            )
+
+    def stop(self):
+        """Stop checking the job, and wait for the thread to finish."""
+        self._stopped.set()
+        if self.is_alive():
+            self.join()
+
+
+def publish_job_status(connection, job):
+    """Publish the current status of the job on its channel."""
+    connection.publish(job_channel(job.id), job.get_status())
+
+
+class Job(rq.job.Job):
+    """An rq job whose result is stored encoded by jobmonitor.results.
+
+    The codec and compression are taken from the JOBMONITOR_RESULT_CODEC and
+    JOBMONITOR_RESULT_COMPRESSION environment variables, defaulting to
+    `arrays` and `gzip`.
+    If JOBMONITOR_RESULT_REDIS_URL is set, the result is stored under
+    sharding.result_key on that server, with the job's result TTL, rather
+    than in the job's hash.
+    rq saves a job as finished as soon as its function returns, before the
+    result is encoded and saved, so the finished status is instead only
+    saved by save, together with the result and completion time.
+    """
+    result_codec = os.getenv('JOBMONITOR_RESULT_CODEC') or 'arrays'
+    result_compression = os.getenv('JOBMONITOR_RESULT_COMPRESSION') or 'gzip'
+
+    def set_status(self, status):
+        if status == rq.job.Status.FINISHED:
+            self._status = status
+            return
+        super(Job, self).set_status(status)
+
+    def perform(self):
+        result = super(Job, self).perform()
+        if result is not None:
+            self._result = results.encode(result, self.result_codec,
+                                          self.result_compression)
+        return self._result
+
+    def save(self, pipeline=None):
+        store = result_connection() if self._result is not None else None
+        if store is None:
+            return super(Job, self).save(pipeline)
+        # The result is stored before the job is saved as finished, so it is
+        # there for anyone seeing the job's status
+        ttl = self.get_ttl(rq.worker.DEFAULT_RESULT_TTL)
+        value = rq.job.dumps(self._result)
+        if ttl > 0:
+            store.set(sharding.result_key(self.id), value, ex=ttl)
+        elif ttl < 0:
+            store.set(sharding.result_key(self.id), value)
+        result, self._result = self._result, None
+        try:
+            return super(Job, self).save(pipeline)
+        finally:
+            self._result = result
+
+
+class Queue(rq.Queue):
+    """An rq queue of jobs with encoded results."""
+    job_class = Job
+
+
+class Worker(rq.Worker):
+    """An rq worker that publishes the status of jobs when they complete,
+    stores their results encoded by jobmonitor.results, and records how long
+    they took in the metrics.
+    The partial result of a job, if it published any, is deleted once the
+    job completes.
+
+    Clients waiting on a job subscribe to its job_channel rather than
+    polling the job's status.
+
+    Jobs are cancelled, rather than run, if request_cancel was called for
+    them, or if they have an `idle_timeout` in their meta and nobody has
+    polled them within it.
+    Running jobs are checked in the same way by a CancellationWatcher, and
+    interrupted with a JobCancelledError once cancelled.
+    Cancelled jobs are not moved to the failed queue, and failed jobs with a
+    `failure_ttl` in their meta are deleted after that many seconds.
+
+    Jobs with a `client` in their meta stop counting towards the client's
+    pending jobs once they complete.
+
+    Jobs with a `parent` in their meta are chunks of a job split by
+    jobmonitor.fanout, whose parent is updated as they start and complete.
+    """
+    queue_class = Queue
+    job_class = Job
+
+    def __init__(self, *args, **kwargs):
+        super(Worker, self).__init__(*args, **kwargs)
+        self.push_exc_handler(self.handle_cancelled_job)
+
+    def handle_cancelled_job(self, job, exc_type, exc_value, traceback):
+        """Mark jobs interrupted by a JobCancelledError as cancelled, rather
+        than moving them to the failed queue."""
+        if not issubclass(exc_type, JobCancelledError):
+            return True
+        mark_cancelled(self.connection, job.id)
+        return False
+
+    def perform_job(self, job):
+        start = time.time()
+        succeeded = False
+        parent_id = job.meta.get('parent')
+        if parent_id is not None:
+            # Imported here, as jobmonitor.fanout imports this module
+            from jobmonitor import fanout
+        try:
+            if is_cancelled(self.connection, job):
+                mark_cancelled(self.connection, job.id)
+                return False
+            if parent_id is not None:
+                fanout.chunk_started(self.connection, job)
+            watcher = CancellationWatcher(self.connection, job)
+            previous_handler = signal.signal(signal.SIGUSR1, watcher.interrupt)
+            watcher.start()
+            try:
+                succeeded = super(Worker, self).perform_job(job)
+            finally:
+                watcher.stop()
+                signal.signal(signal.SIGUSR1, previous_handler)
+            return succeeded
+        finally:
+            status = 'finished' if succeeded else job.get_status()
+            failure_ttl = job.meta.get('failure_ttl')
+            if status == 'failed' and failure_ttl is not None:
+                self.connection.expire(job.key, failure_ttl)
+            self.connection.delete(partial_key(job.id), cancel_key(job.id),
+                                   poll_key(job.id))
+            client = job.meta.get('client')
+            if client is not None:
+                self.connection.zrem(inflight_key(client), job.id)
+            publish_job_status(self.connection, job)
+            if parent_id is not None:
+                fanout.chunk_completed(self.connection, job, status)
+            metrics.record_job_duration(self.connection, job.func_name,
+                                        status, time.time() - start)
+
+
+class InProcessWorker(Worker):
+    """A Worker that performs each job in its own process, rather than in a
+    forked work horse.
+
+    Anything jobs keep in memory, such as the files held by
+    jobmonitor.filecache, then lasts as long as the worker, but a job that
+    crashes the process also takes the worker down with it, so these should
+    be run by jobmonitor.supervisor, which restarts them.
+    """
+    def execute_job(self, job):
+        self.perform_job(job)
+
+
 def work():
-    """Start an rq worker on the connection provided by create_connection."""
+    """Start a worker on the connection provided by create_connection."""
     with rq.Connection(create_connection()):
-        worker = rq.Worker(list(map(rq.Queue, listen)))
+        worker = Worker(list(map(Queue, listen)))
         worker.work()
 
 if __name__ == '__main__':
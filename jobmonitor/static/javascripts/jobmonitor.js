@@ -8,6 +8,23 @@ var JobMonitor = (function($, undefined) {
     debug: false,
     // Default job status polling timeout in milliseconds
     pollRate: 300,
+    // Seconds the server may hold each poll open until the job completes,
+    // 0 disables long polling
+    longPollWait: 25,
+    // Watch jobs with the Server-Sent Events stream, if the browser supports it
+    useEventSource: true,
+    // Poll all pending jobs on the page together, in one request per tick,
+    // rather than watching each job with its own stream or poll loop
+    // With longPollWait, the server holds each request until any of the jobs
+    // changes, so completions are seen straight away. Without it, jobs that
+    // don't change are polled less and less often, which saves requests,
+    // but a long job's completion may then be seen up to maxPollRate late
+    sharedPolling: true,
+    // Longest interval in milliseconds the shared poller backs off to for
+    // jobs that don't change, when it is not long polling
+    maxPollRate: 5000,
+    // Factor the poll interval of a job grows by each time it hasn't changed
+    pollBackoff: 1.5,
     // Defaults for histogram drawing
     histogramDefaults: {
     },
@@ -47,35 +64,195 @@ var JobMonitor = (function($, undefined) {
     }
   };
 
-  // Submit a job to the server
-  // Accepts:
-  //   taskName: Name of the task the job will run
-  //   args: Object of arguments passed to the task as named arguments
-  //   poll: Whether to poll the job until completion (default: true)
-  //     The job is polled in intervals of JobMonitor.settings.pollRate until
-  //     the job status is not `queued` or `started`.
-  // Returns:
-  //   jQuery.Deferred object which fires `resolve` on job completion and fires
-  //     `reject` on either submission failure or job polling failure
-  var submitJob = function(taskName, args, doPoll) {
-    if (doPoll === undefined) {
-      doPoll = true;
+  // Is the job status one of a job that has not yet completed?
+  var isPending = function(jobStatus) {
+    return jobStatus === 'queued' || jobStatus === 'started';
+  };
+
+  // Fire `notify` on the jobPromise with the job if it has a new partial
+  // result, returning the sequence number of the job's latest partial
+  var notifyPartial = function(job, jobPromise, lastSequence) {
+    var partial = job['partial'];
+    if (partial === undefined || partial['sequence'] === lastSequence) {
+      return lastSequence;
     }
-    var jobRequest =  $.ajax('/jobs', {
+    log('Job ' + job['id'] + ' progress: ' + partial['progress']);
+    jobPromise.notify(job);
+    return partial['sequence'];
+  };
+
+  // Jobs watched by the shared poller, by ID, each an object holding the
+  // `job` and its `jobPromise`, the `version` and `lastSequence` of the job
+  // last seen, its poll `interval`, and the time of its `nextPoll`
+  var scheduled = {};
+  // Timeout ID of the next tick of the shared poller, if one is set
+  var pollTimer = null;
+  // Is a request of the shared poller in flight?
+  var pollBusy = false;
+  // The request of the shared poller in flight, if any
+  var pollRequest = null;
+
+  // Set the next tick of the shared poller for when the next job is due,
+  // unless a request is in flight, in which case it's set once it's done
+  var scheduleTick = function() {
+    if (pollBusy) {
+      return;
+    }
+    if (pollTimer !== null) {
+      clearTimeout(pollTimer);
+      pollTimer = null;
+    }
+    var next = Infinity;
+    $.each(scheduled, function(jobID, entry) {
+      next = Math.min(next, entry.nextPoll);
+    });
+    if (next !== Infinity) {
+      pollTimer = setTimeout(pollScheduled, Math.max(0, next - $.now()));
+    }
+  };
+
+  // Poll every job that is due, along with those due within the next
+  // settings.pollRate milliseconds, in a single request
+  // The server only sends the jobs that changed since their last `version`,
+  // and the jobs that didn't are polled less and less often, up to
+  // settings.maxPollRate.
+  // With settings.longPollWait, every job is polled, and the server holds
+  // the request for up to that many seconds until any of them changes.
+  var pollScheduled = function() {
+    pollTimer = null;
+    var longPoll = settings.longPollWait > 0,
+        horizon = $.now() + settings.pollRate,
+        versions = {},
+        due = [];
+    $.each(scheduled, function(jobID, entry) {
+      if (longPoll || entry.nextPoll <= horizon) {
+        versions[jobID] = entry.version;
+        due.push(jobID);
+      }
+    });
+    if (due.length === 0) {
+      scheduleTick();
+      return;
+    }
+    log('Polling ' + due.length + ' jobs');
+    pollBusy = true;
+    pollRequest = $.ajax('/jobs/status' + (longPoll ? '?wait=' + settings.longPollWait : ''), {
       type: 'POST',
       contentType: 'application/json; charset=utf-8',
       dataType: 'json',
-      data: JSON.stringify({task_name: taskName, args: args})
+      data: JSON.stringify({jobs: versions})
+    }).done(function(data, status) {
+      var changed = {};
+      $.each(data['jobs'], function(index, job) { changed[job['id']] = job; });
+      $.each(due, function(index, jobID) {
+        var entry = scheduled[jobID],
+            job = changed[jobID];
+        if (entry === undefined) {
+          return;
+        }
+        if (job === undefined) {
+          if (!longPoll) {
+            entry.interval = Math.min(entry.interval * settings.pollBackoff, settings.maxPollRate);
+          }
+        } else {
+          entry.job = job;
+          entry.version = job['version'];
+          entry.interval = settings.pollRate;
+          entry.lastSequence = notifyPartial(job, entry.jobPromise, entry.lastSequence);
+          if (!isPending(job['status'])) {
+            log('Job ' + jobID + ' completed: ' + job['status']);
+            delete scheduled[jobID];
+            entry.jobPromise.resolve(job);
+            return;
+          }
+        }
+        entry.nextPoll = $.now() + entry.interval;
+      });
+      $.each(data['missing'], function(index, jobID) {
+        var entry = scheduled[jobID];
+        if (entry !== undefined) {
+          delete scheduled[jobID];
+          entry.jobPromise.reject({
+            status: 404,
+            statusText: 'Job not found',
+            responseText: JSON.stringify({message: 'Job not found'})
+          }, 'error');
+        }
+      });
+    }).fail(function(data, status) {
+      // Long polls are aborted to add newly scheduled jobs to them
+      if (status === 'abort') {
+        return;
+      }
+      $.each(due, function(index, jobID) {
+        var entry = scheduled[jobID];
+        if (entry !== undefined) {
+          delete scheduled[jobID];
+          entry.jobPromise.reject(data, status);
+        }
+      });
+    }).always(function() {
+      pollBusy = false;
+      pollRequest = null;
+      scheduleTick();
     });
-    var jobPromise = $.Deferred();
+  };
+
+  // Watch a pending job with the shared poller until completion
+  // Accepts:
+  //   job: Job object, as returned by the server
+  //   jobPromise: jQuery.Deferred object, as for watchJob
+  //   lastSequence: Sequence number of the last partial result notified
+  // Returns:
+  //   undefined
+  var scheduleJob = function(job, jobPromise, lastSequence) {
+    scheduled[job['id']] = {
+      job: job,
+      jobPromise: jobPromise,
+      version: job['version'] === undefined ? null : job['version'],
+      lastSequence: lastSequence,
+      interval: settings.pollRate,
+      nextPoll: $.now() + settings.pollRate
+    };
+    // A long poll in flight would only include the job once it returns
+    if (pollRequest !== null && settings.longPollWait > 0) {
+      pollRequest.abort();
+    }
+    scheduleTick();
+  };
+
+  // Watch a job until completion
+  // With settings.sharedPolling, pending jobs are polled together with all
+  // other jobs on the page by the shared poller.
+  // Otherwise, the job's Server-Sent Events stream is used if the browser
+  // supports it, falling back to polling the job if the stream fails.
+  // Polls ask the server to hold the request open for settings.longPollWait
+  // seconds, so a server that doesn't support long polling is simply polled
+  // in intervals of settings.pollRate.
+  // Accepts:
+  //   job: Job object, as returned by the server
+  //   jobPromise: jQuery.Deferred object which fires `resolve` on job
+  //     completion, `reject` on job polling failure, and `notify` each time
+  //     the job publishes a partial result, held in the job's `partial`
+  //     object with its `result`, `progress` and `message`
+  // Returns:
+  //   undefined
+  var watchJob = function(job, jobPromise) {
+    var lastSequence;
+    if (settings.sharedPolling && isPending(job['status'])) {
+      scheduleJob(job, jobPromise, notifyPartial(job, jobPromise, lastSequence));
+      return;
+    }
     var poll = function(job) {
       var jobID = job['id'],
           jobStatus = job['status'];
       // Poll the job if it hasn't not completed, else fire `resolve`
-      if (jobStatus === 'queued' || jobStatus === 'started') {
+      if (isPending(jobStatus)) {
+        lastSequence = notifyPartial(job, jobPromise, lastSequence);
         setTimeout(function() {
           log('Polling job ID ' + jobID + ': ' + jobStatus);
-          $.getJSON(job['uri'])
+          var params = settings.longPollWait > 0 ? {wait: settings.longPollWait} : {};
+          $.getJSON(job['uri'], params)
             .done(function(data, status) { poll(data['job']); })
             .fail(function(data, status) { jobPromise.reject(data, status); });
         }, settings.pollRate);
@@ -84,10 +261,52 @@ var JobMonitor = (function($, undefined) {
         jobPromise.resolve(job);
       }
     };
+    if (!isPending(job['status']) || !settings.useEventSource || window.EventSource === undefined) {
+      poll(job);
+      return;
+    }
+    var source = new EventSource(job['uri'] + '/events');
+    source.onmessage = function(event) {
+      job = JSON.parse(event.data)['job'];
+      log('Job ' + job['id'] + ' event: ' + job['status']);
+      lastSequence = notifyPartial(job, jobPromise, lastSequence);
+      if (!isPending(job['status'])) {
+        source.close();
+        poll(job);
+      }
+    };
+    // Also fired when the server closes the stream, so carry on by polling
+    source.onerror = function() {
+      source.close();
+      poll(job);
+    };
+  };
+
+  // Submit a job to the server
+  // Accepts:
+  //   taskName: Name of the task the job will run
+  //   args: Object of arguments passed to the task as named arguments
+  //   poll: Whether to poll the job until completion (default: true)
+  //     The job is watched with watchJob until the job status is not
+  //     `queued` or `started`.
+  // Returns:
+  //   jQuery.Deferred object which fires `resolve` on job completion and fires
+  //     `reject` on either submission failure or job polling failure
+  var submitJob = function(taskName, args, doPoll) {
+    if (doPoll === undefined) {
+      doPoll = true;
+    }
+    var jobRequest =  $.ajax('/jobs', {
+      type: 'POST',
+      contentType: 'application/json; charset=utf-8',
+      dataType: 'json',
+      data: JSON.stringify({task_name: taskName, args: args})
+    });
+    var jobPromise = $.Deferred();
     jobRequest.done(function(data, status) {
       var job = data['job'];
       if (doPoll === true) {
-        poll(job);
+        watchJob(job, jobPromise);
       }
     });
     // Fire `reject` if the submission fails
@@ -95,31 +314,86 @@ var JobMonitor = (function($, undefined) {
     return jobPromise;
   };
 
-  // Create a task and submit a job for it to the queue
-  //
-  // Unlike submitJob, this method handles job failures by creating descriptive
-  // HTML error messages.
-  // This relies on the JSON response containing a `result` key which is the
-  // task's return value, which itself contains a `success` key determining
-  // whether the task completed successfully.
-  // If `success` if false, the task's `message` key is retrieved.
+  // Submit many jobs to the server in a single request
   // Accepts:
-  //   taskName: Name of the task the job will run
-  //   args: Object of arguments passed to the task as named arguments
+  //   tasks: Array of objects with a `taskName` key and an optional `args`
+  //     key, as for the arguments of submitJob
+  //   poll: Whether to poll the jobs until completion (default: true)
   // Returns:
-  //   jQuery.Deferred object which fires `resolve` on job completion and fires
-  //     `reject` on either submission failure, job polling failure, or task
-  //     failure. On resolution, the JSON response object is passed, whereas
-  //     on rejection a descriptive HTML error message is passed.
-  var createTask = function(taskName, args) {
-    // Create a polling job
-    var jobPromise = submitJob(taskName, args, true);
+  //   Array of jQuery.Deferred objects, one per task in the same order, each
+  //     behaving as the one returned by submitJob. If the server rejects a
+  //     single task, its Deferred fires `reject` with an object holding the
+  //     `status`, `statusText` and `responseText` of the rejection.
+  var submitJobs = function(tasks, doPoll) {
+    if (doPoll === undefined) {
+      doPoll = true;
+    }
+    var jobsRequest = $.ajax('/jobs/batch', {
+      type: 'POST',
+      contentType: 'application/json; charset=utf-8',
+      dataType: 'json',
+      data: JSON.stringify({jobs: $.map(tasks, function(task) {
+        return {task_name: task.taskName, args: task.args};
+      })})
+    });
+    var jobPromises = $.map(tasks, function() { return $.Deferred(); });
+    var settle = function(items) {
+      $.each(items, function(index, item) {
+        if (item['job'] === undefined) {
+          jobPromises[index].reject({
+            status: 400,
+            statusText: item['message'],
+            responseText: JSON.stringify(item)
+          }, 'error');
+        } else if (doPoll === true) {
+          watchJob(item['job'], jobPromises[index]);
+        }
+      });
+    };
+    jobsRequest.done(function(data, status) { settle(data['jobs']); });
+    // If the server rejected every task, reject each with its own message,
+    // else fire `reject` for all of them if the submission fails
+    jobsRequest.fail(function(data, status) {
+      var items;
+      try {
+        items = JSON.parse(data.responseText)['jobs'];
+      } catch(e) {
+        items = undefined;
+      }
+      if (items === undefined) {
+        $.each(jobPromises, function(index, jobPromise) { jobPromise.reject(data, status); });
+      } else {
+        settle(items);
+      }
+    });
+    return jobPromises;
+  };
+
+  // Cancel a job that has not completed, or delete a job that has
+  // A started job is only stopped once its worker notices, so watching it
+  // carries on until it reaches the `cancelled` status.
+  // Accepts:
+  //   job: Job object, as returned by the server
+  // Returns:
+  //   jQuery.jqXHR object of the request
+  var cancelJob = function(job) {
+    log('Cancelling job ' + job['id']);
+    return $.ajax(job['uri'], {type: 'DELETE'});
+  };
+
+  // Convert a jQuery.Deferred from submitJob in to one that resolves only if
+  // the task completed successfully, as described for createTask
+  var taskFromJob = function(jobPromise) {
     var taskPromise = $.Deferred();
+    // Pass partial results on as they arrive
+    jobPromise.progress(function(job) { taskPromise.notify(job); });
     jobPromise.done(function(job) {
       // Did the job complete successfully or not?
       if (job['status'] === 'failed') {
         var message = '<p>The job completed unsuccessfully.</p>';
         taskPromise.reject(message);
+      } else if (job['status'] === 'cancelled') {
+        taskPromise.reject('<p>The job was cancelled.</p>');
       } else {
         // Did the task the job was running finish successfully or not?
         var result = job['result'];
@@ -150,6 +424,40 @@ var JobMonitor = (function($, undefined) {
     return taskPromise;
   };
 
+  // Create a task and submit a job for it to the queue
+  //
+  // Unlike submitJob, this method handles job failures by creating descriptive
+  // HTML error messages.
+  // This relies on the JSON response containing a `result` key which is the
+  // task's return value, which itself contains a `success` key determining
+  // whether the task completed successfully.
+  // If `success` if false, the task's `message` key is retrieved.
+  // Accepts:
+  //   taskName: Name of the task the job will run
+  //   args: Object of arguments passed to the task as named arguments
+  // Returns:
+  //   jQuery.Deferred object which fires `resolve` on job completion and fires
+  //     `reject` on either submission failure, job polling failure, or task
+  //     failure. On resolution, the JSON response object is passed, whereas
+  //     on rejection a descriptive HTML error message is passed. Partial
+  //     results fire `notify` with the job, as for watchJob, so pages can
+  //     draw them with `.progress(function(job) { ... })`.
+  var createTask = function(taskName, args) {
+    // Create a polling job
+    return taskFromJob(submitJob(taskName, args, true));
+  };
+
+  // Create many tasks and submit their jobs to the queue in a single request
+  // Accepts:
+  //   tasks: Array of objects with a `taskName` key and an optional `args`
+  //     key, as for the arguments of createTask
+  // Returns:
+  //   Array of jQuery.Deferred objects, one per task in the same order, each
+  //     behaving as the one returned by createTask
+  var createTasks = function(tasks) {
+    return $.map(submitJobs(tasks, true), taskFromJob);
+  };
+
   // Add a `Spinner` object to the `element`, using `settings.spinnerDefaults` as options.
   // Accepts:
   //   element: DOM element
@@ -202,7 +510,11 @@ var JobMonitor = (function($, undefined) {
   return {
     init: init,
     submitJob: submitJob,
+    watchJob: watchJob,
+    submitJobs: submitJobs,
+    cancelJob: cancelJob,
     createTask: createTask,
+    createTasks: createTasks,
     appendSpinner: appendSpinner,
     log: log,
     settings: settings
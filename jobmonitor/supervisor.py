@@ -0,0 +1,286 @@
+"""supervisor
+Start and look after a pool of rq workers, one process each.
+
+Run with `jobmonitor-workers`, or `python -m jobmonitor.supervisor`, e.g.
+
+    jobmonitor-workers -n auto -q default --preload mymonitor.jobs
+
+starts one worker per CPU core listening on the `default` queue, with the
+`mymonitor.jobs` module imported once before the workers are forked, so that
+they share its code and start quickly.
+With `--in-process`, workers run jobs themselves rather than forking for
+each one, so that what jobs cache, such as the files of
+jobmonitor.filecache, is kept between jobs.
+With jobs spread over several Redis servers, as described in
+jobmonitor.sharding, each `--redis-url` names one of them, and the workers
+are shared out between them in turn, each taking jobs from its own server
+only. `--result-redis-url` names the server job results are stored in.
+Crashed workers are restarted, waiting longer after each consecutive crash.
+On SIGTERM or SIGINT, the workers are asked to finish their current job and
+stop, and the supervisor exits once they all have.
+"""
+import errno
+import importlib
+import logging
+import multiprocessing
+import optparse
+import os
+import random
+import signal
+import sys
+import time
+
+import rq
+
+from . import start_worker
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait before restarting a worker after its first crash, doubled
+# after each consecutive crash up to MAX_BACKOFF
+BASE_BACKOFF = 1
+MAX_BACKOFF = 60
+# Workers running at least this many seconds before crashing are not
+# considered to be crashing repeatedly, and are restarted immediately
+STABLE_RUNTIME = 60
+# Seconds between checks on the state of the workers
+CHECK_INTERVAL = 0.5
+
+
+def worker_count(value):
+    """Return the number of workers to start for the value of the -n option.
+
+    The value `auto` gives the number of CPU cores.
+    """
+    if value == 'auto':
+        return multiprocessing.cpu_count()
+    count = int(value)
+    if count < 1:
+        raise ValueError('At least one worker is required')
+    return count
+
+
+def backoff(crashes):
+    """Return the seconds to wait before restarting a worker that has
+    crashed the given number of consecutive times."""
+    if crashes < 1:
+        return 0
+    return min(MAX_BACKOFF, BASE_BACKOFF * 2 ** (crashes - 1))
+
+
+def preload(modules):
+    """Import each module, so that forked workers share their code."""
+    for module in modules:
+        logger.info('Preloading {0}'.format(module))
+        importlib.import_module(module)
+
+
+def run_worker(queues, in_process=False, url=None):
+    """Run an rq worker on the queues until it is stopped.
+
+    If in_process is True, the worker runs jobs in its own process, as
+    start_worker.InProcessWorker, rather than forking for each job.
+    The worker connects to the Redis server at the URL, defaulting to
+    start_worker.redis_url().
+    """
+    # Create the connection in the worker, rather than sharing the
+    # supervisor's sockets
+    connection = start_worker.create_connection(
+        start_worker.create_connection_pool(url)
+    )
+    if in_process:
+        worker_class = start_worker.InProcessWorker
+    else:
+        worker_class = start_worker.Worker
+    worker = worker_class(
+        [start_worker.Queue(q, connection=connection) for q in queues],
+        connection=connection
+    )
+    # Jobs find the connection of their worker through rq's connection stack,
+    # as by rq.get_current_job
+    with rq.Connection(connection):
+        worker.work()
+
+
+class Supervisor(object):
+    """Keep num_workers worker processes running.
+
+    Each worker runs target(*args) in a forked child process, and is
+    restarted if it exits before the supervisor is stopped.
+    If slot_args is given, it is called with the slot number of each worker,
+    and the arguments it returns are passed to target after args.
+    """
+    def __init__(self, num_workers, target, args=(), slot_args=None):
+        self.num_workers = num_workers
+        self.target = target
+        self.args = args
+        self.slot_args = slot_args
+        self.stopping = False
+        # Map of the PIDs of running workers to their slot number
+        self.workers = {}
+        # Per slot, the start time and number of consecutive crashes
+        self.started_at = [0] * num_workers
+        self.crashes = [0] * num_workers
+        # Per slot, the time at which a stopped worker should be restarted
+        self.restart_at = [None] * num_workers
+
+    def spawn(self, slot):
+        """Fork a worker process for the slot."""
+        pid = os.fork()
+        if pid == 0:
+            # The child must not run the supervisor's signal handlers, and
+            # leaves the process group so that a Ctrl+C in the terminal only
+            # reaches the supervisor, which then stops the workers
+            os.setpgrp()
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            random.seed()
+            status = 1
+            args = tuple(self.args)
+            if self.slot_args is not None:
+                args += tuple(self.slot_args(slot))
+            try:
+                self.target(*args)
+                status = 0
+            except Exception:
+                logger.exception('Worker {0} failed'.format(os.getpid()))
+            finally:
+                os._exit(status)
+        logger.info('Started worker {0} in slot {1}'.format(pid, slot))
+        self.workers[pid] = slot
+        self.started_at[slot] = time.time()
+        self.restart_at[slot] = None
+
+    def stop(self, signum=None, frame=None):
+        """Ask all workers to finish their current job and exit."""
+        if self.stopping:
+            return
+        logger.info('Stopping {0} workers'.format(len(self.workers)))
+        self.stopping = True
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    raise
+
+    def reap(self):
+        """Handle workers that have exited, scheduling their restart."""
+        while self.workers:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.ECHILD:
+                    self.workers.clear()
+                    break
+                raise
+            if pid == 0:
+                break
+            slot = self.workers.pop(pid, None)
+            if slot is None or self.stopping:
+                continue
+            runtime = time.time() - self.started_at[slot]
+            if runtime >= STABLE_RUNTIME:
+                self.crashes[slot] = 0
+            else:
+                self.crashes[slot] += 1
+            delay = backoff(self.crashes[slot])
+            logger.warning(
+                'Worker {0} exited with status {1}, restarting in {2} '
+                'seconds'.format(pid, status, delay)
+            )
+            self.restart_at[slot] = time.time() + delay
+
+    def run(self):
+        """Start the workers and supervise them until stopped."""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for slot in range(self.num_workers):
+            self.spawn(slot)
+        while self.workers or not self.stopping:
+            self.reap()
+            now = time.time()
+            for slot, restart_at in enumerate(self.restart_at):
+                if not self.stopping and restart_at is not None \
+                        and restart_at <= now:
+                    self.spawn(slot)
+            time.sleep(CHECK_INTERVAL)
+        logger.info('All workers stopped')
+
+
+def parse_args(argv):
+    """Return the options parsed from the command line arguments."""
+    parser = optparse.OptionParser(
+        usage='%prog [-n WORKERS] [-q QUEUE ...] [--preload MODULE ...]'
+    )
+    parser.add_option('-n', '--workers', default='auto',
+                      help='number of workers, at least one per '
+                           '--redis-url, or `auto` for one per CPU core '
+                           '(default: %default)')
+    parser.add_option('-q', '--queue', dest='queues', action='append',
+                      help='queue to listen on, can be given more than once '
+                           '(default: {0})'.format(
+                               ', '.join(start_worker.listen)))
+    parser.add_option('--preload', dest='modules', action='append',
+                      default=[],
+                      help='module to import before forking the workers, '
+                           'can be given more than once')
+    parser.add_option('--in-process', action='store_true', default=False,
+                      help='run jobs in the worker processes, rather than '
+                           'forking for each job, so that caches such as '
+                           'jobmonitor.filecache last between jobs')
+    parser.add_option('--redis-url', dest='redis_urls', action='append',
+                      default=[],
+                      help='Redis server to take jobs from, can be given '
+                           'more than once to share the workers out between '
+                           'shards (default: REDIS_URL)')
+    parser.add_option('--result-redis-url',
+                      help='Redis server job results are stored in '
+                           '(default: JOBMONITOR_RESULT_REDIS_URL, or the '
+                           'job hashes)')
+    options, args = parser.parse_args(argv)
+    if args:
+        parser.error('Unexpected arguments: {0}'.format(' '.join(args)))
+    try:
+        workers = worker_count(options.workers)
+    except ValueError:
+        parser.error('Invalid number of workers `{0}`'.format(
+            options.workers
+        ))
+    # Jobs on a Redis server without a worker would never run
+    shards = len(options.redis_urls)
+    if workers < shards:
+        if options.workers != 'auto':
+            parser.error('At least one worker per --redis-url is required, '
+                         'so {0} workers are needed'.format(shards))
+        workers = shards
+    options.workers = workers
+    if not options.queues:
+        options.queues = list(start_worker.listen)
+    return options
+
+
+def main(argv=None):
+    """Entry point of the jobmonitor-workers command."""
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s %(name)s: %(message)s')
+    options = parse_args(sys.argv[1:] if argv is None else argv)
+    preload(options.modules)
+    if options.result_redis_url:
+        # Read by start_worker.Job in the workers
+        os.environ['JOBMONITOR_RESULT_REDIS_URL'] = options.result_redis_url
+    urls = options.redis_urls
+
+    def slot_args(slot):
+        # Workers are shared out between the Redis servers in turn
+        return (urls[slot % len(urls)],) if urls else ()
+
+    supervisor = Supervisor(options.workers, run_worker,
+                            (options.queues, options.in_process), slot_args)
+    supervisor.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -23,6 +23,11 @@ setup(
         'rq>=0.4.6',
         'redis==2.10.1'
     ],
+    entry_points={
+        'console_scripts': [
+            'jobmonitor-workers = jobmonitor.supervisor:main'
+        ]
+    },
     test_suite='tests',
     tests_require=['unittest2', 'mock', 'fakeredis'],
     classifiers=[
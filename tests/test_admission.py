@@ -0,0 +1,190 @@
+import json
+import unittest2
+import uuid
+import mock
+import fakeredis
+import jobmonitor
+from jobmonitor import admission, config, sharding, start_worker
+from jobmonitor.FlaskWithJobResolvers import ResolvedJob
+from tests.test_jobs_blueprint import mocked_resolve_connection, str_resolver
+
+
+def limits(**kwargs):
+    """Return the default configuration with the limits changed."""
+    d = dict((k, getattr(config, k)) for k in dir(config) if k.isupper())
+    d.update(kwargs)
+    return d
+
+
+class TestCheck(unittest2.TestCase):
+    def setUp(self):
+        self.connection = fakeredis.FakeStrictRedis()
+        self.shards = sharding.Shards([self.connection])
+        # The database is shared between tests, so clients are unique
+        self.client = uuid.uuid4().hex
+        self.calls = [(ResolvedJob(self.client, queue='default'), {})]
+
+    def test_no_limits(self):
+        """Without limits, nothing should be sent to Redis."""
+        connection = mock.Mock()
+        assert admission.check(sharding.Shards([connection]), limits(),
+                               self.client, self.calls) is None
+        assert not connection.pipeline.called
+
+    def test_client_rate_limit(self):
+        """Clients should be limited to a number of jobs per period."""
+        c = limits(CLIENT_RATE_LIMIT=3, RATE_LIMIT_PERIOD=60)
+        now = 600.0
+        assert admission.check(self.shards, c, self.client,
+                               self.calls * 2, now) is None
+        assert admission.check(self.shards, c, self.client,
+                               self.calls, now + 10) is None
+        reason, _, retry_after = admission.check(
+            self.shards, c, self.client, self.calls, now + 15
+        )
+        assert reason == 'client_rate'
+        assert retry_after == 45
+        # Other clients have their own limit
+        assert admission.check(self.shards, c, self.client + 'x',
+                               self.calls, now + 15) is None
+        # The rate is refilled at the start of the next period
+        assert admission.check(self.shards, c, self.client,
+                               self.calls * 3, now + 60) is None
+
+    def test_rejections_not_counted(self):
+        """Rejected submissions should not use up the rate."""
+        c = limits(CLIENT_RATE_LIMIT=2, TASK_RATE_LIMIT=1)
+        now = 1200.0
+        rejection = admission.check(self.shards, c, self.client,
+                                    self.calls * 2, now)
+        assert rejection[0] == 'task_rate'
+        assert admission.check(self.shards, c, self.client,
+                               self.calls, now) is None
+
+    def test_queue_depth(self):
+        """Submissions filling a queue past its maximum should be rejected.
+        """
+        queue = 'admission-' + self.client
+        key = start_worker.Queue.redis_queue_namespace_prefix + queue
+        self.connection.rpush(key, 'a', 'b')
+        calls = [(ResolvedJob('str', queue=queue), {})]
+        c = limits(QUEUE_DEPTH_MAX=3, ADMISSION_RETRY_AFTER=7)
+        assert admission.check(self.shards, c, self.client, calls) is None
+        reason, _, retry_after = admission.check(
+            self.shards, c, self.client, calls * 2
+        )
+        assert reason == 'queue_depth'
+        assert retry_after == 7
+
+    def test_client_inflight(self):
+        """Clients should be limited to a number of pending jobs, not
+        counting those pending for too long."""
+        key = start_worker.inflight_key(self.client)
+        now = 10 * admission.INFLIGHT_TTL
+        self.connection.zadd(key, now - 1, 'a')
+        self.connection.zadd(key, now - 2*admission.INFLIGHT_TTL, 'b')
+        c = limits(CLIENT_INFLIGHT_MAX=2)
+        assert admission.check(self.shards, c, self.client, self.calls,
+                               now) is None
+        assert self.connection.zcard(key) == 1
+        rejection = admission.check(self.shards, c, self.client,
+                                    self.calls * 2, now)
+        assert rejection[0] == 'client_inflight'
+
+    def test_client_id(self):
+        """Clients should be identified by the header, if given."""
+        request = mock.Mock(remote_addr='10.0.0.1',
+                            headers={'X-Forwarded-For': '1.2.3.4'})
+        assert admission.client_id(request) == '10.0.0.1'
+        assert admission.client_id(request, 'X-Forwarded-For') == '1.2.3.4'
+        assert admission.client_id(request, 'X-Client') == '10.0.0.1'
+
+    def test_client_id_spoofed(self):
+        """Addresses sent by the client in the header should be ignored."""
+        request = mock.Mock(remote_addr='10.0.0.1', headers={
+            'X-Forwarded-For': '6.6.6.6, 1.2.3.4, 10.0.0.2'
+        })
+        assert admission.client_id(request, 'X-Forwarded-For') == '10.0.0.2'
+        assert admission.client_id(request, 'X-Forwarded-For', 2) == \
+            '1.2.3.4'
+        assert admission.client_id(request, 'X-Forwarded-For', 4) == \
+            '10.0.0.1'
+
+
+@mock.patch('redis.StrictRedis', fakeredis.FakeStrictRedis)
+@mock.patch('rq.queue.resolve_connection', mocked_resolve_connection)
+@mock.patch('rq.job.resolve_connection', mocked_resolve_connection)
+class TestAdmission(unittest2.TestCase):
+    @mock.patch('redis.StrictRedis', fakeredis.FakeStrictRedis)
+    @mock.patch('rq.queue.resolve_connection', mocked_resolve_connection)
+    def setUp(self):
+        self.app = jobmonitor.create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['CLIENT_ID_HEADER'] = 'X-Client'
+        self.app.add_job_resolver(str_resolver)
+        self.client = self.app.test_client()
+        self.client_id = uuid.uuid4().hex
+        self.job_ids = []
+
+    def tearDown(self):
+        # Other tests list the queue, which the database is shared with
+        connection = fakeredis.FakeStrictRedis()
+        key = start_worker.Queue.redis_queue_namespace_prefix + 'default'
+        for job_id in self.job_ids:
+            connection.lrem(key, 0, job_id)
+
+    def submit(self, url='/jobs', tasks=None, spoofed=None):
+        if tasks is None:
+            data = dict(task_name='foo')
+        else:
+            data = dict(jobs=[dict(task_name=t) for t in tasks])
+        client_id = self.client_id
+        if spoofed is not None:
+            client_id = '{0}, {1}'.format(spoofed, client_id)
+        rv = self.client.post(url, data=json.dumps(data),
+                              content_type='application/json',
+                              headers={'X-Client': client_id})
+        if rv.status_code == 201:
+            data = json.loads(rv.data)
+            jobs = data['jobs'] if 'jobs' in data else [data]
+            self.job_ids.extend(j['job']['id'] for j in jobs)
+        return rv
+
+    @mock.patch('jobmonitor.admission.time')
+    def test_rate_limited(self, mocked_time):
+        """Clients submitting too many jobs should get a 429."""
+        mocked_time.time.return_value = 600.0
+        self.app.config['CLIENT_RATE_LIMIT'] = 2
+        assert self.submit().status_code == 201
+        assert self.submit('/jobs/batch', ['a', 'b']).status_code == 429
+        rv = self.submit()
+        assert rv.status_code == 201
+        rv = self.submit()
+        assert rv.status_code == 429
+        assert rv.headers['Retry-After'] == '60'
+        assert 'message' in json.loads(rv.data)
+
+    @mock.patch('jobmonitor.admission.time')
+    def test_spoofed_rate_limited(self, mocked_time):
+        """Clients should not escape their limit by sending a different
+        address in the header with each submission."""
+        mocked_time.time.return_value = 600.0
+        self.app.config['CLIENT_RATE_LIMIT'] = 1
+        assert self.submit(spoofed='1.1.1.1').status_code == 201
+        assert self.submit(spoofed='2.2.2.2').status_code == 429
+
+    def test_inflight_limited(self):
+        """Clients should not have more than their limit of jobs pending."""
+        self.app.config['CLIENT_INFLIGHT_MAX'] = 1
+        assert self.submit().status_code == 201
+        assert self.submit().status_code == 429
+        # Cancelling the pending job frees up its slot
+        # fakeredis does not support publishing
+        with mock.patch.object(self.app.redis, 'publish', create=True):
+            rv = self.client.delete('/jobs/{0}'.format(self.job_ids[0]))
+        assert rv.status_code == 200
+        assert self.submit().status_code == 201
+
+
+if __name__ == '__main__':
+    unittest2.main()
@@ -0,0 +1,101 @@
+import unittest2
+import json
+import mock
+import os
+import shutil
+import tempfile
+import zlib
+from werkzeug.datastructures import Accept
+from jobmonitor import assets
+
+
+class TestAssets(unittest2.TestCase):
+    def setUp(self):
+        self.source = tempfile.mkdtemp()
+        self.destination = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.source, 'javascripts'))
+        os.makedirs(os.path.join(self.source, 'files'))
+        self.write('javascripts/app.js', b'var a = 1;\n' * 100)
+        self.write('favicon.png', b'\x89PNG')
+        self.write('files/data.root', b'data')
+
+    def tearDown(self):
+        shutil.rmtree(self.source)
+        shutil.rmtree(self.destination)
+
+    def write(self, path, data):
+        with open(os.path.join(self.source, path), 'wb') as f:
+            f.write(data)
+
+    def build(self):
+        return assets.build(self.source, self.destination,
+                            exclude=[os.path.join(self.source, 'files')],
+                            use_brotli=False)
+
+    def test_build(self):
+        """Files should be fingerprinted, and text files compressed."""
+        manifest = self.build()
+        assert sorted(manifest) == ['favicon.png', 'javascripts/app.js']
+        entry = manifest['javascripts/app.js']
+        assert entry['path'].startswith('javascripts/app.')
+        assert entry['path'].endswith('.js')
+        assert entry['encodings'] == ['gzip']
+        assert manifest['favicon.png']['encodings'] == []
+        built = os.path.join(self.destination, entry['path'])
+        with open(built + '.gz', 'rb') as f:
+            assert zlib.decompress(f.read(), 47) == b'var a = 1;\n' * 100
+        with open(os.path.join(self.destination, assets.MANIFEST_NAME)) as f:
+            assert json.load(f) == manifest
+
+    def test_fingerprint_changes(self):
+        """A changed file should get a new fingerprint."""
+        before = self.build()['javascripts/app.js']['path']
+        assert self.build()['javascripts/app.js']['path'] == before
+        self.write('javascripts/app.js', b'var a = 2;\n')
+        assert self.build()['javascripts/app.js']['path'] != before
+
+    def test_variant(self):
+        """The compressed variant should be chosen if it's accepted."""
+        built = assets.Assets(self.source, self.destination, self.build())
+        path = built.built_path('javascripts/app.js')
+        accept = Accept([('gzip', 1)])
+        filename, encoding = built.variant(path, accept)
+        assert encoding == 'gzip'
+        assert filename.endswith('.gz')
+        filename, encoding = built.variant(path, Accept())
+        assert encoding is None
+        assert os.path.exists(filename)
+        with self.assertRaises(KeyError):
+            built.variant('javascripts/app.js', accept)
+
+    def test_get_assets(self):
+        """Assets should only be built once per source and destination."""
+        built = assets.get_assets(self.source, self.destination)
+        assert assets.get_assets(self.source, self.destination) is built
+        # Assets are only built again once a file changes
+        assert assets.get_assets(self.source, self.destination,
+                                 rebuild=True) is built
+        self.write('javascripts/app.js', b'var a = 2;\n')
+        rebuilt = assets.get_assets(self.source, self.destination,
+                                    rebuild=True)
+        assert rebuilt is not built
+        assert rebuilt.version != built.version
+
+    def test_temporary_build_directory(self):
+        """Assets built in to a temporary directory should be removed when
+        the process that built them exits."""
+        with mock.patch('atexit.register') as register:
+            built = assets.get_assets(self.source)
+        self.addCleanup(assets._assets.pop, (self.source, None))
+        assert os.path.isdir(built.destination)
+        remove, directory, pid = register.call_args[0]
+        assert directory == built.destination
+        # Forked processes leave the directory to their parent
+        remove(directory, pid + 1)
+        assert os.path.isdir(built.destination)
+        remove(directory, pid)
+        assert not os.path.exists(built.destination)
+
+
+if __name__ == '__main__':
+    unittest2.main()
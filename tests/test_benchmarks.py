@@ -0,0 +1,58 @@
+import unittest2
+import mock
+import os
+import shutil
+import tempfile
+from benchmarks import harness, load, startup
+
+
+class TestBenchmarks(unittest2.TestCase):
+    def test_percentile(self):
+        """Percentiles should be taken by the nearest rank."""
+        values = list(range(1, 101))
+        assert harness.percentile(values, 50) == 50
+        assert harness.percentile(values, 99) == 99
+        assert harness.percentile(values, 100) == 100
+        assert harness.percentile([], 50) is None
+
+    def test_compare(self):
+        """Slower timings and lower throughputs should be regressions."""
+        baseline = dict(a=dict(median_us=10.0, calls_per_second=100.0),
+                        b=dict(p99_ms=5.0))
+        results = dict(a=dict(median_us=13.0, calls_per_second=100.0),
+                       b=dict(p99_ms=5.5), c=dict(p99_ms=1.0))
+        rows, regressions = harness.compare(results, baseline, 0.2)
+        assert len(rows) == 3
+        assert [(r[0], r[1]) for r in regressions] == [('a', 'median_us')]
+
+    def test_baselines(self):
+        """Saved baselines should be loaded again."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        with mock.patch.object(harness, 'BASELINE_DIRECTORY',
+                               os.path.join(directory, 'baselines')):
+            harness.save_baseline('test', dict(a=dict(median_us=1.0)))
+            assert harness.load_baseline('test') == dict(
+                a=dict(median_us=1.0)
+            )
+
+    def test_load(self):
+        """The load test should submit and poll jobs without errors."""
+        stats = load.run(clients=2, duration=0.3, poll_rate=0.01,
+                         job_time=0.01, workers=1)
+        assert stats['load all']['errors'] == 0
+        assert stats['load POST /jobs']['count'] > 0
+        assert stats['load GET /jobs/<id>']['count'] > 0
+
+    def test_startup(self):
+        """A lazy app should load fewer modules than an eager one."""
+        stats = startup.run(repeat=1)
+        assert stats['startup create_app']['median_ms'] > 0
+        assert stats['startup create_app lazy']['modules'] < \
+            stats['startup create_app']['modules']
+        assert stats['startup import']['modules'] < \
+            stats['startup create_app lazy']['modules']
+
+
+if __name__ == '__main__':
+    unittest2.main()
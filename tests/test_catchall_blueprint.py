@@ -1,7 +1,9 @@
 import unittest2
 from mock import patch
 import flask
+import fakeredis
 import jobmonitor
+from jobmonitor import assets, catchall
 
 class TestCatchAll(unittest2.TestCase):
     def setUp(self):
@@ -20,7 +22,10 @@ class TestCatchAll(unittest2.TestCase):
         assert '404' in rv.data
 
     # Mock out render_template else it will raise TemplateNotFound, calling
-    # the 404 error handler and setting g.active_page to '404'
+    # the 404 error handler and setting g.active_page to '404', and pretend
+    # the templates exist, else the route table 404s without rendering
+    @patch('jobmonitor.catchall.list_page_templates',
+           lambda app: ['foo.html', 'foo/bar.html', 'baz/qux.html'])
     @patch('jobmonitor.catchall.render_template')
     def test_active_path(self, mocked):
         """Global active path var should be set to the resolved child."""
@@ -44,6 +49,161 @@ class TestCatchAll(unittest2.TestCase):
             assert mocked.call_args[0][0] == 'baz/qux.html'
             assert flask.g.active_page == 'baz/qux'
 
+    @patch('jobmonitor.catchall.list_page_templates',
+           lambda app: ['foo.html'])
+    @patch('jobmonitor.catchall.render_template')
+    def test_missing_default_child_template(self, mocked):
+        """A path whose default child has no template should 404 without
+        trying to render the child."""
+        mocked.return_value = 'Not found'
+        rv = self.client.get('/baz')
+        assert rv.status_code == 404
+        assert mocked.call_args[0][0] == 'errors/404.html'
+
+    def test_route_table_rebuilt(self):
+        """The route table should follow changes to DEFAULT_CHILDREN."""
+        with self.app.test_request_context():
+            table = catchall.route_table()
+            assert catchall.route_table() is table
+            self.app.config['DEFAULT_CHILDREN'] = {'': 'layout'}
+            table = catchall.route_table()
+            assert table.pages[''] == 'layout'
+            assert table.pages['errors/404'] == 'errors/404'
+
+    def test_route_table_edited_in_place(self):
+        """The route table should follow DEFAULT_CHILDREN edited in place."""
+        with self.app.test_request_context():
+            table = catchall.route_table()
+            self.app.config['DEFAULT_CHILDREN'][''] = 'layout'
+            table = catchall.route_table()
+            assert table.pages[''] == 'layout'
+            assert catchall.route_table() is table
+
+    @patch('jobmonitor.catchall.list_page_templates',
+           lambda app: ['foo.html', 'baz/qux.html'])
+    def test_default_child_path(self):
+        """Default child paths should come from the route table."""
+        with self.app.test_request_context():
+            with patch('jobmonitor.catchall.resolve_default_children',
+                       wraps=catchall.resolve_default_children) as mocked:
+                assert catchall.default_child_path('') == 'foo'
+                assert catchall.default_child_path('baz') == 'baz/qux'
+                assert catchall.default_child_path('foo') == 'foo'
+                assert catchall.default_child_path('missing') == 'missing'
+                assert mocked.call_count == 1
+
+    def test_resolve_default_children(self):
+        """Chains of default children should be flattened."""
+        resolved = catchall.resolve_default_children({
+            'a': 'a/b', 'a/b': 'a/b/c', 'd': 'a'
+        })
+        assert resolved == {'a': 'a/b/c', 'a/b': 'a/b/c', 'd': 'a/b/c'}
+
+    def test_default_children_cycle(self):
+        """Circular default children should be rejected up front."""
+        with self.assertRaises(catchall.DefaultChildCycleError):
+            catchall.resolve_default_children({'a': 'b', 'b': 'c', 'c': 'a'})
+        self.app.config['DEFAULT_CHILDREN'] = {'a': 'a'}
+        with self.app.test_request_context():
+            with self.assertRaises(catchall.DefaultChildCycleError):
+                catchall.route_table()
+
+    def test_page_cache(self):
+        """Cached pages should only be rendered once, and carry validators."""
+        self.app.config['PAGE_CACHE'] = True
+        with patch('jobmonitor.catchall.render_template',
+                   wraps=flask.render_template) as mocked:
+            rv = self.client.get('/layout')
+            assert rv.status_code == 200
+            etag = rv.headers['ETag']
+            assert 'Last-Modified' in rv.headers
+            rv = self.client.get('/layout')
+            assert rv.headers['ETag'] == etag
+            assert mocked.call_count == 1
+            rv = self.client.get('/layout', headers={'If-None-Match': etag})
+            assert rv.status_code == 304
+            # The 404 page is cached too
+            self.client.get('/fake_route')
+            rv = self.client.get('/fake_route')
+            assert rv.status_code == 404
+            assert mocked.call_count == 2
+
+    def test_page_cache_template_reloaded(self):
+        """Pages should be rendered again when their templates change."""
+        self.app.config['PAGE_CACHE'] = True
+        with patch('jobmonitor.catchall.render_template',
+                   wraps=flask.render_template) as mocked:
+            self.client.get('/layout')
+            with patch('jobmonitor.catchall.template_versions',
+                       return_value=(1,)):
+                self.client.get('/layout')
+            assert mocked.call_count == 2
+
+    def test_page_cache_redis(self):
+        """Pages cached in Redis should be shared between processes."""
+        self.app.config['PAGE_CACHE'] = True
+        self.app.config['PAGE_CACHE_REDIS'] = True
+        self.app.redis = fakeredis.FakeStrictRedis()
+        with patch('jobmonitor.catchall.render_template',
+                   wraps=flask.render_template) as mocked:
+            rv = self.client.get('/layout')
+            # Empty the in-process cache, as if in another process
+            self.app.route_table.page_cache.clear()
+            assert self.client.get('/layout').data == rv.data
+            assert mocked.call_count == 1
+
+    def test_fingerprinted_assets(self):
+        """Pages should link to fingerprinted assets, which are served
+        compressed and cached indefinitely."""
+        rv = self.client.get('/layout')
+        page = rv.data.decode('utf-8')
+        assert '/static/javascripts/jobmonitor.js' not in page
+        start = page.index('/assets/javascripts/jobmonitor.')
+        url = page[start:page.index('"', start)]
+        rv = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        assert rv.status_code == 200
+        assert rv.mimetype.endswith('javascript')
+        assert rv.headers['Content-Encoding'] == 'gzip'
+        assert rv.headers['Vary'] == 'Accept-Encoding'
+        assert 'immutable' in rv.headers['Cache-Control']
+        rv.close()
+        rv = self.client.get(url)
+        assert 'Content-Encoding' not in rv.headers
+        rv.close()
+        assert self.client.get('/assets/nonexistent.js').status_code == 404
+
+    def test_debug_assets(self):
+        """In debug mode, assets should be checked for changes once per
+        request, and not built again unless they changed."""
+        self.app.debug = True
+        with patch('jobmonitor.assets.source_stamp',
+                   wraps=assets.source_stamp) as stamp, \
+                patch('jobmonitor.assets.build',
+                      wraps=assets.build) as build:
+            rv = self.client.get('/layout')
+            assert rv.status_code == 200
+            assert rv.data.count(b'/assets/') > 1
+            assert stamp.call_count == 1
+            assert not build.called
+
+    def test_asset_url_without_blueprint(self):
+        """Assets of the current blueprint should be those of the app when
+        the request has no blueprint."""
+        with self.app.test_request_context('/static/favicon.ico'):
+            assert flask.request.blueprint is None
+            url = catchall.asset_url('javascripts/jobmonitor.js', '')
+            assert url.startswith('/assets/javascripts/jobmonitor.')
+            self.app.config['ASSETS_FINGERPRINT'] = False
+            url = catchall.asset_url('javascripts/jobmonitor.js', '')
+            assert url == '/static/javascripts/jobmonitor.js'
+
+    def test_fingerprinting_disabled(self):
+        """Assets should be served from the static folder if fingerprinting
+        is disabled."""
+        self.app.config['ASSETS_FINGERPRINT'] = False
+        rv = self.client.get('/layout')
+        assert '/static/javascripts/jobmonitor.js' in rv.data.decode('utf-8')
+
 
 if __name__ == '__main__':
     unittest2.main()
@@ -0,0 +1,208 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest2
+import mock
+import rq
+from rq.compat import as_text
+import fakeredis
+import jobmonitor
+from jobmonitor import fanout, start_worker
+from jobmonitor.FlaskWithJobResolvers import ResolvedJob
+from tests.test_jobs_blueprint import mocked_resolve_connection
+
+
+def count_evens(n, start, stop, fail_at=None):
+    """Job returning the number of even numbers in [start, stop)."""
+    if fail_at is not None and start <= fail_at < stop:
+        raise ValueError('Failed')
+    return len([i for i in range(start, stop) if i % 2 == 0])
+
+
+def add(counts):
+    """Merge the counts of count_evens."""
+    return sum(counts)
+
+
+def number_ranges(args, chunks):
+    """Split range(args['n']) in to chunks ranges."""
+    n = args['n']
+    return [(i*n//chunks, (i + 1)*n//chunks) for i in range(chunks)]
+
+
+def split_resolver(jname):
+    if jname == 'evens':
+        return ResolvedJob('tests.test_fanout.count_evens',
+                           split=fanout.Split('tests.test_fanout.add',
+                                              ranges=number_ranges))
+    if jname == 'bytes':
+        return ResolvedJob('len',
+                           split=fanout.Split('tests.test_fanout.add',
+                                              file_arg='filename'))
+    return None
+
+
+class TestSplit(unittest2.TestCase):
+    def test_byte_ranges(self):
+        """Byte ranges should cover the size in nearly equal lengths."""
+        assert fanout.byte_ranges(10, 3) == [(0, 4), (4, 7), (7, 10)]
+        assert fanout.byte_ranges(2, 4) == [(0, 1), (1, 2)]
+        assert fanout.byte_ranges(0, 4) == [(0, 0)]
+
+    def test_split_arguments(self):
+        """Splits need exactly one way of choosing ranges."""
+        with self.assertRaises(ValueError):
+            fanout.Split('foo.merge')
+        with self.assertRaises(ValueError):
+            fanout.Split('foo.merge', file_arg='f', ranges=number_ranges)
+
+
+@mock.patch('redis.StrictRedis', fakeredis.FakeStrictRedis)
+@mock.patch('rq.queue.resolve_connection', mocked_resolve_connection)
+@mock.patch('rq.job.resolve_connection', mocked_resolve_connection)
+@mock.patch('rq.connections.patch_connection', lambda connection: connection)
+@mock.patch('jobmonitor.fanout.worker_count', lambda connection: 3)
+class TestFanout(unittest2.TestCase):
+    @mock.patch('redis.StrictRedis', fakeredis.FakeStrictRedis)
+    @mock.patch('rq.queue.resolve_connection', mocked_resolve_connection)
+    def setUp(self):
+        self.files_directory = tempfile.mkdtemp()
+        self.app = jobmonitor.create_app()
+        self.app.config['TESTING'] = True
+        self.app.config['FILES_DIRECTORY'] = self.files_directory
+        self.app.add_job_resolver(split_resolver)
+        self.client = self.app.test_client()
+        self.connection = fakeredis.FakeStrictRedis()
+        mocked_resolve_connection(self.connection)
+        # fakeredis does not support publishing
+        self.connection.publish = mock.Mock()
+        self.app.redis.publish = self.connection.publish
+        self.job_ids = []
+
+    def tearDown(self):
+        shutil.rmtree(self.files_directory)
+        # Other tests list the queue, which the database is shared with
+        key = start_worker.Queue.redis_queue_namespace_prefix + 'default'
+        for job_id in self.job_ids:
+            self.connection.lrem(key, 0, job_id)
+
+    def submit(self, task_name, args):
+        """Return the response to submitting the task."""
+        return self.client.post('/jobs', data=json.dumps(dict(
+            task_name=task_name, args=args
+        )), content_type='application/json')
+
+    def get_job(self, job_id):
+        rv = self.client.get('/jobs/{0}'.format(job_id))
+        return json.loads(rv.data)['job']
+
+    def chunks(self, job_id):
+        """Return the chunk jobs of the merge job."""
+        chunk_ids = as_text(self.connection.hget(fanout.fanout_key(job_id),
+                                                 'chunks'))
+        chunk_ids = chunk_ids.split(',')
+        self.job_ids.extend(chunk_ids + [job_id])
+        return [start_worker.Job.fetch(chunk_id, connection=self.connection)
+                for chunk_id in chunk_ids]
+
+    def perform(self, job):
+        worker = start_worker.Worker([], connection=self.connection)
+        with rq.Connection(self.connection):
+            return worker.perform_job(job)
+
+    def test_split_job(self):
+        """Split jobs should run as chunks, merged by the job."""
+        rv = self.submit('evens', dict(n=100))
+        assert rv.status_code == 201
+        job_id = json.loads(rv.data)['job']['id']
+        chunks = self.chunks(job_id)
+        assert len(chunks) == 3
+        assert [c.kwargs['start'] for c in chunks] == [0, 33, 66]
+        assert [c.kwargs['stop'] for c in chunks] == [33, 66, 100]
+        assert chunks[0].meta['parent'] == job_id
+        # Chunks are stored on their parent's shard
+        assert [c.id for c in chunks] == \
+            ['{0}.{1}'.format(job_id, i) for i in range(3)]
+        queue = start_worker.Queue(connection=self.connection)
+        assert all(c.id in queue.job_ids for c in chunks)
+        assert job_id not in queue.job_ids
+        assert self.get_job(job_id)['status'] == 'queued'
+        assert self.perform(chunks[0])
+        job = self.get_job(job_id)
+        assert job['status'] == 'started'
+        assert job['partial']['progress'] == 1/3.0
+        assert job['partial']['message'] == '1 of 3 chunks finished'
+        for chunk in chunks[1:]:
+            assert self.perform(chunk)
+        # The last chunk to finish enqueues the merge job
+        assert job_id in queue.job_ids
+        parent = start_worker.Job.fetch(job_id, connection=self.connection)
+        assert self.perform(parent)
+        job = self.get_job(job_id)
+        assert job['status'] == 'finished'
+        assert job['result'] == 50
+        # The chunks are deleted once merged
+        assert not any(self.connection.exists(c.key) for c in chunks)
+        assert not self.connection.exists(fanout.fanout_key(job_id))
+
+    def test_failed_chunk(self):
+        """The job should fail with any of its chunks, cancelling the
+        others."""
+        rv = self.submit('evens', dict(n=100, fail_at=50))
+        job_id = json.loads(rv.data)['job']['id']
+        chunks = self.chunks(job_id)
+        assert self.perform(chunks[0])
+        assert not self.perform(chunks[1])
+        assert self.get_job(job_id)['status'] == 'failed'
+        assert not self.perform(chunks[2])
+        assert chunks[2].get_status() == start_worker.CANCELLED
+        queue = start_worker.Queue(connection=self.connection)
+        assert job_id not in queue.job_ids
+
+    def test_cancel_split_job(self):
+        """Cancelling the job should cancel its chunks."""
+        rv = self.submit('evens', dict(n=100))
+        job_id = json.loads(rv.data)['job']['id']
+        chunks = self.chunks(job_id)
+        assert self.perform(chunks[0])
+        rv = self.client.delete('/jobs/{0}'.format(job_id))
+        assert rv.status_code == 202
+        assert not self.perform(chunks[1])
+        assert self.get_job(job_id)['status'] == start_worker.CANCELLED
+
+    def test_cancel_queued_split_job(self):
+        """Cancelling the job before any chunk has started should take its
+        chunks off the queue."""
+        rv = self.submit('evens', dict(n=100))
+        job_id = json.loads(rv.data)['job']['id']
+        chunks = self.chunks(job_id)
+        rv = self.client.delete('/jobs/{0}'.format(job_id))
+        assert rv.status_code == 200
+        assert json.loads(rv.data)['job']['status'] == start_worker.CANCELLED
+        queue = start_worker.Queue(connection=self.connection)
+        assert not set(c.id for c in chunks) & set(queue.job_ids)
+        assert all(c.get_status() == start_worker.CANCELLED for c in chunks)
+        assert self.get_job(job_id)['status'] == start_worker.CANCELLED
+        self.connection.publish.assert_called_with(
+            start_worker.job_channel(job_id), start_worker.CANCELLED
+        )
+
+    def test_file_split(self):
+        """Jobs split by file should run on byte ranges of the file."""
+        with open(os.path.join(self.files_directory, 'data'), 'wb') as f:
+            f.write(b'x'*10)
+        rv = self.submit('bytes', dict(filename='data'))
+        assert rv.status_code == 201
+        job_id = json.loads(rv.data)['job']['id']
+        ranges = [(c.kwargs['start'], c.kwargs['stop'])
+                  for c in self.chunks(job_id)]
+        assert ranges == [(0, 4), (4, 7), (7, 10)]
+        rv = self.submit('bytes', dict(filename='missing'))
+        assert rv.status_code == 400
+        rv = self.submit('bytes', dict(filename='../data'))
+        assert rv.status_code == 400
+
+
+if __name__ == '__main__':
+    unittest2.main()
@@ -0,0 +1,122 @@
+import functools
+import os
+import shutil
+import tempfile
+import time
+import unittest2
+import mock
+from jobmonitor import filecache
+
+
+def read_lines(path):
+    """Loader returning the lines of the file."""
+    with open(path) as f:
+        return f.read().splitlines()
+
+
+class TestFileCache(unittest2.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        patcher = mock.patch.dict(
+            os.environ, {'JOBMONITOR_FILES_DIRECTORY': self.directory}
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = filecache.FileCache(max_entries=2, max_bytes=100)
+        patcher = mock.patch.object(filecache, 'cache', self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write(self, filename, data):
+        path = os.path.join(self.directory, filename)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_resolve_path(self):
+        """Files should be resolved within the files directory only."""
+        assert filecache.resolve_path('a/b.root') == os.path.join(
+            self.directory, 'a', 'b.root'
+        )
+        with self.assertRaises(ValueError):
+            filecache.resolve_path('../secret')
+        with self.assertRaises(ValueError):
+            filecache.resolve_path('/etc/passwd')
+
+    def test_mapped(self):
+        """Files should be memory-mapped, and only opened once."""
+        self.write('a.dat', b'abcdef')
+        data = filecache.mapped('a.dat')
+        assert data[1:3] == b'bc'
+        assert len(data) == 6
+        assert filecache.mapped('a.dat') is data
+        assert self.cache.stats()['hits'] == 1
+        # Mapped files don't take any memory of their own
+        assert self.cache.nbytes == 0
+        # Empty files can't be mapped, so are read
+        self.write('empty.dat', b'')
+        assert filecache.mapped('empty.dat') == b''
+
+    def test_load(self):
+        """Loaded values should be cached until the file changes."""
+        self.write('a.txt', b'x\ny')
+        loader = mock.Mock(side_effect=read_lines, __name__='read_lines')
+        assert filecache.load('a.txt', loader) == ['x', 'y']
+        assert filecache.load('a.txt', loader) == ['x', 'y']
+        assert loader.call_count == 1
+        assert self.cache.nbytes == 3
+        # Rewrite the file with a later modification time
+        path = self.write('a.txt', b'z')
+        mtime = time.time() + 10
+        os.utime(path, (mtime, mtime))
+        assert filecache.load('a.txt', loader) == ['z']
+        assert loader.call_count == 2
+        assert self.cache.nbytes == 1
+        # Different loaders of the same file are cached separately
+        assert filecache.load('a.txt', read_lines, nbytes=lambda v: 10) == \
+            ['z']
+        assert len(self.cache) == 2
+        assert self.cache.nbytes == 11
+
+    def test_load_key(self):
+        """Loaders without a stable name should need a key, which tells
+        their values apart."""
+        self.write('a.txt', b'x')
+        with self.assertRaises(ValueError):
+            filecache.load('a.txt', lambda p: 'A')
+        with self.assertRaises(ValueError):
+            filecache.load('a.txt', functools.partial(read_lines))
+        assert filecache.load('a.txt', lambda p: 'A', key='a') == 'A'
+        assert filecache.load('a.txt', lambda p: 'B', key='b') == 'B'
+        assert filecache.load('a.txt', lambda p: 'C', key='a') == 'A'
+        partial = functools.partial(read_lines)
+        assert filecache.load('a.txt', partial, key='lines') == ['x']
+        assert filecache.load('a.txt', partial, key='lines') == ['x']
+        assert len(self.cache) == 2
+        assert self.cache.stats()['hits'] == 2
+
+    def test_eviction(self):
+        """The least recently used entries should be evicted once the cache
+        holds too many entries or bytes."""
+        for name in 'abc':
+            self.write(name, b'1' * 40)
+        filecache.load('a', read_lines)
+        filecache.load('b', read_lines)
+        filecache.load('a', read_lines)
+        filecache.load('c', read_lines)
+        assert len(self.cache) == 2
+        assert self.cache.nbytes == 80
+        keys = [path for path, _ in self.cache._entries]
+        assert keys == [filecache.resolve_path('a'),
+                        filecache.resolve_path('c')]
+        filecache.load('b', read_lines, nbytes=lambda v: 90)
+        assert len(self.cache) == 1
+        assert self.cache.nbytes == 90
+        # Values larger than the cache are not kept
+        filecache.load('a', read_lines, nbytes=lambda v: 1000)
+        assert len(self.cache) == 1
+
+
+if __name__ == '__main__':
+    unittest2.main()
@@ -1,5 +1,12 @@
+import threading
+import time
 import unittest2
+import mock
+import fakeredis
 import jobmonitor
+from werkzeug.utils import import_string
+from jobmonitor.FlaskWithJobResolvers import ResolvedJob, StaticJobResolver
+from tests.test_jobs_blueprint import mocked_resolve_connection
 
 def module_resolver(jname):
     """Job resolver which adds a module name (called foo)."""
@@ -69,6 +76,156 @@ class TestJobMonitor(unittest2.TestCase):
         assert self.app.resolve_job('bcd') == None
         assert self.app.resolve_job('abc') == 'foo.abc'
 
+    def test_job_resolution_cached(self):
+        """Resolved task names should be cached until resolvers change."""
+        resolver = mock.Mock(side_effect=module_resolver, spec=module_resolver)
+        self.app.add_job_resolver(resolver)
+        assert self.app.resolve_job('abc') == 'foo.abc'
+        assert self.app.resolve_job('abc') == 'foo.abc'
+        assert resolver.call_count == 1
+        stats = self.app.job_resolver_stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 1
+        # Adding a resolver should clear the cache
+        self.app.add_job_resolver(conditional_resolver)
+        assert self.app.resolve_job('abc') == 'foo.abc'
+        assert resolver.call_count == 2
+        # As should removing one
+        self.app.remove_job_resolver(resolver)
+        self.app.resolve_job('bcd')
+        assert resolver.call_count == 2
+        assert self.app.resolve_job('bcd') is None
+
+    def test_job_resolution_cache_size(self):
+        """The cache should hold at most JOB_RESOLVER_CACHE_SIZE names."""
+        self.app.config['JOB_RESOLVER_CACHE_SIZE'] = 2
+        self.app.add_job_resolver(module_resolver)
+        for name in ('a', 'b', 'c'):
+            self.app.resolve_job(name)
+        assert self.app.job_resolver_stats()['size'] == 2
+
+    def test_static_job_resolution(self):
+        """Static resolvers should be looked up in resolution order."""
+        self.app.add_job_resolver(StaticJobResolver({'abc': 'bar.abc'}))
+        self.app.add_job_resolver(StaticJobResolver({
+            'abc': 'baz.abc',
+            'bcd': 'baz.bcd'
+        }))
+        self.app.add_job_resolver(module_resolver)
+        assert self.app.resolve_job('abc') == 'bar.abc'
+        assert self.app.resolve_job('bcd') == 'baz.bcd'
+        assert self.app.resolve_job('cde') == 'foo.cde'
+
+    def test_prefixed_job_resolution(self):
+        """Resolvers with a prefix should only be called for that prefix."""
+        resolver = mock.Mock(side_effect=module_resolver, spec=module_resolver)
+        resolver.task_prefix = 'ab'
+        self.app.add_job_resolver(resolver)
+        assert self.app.resolve_job('bcd') is None
+        assert not resolver.called
+        assert self.app.resolve_job('abc') == 'foo.abc'
+
+    def test_job_spec_resolution(self):
+        """Resolvers may return a ResolvedJob with options for the job."""
+        self.app.add_job_resolver(StaticJobResolver({
+            'abc': ResolvedJob('bar.abc', queue='low', timeout=600)
+        }))
+        self.app.add_job_resolver(module_resolver)
+        assert self.app.resolve_job('abc') == 'bar.abc'
+        resolved = self.app.resolve_job_spec('abc')
+        assert resolved.queue == 'low'
+        assert resolved.timeout == 600
+        # Plain job names should be given the default options
+        resolved = self.app.resolve_job_spec('bcd')
+        assert resolved.name == 'foo.bcd'
+        assert resolved.queue is None
+        assert resolved.timeout is None
+
+    def test_job_resolution_by_path(self):
+        """Resolvers added by their path should be imported on first use."""
+        self.app.add_job_resolver('tests.missing:resolver')
+        self.app.remove_job_resolver('tests.missing:resolver')
+        self.app.add_job_resolver(StaticJobResolver({'abc': 'bar.abc'}))
+        self.app.add_job_resolver(
+            'tests.test_jobmonitor_app.conditional_resolver'
+        )
+        assert self.app.resolve_job('abc') == 'bar.abc'
+        assert self.app.resolve_job('acd') == 'foo.acd'
+        self.app.add_job_resolver('tests.missing:resolver')
+        with self.assertRaises(ImportError):
+            self.app.resolve_job('bcd')
+
+
+@mock.patch('redis.StrictRedis', fakeredis.FakeStrictRedis)
+@mock.patch('rq.queue.resolve_connection', mocked_resolve_connection)
+@mock.patch('rq.job.resolve_connection', mocked_resolve_connection)
+class TestLazyApp(unittest2.TestCase):
+    def tearDown(self):
+        jobmonitor._app = None
+
+    def test_lazy_jobs_blueprint(self):
+        """The jobs API should be registered on the first request."""
+        app = jobmonitor.create_app(lazy=True)
+        assert 'jobs' not in app.blueprints
+        rv = app.test_client().get('/jobs/stats')
+        assert rv.status_code == 200
+        assert 'jobs' in app.blueprints
+
+    def test_lazy_blueprint_import_error(self):
+        """A blueprint failing to import should be tried again."""
+        app = jobmonitor.create_app(lazy=True)
+        failures = [ImportError('Failed')]
+
+        def failing_import_string(import_name):
+            if failures:
+                raise failures.pop()
+            return import_string(import_name)
+        with mock.patch('jobmonitor.FlaskWithJobResolvers.import_string',
+                        failing_import_string):
+            with self.assertRaises(ImportError):
+                app.test_client().get('/jobs/stats')
+            rv = app.test_client().get('/jobs/stats')
+        assert rv.status_code == 200
+
+    def test_lazy_blueprint_concurrent(self):
+        """Requests arriving during the registration should wait for it."""
+        app = jobmonitor.create_app(lazy=True)
+        importing, imported = threading.Event(), threading.Event()
+
+        def slow_import_string(import_name):
+            importing.set()
+            imported.wait(5)
+            return import_string(import_name)
+        statuses = []
+
+        def get():
+            rv = app.test_client().get('/jobs/stats')
+            statuses.append(rv.status_code)
+        with mock.patch('jobmonitor.FlaskWithJobResolvers.import_string',
+                        slow_import_string):
+            threads = [threading.Thread(target=get) for _ in range(2)]
+            threads[0].start()
+            importing.wait(5)
+            threads[1].start()
+            time.sleep(0.05)
+            imported.set()
+            for thread in threads:
+                thread.join()
+        assert statuses == [200, 200]
+
+    def test_preload(self):
+        """Preloading should load the app served by wsgi up front."""
+        app = jobmonitor.create_app(lazy=True)
+        assert jobmonitor.preload(app) is app
+        assert 'jobs' in app.blueprints
+        start_response = mock.Mock()
+        environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/jobs/stats',
+                   'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+                   'wsgi.url_scheme': 'http'}
+        with mock.patch.object(app, 'wsgi_app') as wsgi_app:
+            jobmonitor.wsgi(environ, start_response)
+        wsgi_app.assert_called_once_with(environ, start_response)
+
 
 if __name__ == '__main__':
     unittest2.main()
@@ -1,11 +1,17 @@
 import unittest2
 import mock
 import json
+import os
+import shutil
+import tempfile
+import zlib
 import flask
 import rq
+from rq.utils import utcnow
 import fakeredis
 import jobmonitor
-from jobmonitor import start_worker
+from jobmonitor import jobs, results, start_worker
+from jobmonitor.FlaskWithJobResolvers import ResolvedJob
 
 # The resolve_connection method in rq.connections calls patch_connection(conn)
 # in rq.compat.connections. This method checks if conn is an instance of
@@ -32,6 +38,18 @@ def conditional_resolver(jname):
     """Job resolver that resolves to str_resolver if jnames start with 'a'."""
     return str_resolver(jname) if jname.startswith('a') else None
 
+def routing_resolver(jname):
+    """Job resolver that routes jnames starting with 'slow' to the low queue."""
+    if jname.startswith('slow'):
+        return ResolvedJob('str', queue='low', timeout=600)
+    return None
+
+def ttl_resolver(jname):
+    """Job resolver that gives jnames starting with 'keep' long TTLs."""
+    if jname.startswith('keep'):
+        return ResolvedJob('str', result_ttl=86400, failure_ttl=3600)
+    return None
+
 # The decorators on the TestCase class apply the patch to all test_* methods
 @mock.patch('redis.StrictRedis', fakeredis.FakeStrictRedis)
 @mock.patch('rq.queue.resolve_connection', mocked_resolve_connection)
@@ -54,17 +72,22 @@ class TestJobs(unittest2.TestCase):
         # Dummy request data
         self.request_data = json.dumps(dict(task_name='task_name'))
 
+    def tearDown(self):
+        """Empty the database, so that jobs don't pile up between tests."""
+        self.queue.connection.flushall()
+
     def get_json_response(self, url):
         """Return the rv for the URL and the decoded JSON data."""
         rv = self.client.get(url)
         data = json.loads(rv.data)
         return rv, data
 
-    def validate_job(self, job):
+    def validate_job(self, job, result=True):
         """Assert that a job dictionary, from JSON, is valid.
 
         As this method checks the job URI with flask.url_for, it must be called
         in an app.test_request_context.
+        If result is False, the job must not have a result key.
         """
         assert 'id' in job
         job_id = job['id']
@@ -75,19 +98,50 @@ class TestJobs(unittest2.TestCase):
         # Status should be one of the values allowed by rq
         # https://github.com/nvie/rq/blob/0.4.6/rq/job.py#L30
         assert job['status'] in ('queued', 'finished', 'failed', 'started')
-        assert 'result' in job
+        assert ('result' in job) == result
 
     def test_list_jobs(self):
         """The correct number of jobs should be returned."""
         rv, data = self.get_json_response('/jobs')
         assert len(data['jobs']) == self.queue.count
+        assert data['total'] == self.queue.count
 
     def test_list_job_serialisation(self):
         """All jobs in a list should be serialise correctly."""
         with self.app.test_request_context():
             rv, data = self.get_json_response('/jobs')
+            for job in data['jobs']: self.validate_job(job, result=False)
+            rv, data = self.get_json_response(
+                '/jobs?fields=id,uri,status,result')
             for job in data['jobs']: self.validate_job(job)
 
+    def test_list_jobs_fields(self):
+        """Only the requested fields should be sent, plus the job ID."""
+        rv, data = self.get_json_response('/jobs?fields=status')
+        for job in data['jobs']:
+            assert sorted(job.keys()) == ['id', 'status']
+        rv, data = self.get_json_response('/jobs?fields=data')
+        assert rv.status_code == 400
+        assert 'message' in data
+
+    def test_list_jobs_pagination(self):
+        """Jobs should be listed in pages, linked by the next URI."""
+        job_ids = self.queue.job_ids
+        rv, data = self.get_json_response('/jobs?limit=1&offset=1')
+        assert [j['id'] for j in data['jobs']] == job_ids[1:2]
+        assert data['offset'] == 1
+        assert data['limit'] == 1
+        listed = []
+        uri = '/jobs?limit=1'
+        while uri is not None:
+            rv, data = self.get_json_response(uri)
+            listed.extend(j['id'] for j in data['jobs'])
+            # The test client ignores the query string of absolute URLs
+            uri = data['next'] and data['next'].replace('http://localhost', '')
+        assert listed == job_ids
+        rv, data = self.get_json_response('/jobs?offset=-1')
+        assert rv.status_code == 400
+
     def test_create_job(self):
         """Job response should be the new job and a success status code."""
         # Add a job resolver so the job actually submits
@@ -103,6 +157,190 @@ class TestJobs(unittest2.TestCase):
         assert rv.status_code == 201
         assert self.queue.count == (njobs + 1)
 
+    def test_create_jobs_batch(self):
+        """A batch should enqueue every valid task and report invalid ones."""
+        self.app.add_job_resolver(conditional_resolver)
+        njobs = self.queue.count
+        tasks = [dict(task_name='abc', args=dict(object='foo')),
+                 dict(task_name='bcd'),
+                 dict(args={}),
+                 dict(task_name='acd')]
+        rv = self.client.post('/jobs/batch', data=json.dumps(dict(jobs=tasks)),
+            content_type='application/json')
+        self.app.remove_job_resolver(conditional_resolver)
+        data = json.loads(rv.data)
+        assert rv.status_code == 201
+        assert len(data['jobs']) == len(tasks)
+        assert ['job' in item for item in data['jobs']] == \
+            [True, False, False, True]
+        assert 'message' in data['jobs'][1]
+        assert 'message' in data['jobs'][2]
+        assert self.queue.count == (njobs + 2)
+        job = self.queue.fetch_job(data['jobs'][0]['job']['id'])
+        assert job.func_name == 'str'
+        assert job.kwargs == dict(object='foo')
+        assert job.get_status() == 'queued'
+        assert self.queue.job_ids[-2:] == \
+            [data['jobs'][0]['job']['id'], data['jobs'][3]['job']['id']]
+
+    def test_create_jobs_batch_invalid(self):
+        """A batch with no valid tasks should give 400."""
+        njobs = self.queue.count
+        rv = self.client.post('/jobs/batch',
+            data=json.dumps(dict(jobs=[dict(task_name='abc')])),
+            content_type='application/json')
+        data = json.loads(rv.data)
+        assert rv.status_code == 400
+        assert 'message' in data['jobs'][0]
+        rv = self.client.post('/jobs/batch', data=json.dumps(dict(jobs=[])),
+            content_type='application/json')
+        assert rv.status_code == 400
+        rv = self.client.post('/jobs/batch',
+            data=json.dumps([dict(task_name='abc')]),
+            content_type='application/json')
+        assert rv.status_code == 400
+        assert json.loads(rv.data)['message'] == 'No list of jobs provided'
+        assert self.queue.count == njobs
+
+    def post_task(self, task_name, **args):
+        """Return the rv for a POST of the task and the decoded JSON data."""
+        rv = self.client.post('/jobs',
+            data=json.dumps(dict(task_name=task_name, args=args)),
+            content_type='application/json')
+        return rv, json.loads(rv.data)
+
+    def test_create_job_deduplication(self):
+        """Identical tasks should share a job when deduplication is on."""
+        self.app.config['JOB_DEDUPLICATION'] = True
+        self.app.add_job_resolver(str_resolver)
+        njobs = self.queue.count
+        rv, data = self.post_task('abc', object='dedup')
+        assert rv.status_code == 201
+        job_id = data['job']['id']
+        rv, data = self.post_task('abc', object='dedup')
+        assert rv.status_code == 200
+        assert data['job']['id'] == job_id
+        assert self.queue.count == (njobs + 1)
+        # Finished jobs are reused, failed ones are not
+        self.queue.fetch_job(job_id).set_status('finished')
+        rv, data = self.post_task('abc', object='dedup')
+        assert data['job']['id'] == job_id
+        self.queue.fetch_job(job_id).set_status('failed')
+        rv, data = self.post_task('abc', object='dedup')
+        assert rv.status_code == 201
+        assert data['job']['id'] != job_id
+        self.app.remove_job_resolver(str_resolver)
+
+    def test_create_job_deduplication_disabled(self):
+        """Identical tasks should get their own jobs by default."""
+        self.app.add_job_resolver(str_resolver)
+        rv, first = self.post_task('abc', object='nodedup')
+        rv, second = self.post_task('abc', object='nodedup')
+        self.app.remove_job_resolver(str_resolver)
+        assert first['job']['id'] != second['job']['id']
+
+    def test_create_job_deduplication_mtime(self):
+        """Modifying an input file should stop its jobs being reused."""
+        files_directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, files_directory)
+        path = os.path.join(files_directory, 'input.root')
+        open(path, 'w').close()
+        self.app.config['FILES_DIRECTORY'] = files_directory
+        self.app.config['JOB_DEDUPLICATION'] = True
+        self.app.add_job_resolver(str_resolver)
+        rv, first = self.post_task('abc', filename='input.root')
+        rv, second = self.post_task('abc', filename='input.root')
+        assert first['job']['id'] == second['job']['id']
+        mtime = os.path.getmtime(path) + 10
+        os.utime(path, (mtime, mtime))
+        rv, third = self.post_task('abc', filename='input.root')
+        self.app.remove_job_resolver(str_resolver)
+        assert third['job']['id'] != first['job']['id']
+
+    def test_create_job_deduplication_concurrent(self):
+        """A submission finding no duplicate should still be given the job
+        of an identical submission made at the same time."""
+        self.app.config['JOB_DEDUPLICATION'] = True
+        self.app.add_job_resolver(str_resolver)
+        self.addCleanup(self.app.remove_job_resolver, str_resolver)
+        njobs = self.queue.count
+        rv, first = self.post_task('abc', object='concurrent')
+        # The second submission read the key before the first claimed it
+        with mock.patch('jobmonitor.jobs.find_duplicate_jobs',
+                        return_value=[(None, None)]):
+            rv, second = self.post_task('abc', object='concurrent')
+        assert rv.status_code == 200
+        assert second['job']['id'] == first['job']['id']
+        assert self.queue.count == (njobs + 1)
+
+    def test_deduplication_key_files_directory(self):
+        """Only files within FILES_DIRECTORY should change the key."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        files_directory = os.path.join(directory, 'files')
+        os.mkdir(files_directory)
+        os.mkdir(files_directory + '2')
+        path = os.path.join(files_directory + '2', 'input.root')
+        open(path, 'w').close()
+        self.app.config['FILES_DIRECTORY'] = files_directory
+        args = dict(filename='../files2/input.root')
+        with self.app.test_request_context():
+            key = jobs.deduplication_key('abc', args)
+            mtime = os.path.getmtime(path) + 10
+            os.utime(path, (mtime, mtime))
+            assert jobs.deduplication_key('abc', args) == key
+
+    def test_create_jobs_batch_deduplication(self):
+        """Identical tasks in one batch should share a job."""
+        self.app.config['JOB_DEDUPLICATION'] = True
+        self.app.add_job_resolver(str_resolver)
+        njobs = self.queue.count
+        task = dict(task_name='abc', args=dict(object='batchdedup'))
+        rv = self.client.post('/jobs/batch',
+            data=json.dumps(dict(jobs=[task, task])),
+            content_type='application/json')
+        self.app.remove_job_resolver(str_resolver)
+        data = json.loads(rv.data)
+        assert data['jobs'][0]['job']['id'] == data['jobs'][1]['job']['id']
+        assert self.queue.count == (njobs + 1)
+
+    def test_create_job_priority(self):
+        """Tasks should be enqueued on the queue named by their priority."""
+        self.app.add_job_resolver(str_resolver)
+        high = rq.Queue('high', connection=start_worker.create_connection())
+        njobs = high.count
+        rv = self.client.post('/jobs',
+            data=json.dumps(dict(task_name='abc', priority='high')),
+            content_type='application/json')
+        assert rv.status_code == 201
+        assert high.count == (njobs + 1)
+        rv = self.client.post('/jobs',
+            data=json.dumps(dict(task_name='abc', priority='urgent')),
+            content_type='application/json')
+        self.app.remove_job_resolver(str_resolver)
+        assert rv.status_code == 400
+        assert 'message' in json.loads(rv.data)
+
+    def test_create_job_routing(self):
+        """Resolvers should choose the queue and timeout of their tasks."""
+        self.app.add_job_resolver(routing_resolver)
+        low = rq.Queue('low', connection=start_worker.create_connection())
+        njobs = low.count
+        rv = self.client.post('/jobs',
+            data=json.dumps(dict(task_name='slow_task', priority='high')),
+            content_type='application/json')
+        self.app.remove_job_resolver(routing_resolver)
+        data = json.loads(rv.data)
+        assert low.count == (njobs + 1)
+        job = low.fetch_job(data['job']['id'])
+        assert job.origin == 'low'
+        assert job.timeout == 600
+        # Jobs on other queues can be listed by name
+        rv, data = self.get_json_response('/jobs?queue=low')
+        assert data['total'] == low.count
+        rv, data = self.get_json_response('/jobs?queue=fake_queue')
+        assert rv.status_code == 404
+
     def test_invalid_job_creation_no_task_name(self):
         """Attempting to create a job without a task name should give 400."""
         rv = self.client.post('/jobs', data=json.dumps(dict()),
@@ -161,6 +399,358 @@ class TestJobs(unittest2.TestCase):
         assert len(data['message']) > 0
         assert rv.status_code == 404
 
+    def test_shared_connection_pool(self):
+        """Apps and connections should share one pool per Redis URL."""
+        app = jobmonitor.create_app()
+        assert app.redis_pool is self.app.redis_pool
+        assert start_worker.create_connection_pool() is \
+            start_worker.create_connection_pool()
+
+    def test_shared_queue(self):
+        """Every request should use the queue created with the app."""
+        queue = self.app.queues['default']
+        with self.app.test_request_context('/jobs'):
+            self.app.preprocess_request()
+            assert flask.g.queue is queue
+
+    def test_stats(self):
+        """Stats should include pool usage and the length of each queue."""
+        rv, data = self.get_json_response('/jobs/stats')
+        assert rv.status_code == 200
+        pool = data['redis_pool']
+        assert pool['max_connections'] == \
+            self.app.config['REDIS_MAX_CONNECTIONS']
+        for key in ('created_connections', 'idle_connections',
+                    'in_use_connections'):
+            assert key in pool
+        assert data['queues']['default'] == self.queue.count
+
+    @mock.patch('jobmonitor.jobs.wait_for_job')
+    def test_get_job_wait(self, mocked):
+        """A pending job should be waited on for at most JOB_WAIT_MAX."""
+        mocked.return_value = False
+        job_id = self.queue.job_ids[0]
+        rv, data = self.get_json_response('/jobs/{0}?wait=5'.format(job_id))
+        assert rv.status_code == 200
+        assert data['job']['id'] == job_id
+        assert mocked.call_args[0][1] == 5
+        self.get_json_response('/jobs/{0}?wait=1000'.format(job_id))
+        assert mocked.call_args[0][1] == self.app.config['JOB_WAIT_MAX']
+
+    @mock.patch('jobmonitor.jobs.wait_for_job')
+    def test_get_job_wait_completed(self, mocked):
+        """A completed job should be returned without waiting."""
+        job = self.queue.enqueue('str', args=('foo',))
+        job.set_status('finished')
+        job.ended_at = utcnow()
+        job.save()
+        rv, data = self.get_json_response('/jobs/{0}?wait=5'.format(job.id))
+        assert data['job']['status'] == 'finished'
+        assert not mocked.called
+
+    @mock.patch('jobmonitor.jobs.wait_for_job')
+    def test_job_events(self, mocked):
+        """The events stream should send the job until it completes."""
+        job = self.queue.enqueue('str', args=('foo',))
+
+        def finish(*args, **kwargs):
+            job.set_status('finished')
+            job.ended_at = utcnow()
+            job.save()
+            return True
+        mocked.side_effect = finish
+        rv = self.client.get('/jobs/{0}/events'.format(job.id))
+        assert rv.mimetype == 'text/event-stream'
+        events = [json.loads(line[len('data: '):])['job']
+                  for line in rv.data.decode('utf-8').splitlines()
+                  if line.startswith('data: ')]
+        assert [e['status'] for e in events] == ['queued', 'finished']
+
+    def finished_job(self, result):
+        """Return a finished job with the encoded result."""
+        job = self.queue.enqueue('str', args=('foo',))
+        job._result = results.encode(result)
+        job.set_status('finished')
+        job.ended_at = utcnow()
+        job.save()
+        return job
+
+    def test_get_job_encoded_result(self):
+        """Encoded results should be decoded when serialising the job."""
+        job = self.finished_job(list(range(50)))
+        rv, data = self.get_json_response('/jobs/{0}'.format(job.id))
+        assert data['job']['result'] == list(range(50))
+
+    def test_get_job_result(self):
+        """The result should be sent as JSON or binary, compressed if
+        accepted."""
+        value = {'bins': list(range(50))}
+        job = self.finished_job(value)
+        url = '/jobs/{0}/result'.format(job.id)
+        rv = self.client.get(url)
+        assert rv.mimetype == 'application/json'
+        assert 'Content-Encoding' not in rv.headers
+        assert json.loads(rv.data.decode('utf-8')) == value
+        rv = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+        assert rv.headers['Content-Encoding'] == 'gzip'
+        assert rv.headers['Vary'] == 'Accept-Encoding'
+        data = zlib.decompress(rv.data, 47)
+        assert json.loads(data.decode('utf-8')) == value
+        rv = self.client.get(url + '?format=binary')
+        assert rv.mimetype == results.ArrayCodec.content_type
+        assert results.codecs['arrays'].decode(rv.data) == value
+        # The stored gzipped bytes are sent as they are
+        rv = self.client.get(url + '?format=binary',
+                             headers={'Accept-Encoding': 'gzip'})
+        assert rv.data == job.result.data
+
+    def test_get_job_result_not_modified(self):
+        """A request with a matching ETag should get a 304."""
+        job = self.finished_job([1, 2, 3])
+        url = '/jobs/{0}/result'.format(job.id)
+        rv = self.client.get(url)
+        etag = rv.headers['ETag']
+        rv = self.client.get(url, headers={'If-None-Match': etag})
+        assert rv.status_code == 304
+        assert rv.data == b''
+        rv = self.client.get(url + '?format=binary',
+                             headers={'If-None-Match': etag})
+        assert rv.status_code == 200
+        # The gzipped body has an ETag of its own
+        rv = self.client.get(url, headers={'If-None-Match': etag,
+                                           'Accept-Encoding': 'gzip'})
+        assert rv.status_code == 200
+        assert rv.headers['ETag'] != etag
+
+    def test_get_job_result_pending(self):
+        """Results of unfinished jobs should not be found."""
+        job = self.queue.enqueue('str', args=('foo',))
+        rv, data = self.get_json_response('/jobs/{0}/result'.format(job.id))
+        assert rv.status_code == 404
+        assert 'not finished' in data['message']
+        rv = self.client.get('/jobs/{0}/result?format=xml'.format(job.id))
+        assert rv.status_code == 400
+
+    def test_get_job_result_finishing(self):
+        """Results of jobs saved as finished before their result and
+        completion time should not be found."""
+        job = self.queue.enqueue('str', args=('foo',))
+        job.set_status('finished')
+        rv, data = self.get_json_response('/jobs/{0}/result'.format(job.id))
+        assert rv.status_code == 404
+        assert 'not finished' in data['message']
+        assert 'Cache-Control' not in rv.headers
+        assert len(self.app.result_cache) == 0
+        # Bodies without a stored result are not cached
+        job.ended_at = utcnow()
+        job.save()
+        rv = self.client.get('/jobs/{0}/result'.format(job.id))
+        assert rv.status_code == 200
+        assert json.loads(rv.data.decode('utf-8')) is None
+        assert len(self.app.result_cache) == 0
+
+    def test_get_job_not_modified(self):
+        """A request with the job's current ETag should get a 304 without
+        the job being fetched."""
+        job = self.queue.enqueue('str', args=('foo',))
+        url = '/jobs/{0}'.format(job.id)
+        rv = self.client.get(url)
+        etag = rv.headers['ETag']
+        assert rv.headers['Cache-Control'] == 'no-cache'
+        with mock.patch.object(rq.Queue, 'fetch_job') as fetch_job:
+            rv = self.client.get(url, headers={'If-None-Match': etag})
+            assert rv.status_code == 304
+            assert rv.data == b''
+            assert not fetch_job.called
+        # The ETag changes with the job's status
+        job.set_status('started')
+        rv = self.client.get(url, headers={'If-None-Match': etag})
+        assert rv.status_code == 200
+        assert rv.headers['ETag'] != etag
+
+    def test_get_job_cache_control(self):
+        """Finished jobs should be cacheable."""
+        job = self.finished_job([1, 2, 3])
+        rv = self.client.get('/jobs/{0}'.format(job.id))
+        assert rv.headers['Cache-Control'] == 'public, max-age={0}'.format(
+            self.app.config['JOB_CACHE_MAX_AGE']
+        )
+
+    def test_get_job_finishing(self):
+        """Jobs saved as finished before their result and completion time
+        should be sent as started, and not be cacheable."""
+        job = self.queue.enqueue('str', args=('foo',))
+        job.set_status('finished')
+        rv, data = self.get_json_response('/jobs/{0}'.format(job.id))
+        assert data['job']['status'] == 'started'
+        assert data['job']['result'] is None
+        assert rv.headers['Cache-Control'] == 'no-cache'
+        rv, data = self.get_json_response('/jobs?ids={0}'.format(job.id))
+        assert data['jobs'][0]['status'] == 'started'
+        versions = data['jobs'][0]['version']
+        # The version changes once the job is saved with its result
+        job._result = results.encode([1, 2, 3])
+        job.ended_at = utcnow()
+        job.save()
+        rv, data = self.get_json_response(
+            '/jobs?ids={0}&versions={1}'.format(job.id, versions)
+        )
+        assert data['jobs'][0]['status'] == 'finished'
+        assert data['jobs'][0]['result'] == [1, 2, 3]
+
+    def test_get_jobs_not_modified(self):
+        """A listing with the page's current ETag should get a 304 without
+        results being fetched."""
+        url = '/jobs?limit=5&fields=id,status,result'
+        rv = self.client.get(url)
+        etag = rv.headers['ETag']
+        with mock.patch('jobmonitor.jobs.fetch_job_results') as fetch:
+            rv = self.client.get(url, headers={'If-None-Match': etag})
+            assert rv.status_code == 304
+            assert not fetch.called
+        # The ETag changes when a job on the page changes status
+        job_id = json.loads(self.client.get(url).data.decode('utf-8'))[
+            'jobs'][0]['id']
+        self.queue.fetch_job(job_id).set_status('started')
+        rv = self.client.get(url, headers={'If-None-Match': etag})
+        assert rv.status_code == 200
+
+    def test_get_jobs_by_id(self):
+        """Jobs requested by ID should be sent unless the client has their
+        version."""
+        queued = self.queue.enqueue('str', args=('foo',))
+        finished = self.finished_job([1, 2, 3])
+        url = '/jobs?ids={0},{1},missing'.format(queued.id, finished.id)
+        rv, data = self.get_json_response(url)
+        assert rv.status_code == 200
+        assert rv.headers['Cache-Control'] == 'no-cache'
+        assert [j['id'] for j in data['jobs']] == [queued.id, finished.id]
+        assert [j['status'] for j in data['jobs']] == ['queued', 'finished']
+        assert data['jobs'][0]['result'] is None
+        assert data['jobs'][1]['result'] == [1, 2, 3]
+        assert data['missing'] == ['missing']
+        # The version of a job is its ETag
+        rv = self.client.get(data['jobs'][0]['uri'])
+        assert rv.headers['ETag'] == '"{0}"'.format(
+            data['jobs'][0]['version']
+        )
+        versions = ','.join(j['version'] for j in data['jobs'])
+        rv, data = self.get_json_response(url + '&versions=' + versions)
+        assert data['jobs'] == []
+        queued.set_status('started')
+        rv, data = self.get_json_response(url + '&versions=' + versions)
+        assert [j['id'] for j in data['jobs']] == [queued.id]
+        assert data['jobs'][0]['status'] == 'started'
+
+    def test_get_job_statuses(self):
+        """Jobs posted with their versions should be sent if they changed.
+        """
+        queued = self.queue.enqueue('str', args=('foo',))
+        finished = self.finished_job([1, 2, 3])
+        rv = self.client.post('/jobs/status', data=json.dumps(dict(
+            jobs={queued.id: None, finished.id: None}
+        )), content_type='application/json')
+        data = json.loads(rv.data)
+        assert rv.status_code == 200
+        assert sorted(j['id'] for j in data['jobs']) == sorted([queued.id,
+                                                                finished.id])
+        versions = dict((j['id'], j['version']) for j in data['jobs'])
+        with mock.patch('jobmonitor.jobs.decode_result') as decode:
+            rv = self.client.post('/jobs/status', data=json.dumps(dict(
+                jobs=versions
+            )), content_type='application/json')
+            assert json.loads(rv.data)['jobs'] == []
+            assert not decode.called
+        rv = self.client.post('/jobs/status', data=json.dumps(dict(
+            jobs=[queued.id]
+        )), content_type='application/json')
+        assert rv.status_code == 400
+        rv = self.client.post('/jobs/status', data=json.dumps([queued.id]),
+                              content_type='application/json')
+        assert rv.status_code == 400
+        assert json.loads(rv.data)['message'] == 'No object of jobs provided'
+        self.app.config['JOBS_PAGE_SIZE_MAX'] = 1
+        rv = self.client.post('/jobs/status', data=json.dumps(dict(
+            jobs=versions
+        )), content_type='application/json')
+        assert rv.status_code == 400
+
+    def test_create_job_ttls(self):
+        """Resolvers should choose the TTLs of their tasks, else the
+        configured TTLs are used."""
+        self.app.add_job_resolver(ttl_resolver)
+        self.app.add_job_resolver(str_resolver)
+        self.app.config['JOB_RESULT_TTL'] = 100
+        rv = self.client.post('/jobs', data=json.dumps(dict(task_name='keep')),
+                              content_type='application/json')
+        job = self.queue.fetch_job(json.loads(rv.data)['job']['id'])
+        assert job.result_ttl == 86400
+        assert job.meta['failure_ttl'] == 3600
+        rv = self.client.post('/jobs', data=json.dumps(dict(task_name='abc')),
+                              content_type='application/json')
+        job = self.queue.fetch_job(json.loads(rv.data)['job']['id'])
+        assert job.result_ttl == 100
+        assert 'failure_ttl' not in job.meta
+        assert 'idle_timeout' not in job.meta
+
+    def test_job_idle_timeout(self):
+        """Polls of jobs with an idle timeout should be recorded."""
+        self.app.add_job_resolver(str_resolver)
+        self.app.config['JOB_IDLE_TIMEOUT'] = 100
+        # The TTL commands of patched connections are broken, but fakeredis
+        # instances share the same data
+        redis = fakeredis.FakeStrictRedis()
+        rv = self.client.post('/jobs', data=self.request_data,
+                              content_type='application/json')
+        job_id = json.loads(rv.data)['job']['id']
+        assert self.queue.fetch_job(job_id).meta['idle_timeout'] == 100
+        key = start_worker.poll_key(job_id)
+        redis.delete(key)
+        self.client.get('/jobs/{0}'.format(job_id))
+        # Only jobs submitted with an idle timeout have their polls recorded
+        assert not redis.exists(key)
+        redis.set(key, 0)
+        self.client.get('/jobs/{0}'.format(job_id))
+        assert float(redis.get(key)) > 0
+        assert 0 < redis.ttl(key) <= 100
+
+    def test_delete_queued_job(self):
+        """Deleting a queued job should cancel it."""
+        job = self.queue.enqueue('str', args=('foo',))
+        # fakeredis does not support publishing
+        with mock.patch.object(self.app.redis, 'publish', create=True) as \
+                publish:
+            rv = self.client.delete('/jobs/{0}'.format(job.id))
+        assert rv.status_code == 200
+        assert json.loads(rv.data)['job']['status'] == 'cancelled'
+        publish.assert_called_once_with(start_worker.job_channel(job.id),
+                                        start_worker.CANCELLED)
+        assert job.id not in self.queue.job_ids
+        rv, data = self.get_json_response('/jobs/{0}'.format(job.id))
+        assert data['job']['status'] == 'cancelled'
+
+    def test_delete_started_job(self):
+        """Deleting a started job should ask its worker to cancel it."""
+        job = self.queue.enqueue('str', args=('foo',))
+        self.app.redis.lrem(self.queue.key, 1, job.id)
+        job.set_status('started')
+        rv = self.client.delete('/jobs/{0}'.format(job.id))
+        assert rv.status_code == 202
+        assert json.loads(rv.data)['job']['status'] == 'started'
+        assert self.app.redis.exists(start_worker.cancel_key(job.id))
+
+    def test_delete_finished_job(self):
+        """Deleting a finished job should delete it."""
+        job = self.finished_job([1, 2, 3])
+        # Workers take jobs off the queue before finishing them
+        self.app.redis.lrem(self.queue.key, 1, job.id)
+        rv = self.client.delete('/jobs/{0}'.format(job.id))
+        assert rv.status_code == 204
+        rv = self.client.get('/jobs/{0}'.format(job.id))
+        assert rv.status_code == 404
+        rv = self.client.delete('/jobs/{0}'.format(job.id))
+        assert rv.status_code == 404
+
 
 if __name__ == '__main__':
     unittest2.main()
@@ -0,0 +1,50 @@
+import unittest2
+from jobmonitor.lru import LRUCache
+
+
+class TestLRUCache(unittest2.TestCase):
+    def setUp(self):
+        self.cache = LRUCache(maxsize=2)
+
+    def test_get_and_set(self):
+        """Stored values should be retrievable, missing keys give default."""
+        self.cache.set('a', 1)
+        assert self.cache.get('a') == 1
+        assert self.cache.get('b') is None
+        assert self.cache.get('b', 2) == 2
+        assert 'a' in self.cache
+        assert len(self.cache) == 1
+
+    def test_eviction(self):
+        """The least recently used item should be evicted when full."""
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        # Use a, so b becomes the least recently used
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        assert 'b' not in self.cache
+        assert self.cache.get('a') == 1
+        assert self.cache.get('c') == 3
+        assert len(self.cache) == 2
+
+    def test_pop_and_clear(self):
+        """Items should be removable individually and all at once."""
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        assert self.cache.pop('a') == 1
+        assert self.cache.pop('a') is None
+        self.cache.clear()
+        assert len(self.cache) == 0
+        self.cache.set('c', 3)
+        assert self.cache.get('c') == 3
+
+    def test_stats(self):
+        """Hits and misses of get should be counted."""
+        self.cache.set('a', 1)
+        self.cache.get('a')
+        self.cache.get('b')
+        assert self.cache.stats() == dict(size=1, maxsize=2, hits=1, misses=1)
+
+
+if __name__ == '__main__':
+    unittest2.main()
@@ -0,0 +1,108 @@
+import unittest2
+import mock
+import fakeredis
+import jobmonitor
+from jobmonitor import metrics, sharding
+from tests.test_jobs_blueprint import mocked_resolve_connection
+
+
+class TestMetrics(unittest2.TestCase):
+    def test_counter(self):
+        """Counters should render a sample per label combination."""
+        counter = metrics.Counter('requests_total', 'Requests.', ['code'])
+        counter.inc(code=200)
+        counter.inc(2, code=200)
+        counter.inc(code=404)
+        assert counter.render() == (
+            '# HELP requests_total Requests.\n'
+            '# TYPE requests_total counter\n'
+            'requests_total{code="200"} 3\n'
+            'requests_total{code="404"} 1\n'
+        )
+        with self.assertRaises(ValueError):
+            counter.inc(status=200)
+
+    def test_histogram(self):
+        """Histograms should render cumulative buckets, a sum, and a count.
+        """
+        histogram = metrics.Histogram('duration', 'Duration.',
+                                      buckets=(1, 5))
+        histogram.observe(0.5)
+        histogram.observe(2)
+        histogram.observe(10)
+        assert histogram.render().splitlines()[2:] == [
+            'duration_bucket{le="1"} 1',
+            'duration_bucket{le="5"} 2',
+            'duration_bucket{le="+Inf"} 3',
+            'duration_sum 12.5',
+            'duration_count 3'
+        ]
+
+    def test_label_escaping(self):
+        """Quotes, backslashes, and newlines in labels should be escaped."""
+        gauge = metrics.Gauge('g', 'Gauge.', ['name'])
+        gauge.set(1, name='a"b\\c\nd')
+        assert 'g{name="a\\"b\\\\c\\nd"} 1' in gauge.render()
+
+    def test_job_durations(self):
+        """Job durations recorded in Redis should be collected."""
+        app = mock.Mock()
+        app.redis = fakeredis.FakeStrictRedis()
+        app.shards = sharding.Shards([app.redis])
+        app.redis.delete(metrics.JOB_DURATION_KEY)
+        metrics.record_job_duration(app.redis, 'foo.bar', 'finished', 0.3)
+        metrics.record_job_duration(app.redis, 'foo.bar', 'finished', 20)
+        metrics.record_job_duration(app.redis, 'foo.bar', 'failed', 1)
+        [histogram] = metrics.collect_job_durations(app)
+        text = histogram.render()
+        labels = 'task="foo.bar",status="finished"'
+        assert ('jobmonitor_job_duration_seconds_bucket{{{0},le="0.5"}} 1'
+                .format(labels)) in text
+        assert ('jobmonitor_job_duration_seconds_bucket{{{0},le="+Inf"}} 2'
+                .format(labels)) in text
+        assert ('jobmonitor_job_duration_seconds_sum{{{0}}} 20.3'
+                .format(labels)) in text
+        assert ('jobmonitor_job_duration_seconds_count'
+                '{task="foo.bar",status="failed"} 1') in text
+
+
+@mock.patch('redis.StrictRedis', fakeredis.FakeStrictRedis)
+@mock.patch('rq.queue.resolve_connection', mocked_resolve_connection)
+@mock.patch('rq.job.resolve_connection', mocked_resolve_connection)
+class TestMetricsEndpoint(unittest2.TestCase):
+    @mock.patch('redis.StrictRedis', fakeredis.FakeStrictRedis)
+    @mock.patch('rq.queue.resolve_connection', mocked_resolve_connection)
+    @mock.patch('rq.job.resolve_connection', mocked_resolve_connection)
+    def setUp(self):
+        self.app = jobmonitor.create_app()
+        self.app.config['TESTING'] = True
+        self.client = self.app.test_client()
+
+    def test_metrics(self):
+        """Request, queue, and job resolver metrics should be served."""
+        self.app.add_job_resolver(lambda name: 'str')
+        self.client.post('/jobs', data='{"task_name": "foo"}',
+                         content_type='application/json')
+        self.client.get('/jobs')
+        rv = self.client.get('/metrics')
+        assert rv.status_code == 200
+        assert rv.mimetype == 'text/plain'
+        text = rv.data.decode('utf-8')
+        assert ('jobmonitor_http_requests_total{endpoint="jobs.get_jobs",'
+                'method="GET",status="200"}') in text
+        assert ('jobmonitor_http_request_duration_seconds_count'
+                '{endpoint="jobs.create_job",method="POST"}') in text
+        assert 'jobmonitor_jobs_submitted_total{queue="default"' in text
+        assert 'jobmonitor_queue_jobs{queue="high"}' in text
+        assert 'jobmonitor_failed_jobs ' in text
+        assert 'jobmonitor_job_resolution_seconds_count ' in text
+        assert 'jobmonitor_job_resolver_cache_misses_total 1' in text
+
+    def test_metrics_disabled(self):
+        """No metrics should be served when disabled."""
+        self.app.config['METRICS'] = False
+        assert self.client.get('/metrics').status_code == 404
+
+
+if __name__ == '__main__':
+    unittest2.main()
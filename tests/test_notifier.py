@@ -0,0 +1,142 @@
+import json
+import threading
+import time
+import unittest2
+import mock
+import redis
+import rq
+import fakeredis
+from rq.utils import utcnow
+import jobmonitor
+from jobmonitor import jobs, notifier, start_worker
+from tests.test_jobs_blueprint import mocked_resolve_connection
+
+
+class TestJobNotifier(unittest2.TestCase):
+    def setUp(self):
+        self.notifier = notifier.JobNotifier(mock.Mock())
+
+    def test_subscription(self):
+        """Waiters should be woken by messages for their job only."""
+        with self.notifier.subscription('a') as a, \
+                self.notifier.subscription('b') as b:
+            assert self.notifier.waiting() == 2
+            self.notifier.notify('a')
+            assert a.is_set()
+            assert not b.is_set()
+            self.notifier.notify_all()
+            assert b.is_set()
+        assert self.notifier.waiting() == 0
+        # Notifying jobs nobody is waiting on does nothing
+        self.notifier.notify('a')
+
+    def test_listen(self):
+        """Messages on job channels should wake the job's waiters."""
+        pubsub = self.notifier.connection.pubsub.return_value
+        pubsub.get_message.side_effect = [
+            None,
+            dict(type='pmessage', channel=start_worker.job_channel('a'),
+                 data='finished'),
+            redis.ConnectionError('Closed')
+        ]
+        with mock.patch('time.sleep'), \
+                self.notifier.subscription('a') as event:
+            with self.assertRaises(redis.ConnectionError):
+                self.notifier.listen()
+            assert event.is_set()
+        pubsub.psubscribe.assert_called_once_with(notifier.CHANNEL_PATTERN)
+        assert pubsub.close.called
+
+
+@mock.patch('redis.StrictRedis', fakeredis.FakeStrictRedis)
+@mock.patch('rq.queue.resolve_connection', mocked_resolve_connection)
+@mock.patch('rq.job.resolve_connection', mocked_resolve_connection)
+@mock.patch('jobmonitor.notifier.JobNotifier.start')
+class TestWaitForJob(unittest2.TestCase):
+    @mock.patch('redis.StrictRedis', fakeredis.FakeStrictRedis)
+    @mock.patch('rq.queue.resolve_connection', mocked_resolve_connection)
+    @mock.patch('rq.job.resolve_connection', mocked_resolve_connection)
+    def setUp(self):
+        self.app = jobmonitor.create_app()
+        self.app.config['TESTING'] = True
+        queue = rq.Queue(connection=start_worker.create_connection())
+        self.job = queue.enqueue('str', args=('foo',))
+
+    def test_wait_for_job(self, start):
+        """Waiting requests should be woken by the shared notifier."""
+        with self.app.test_request_context():
+            timer = threading.Timer(0.05, self.app.job_notifier.notify,
+                                    [self.job.id])
+            timer.start()
+            begin = time.time()
+            assert jobs.wait_for_job(self.job.id, 5)
+            assert time.time() - begin < 5
+            assert start.called
+            assert not jobs.wait_for_job(self.job.id, 0.05)
+            assert self.app.job_notifier.waiting() == 0
+
+    def test_wait_for_cancelled_job(self, start):
+        """Requests waiting on a queued job should be woken when it is
+        cancelled."""
+        # fakeredis does not support pub/sub, so messages are passed
+        # straight to the notifier
+        def publish(channel, message):
+            self.app.job_notifier.notify(
+                channel[len(notifier.CHANNEL_PREFIX):]
+            )
+        self.app.redis.publish = publish
+        client = self.app.test_client()
+        responses = []
+        waiting = threading.Thread(target=lambda: responses.append(
+            client.get('/jobs/{0}?wait=5'.format(self.job.id))
+        ))
+        begin = time.time()
+        waiting.start()
+        while not self.app.job_notifier.waiting() and \
+                time.time() - begin < 5:
+            time.sleep(0.01)
+        rv = self.app.test_client().delete('/jobs/{0}'.format(self.job.id))
+        assert rv.status_code == 200
+        waiting.join()
+        assert time.time() - begin < 5
+        job = json.loads(responses[0].data)['job']
+        assert job['status'] == start_worker.CANCELLED
+
+    def test_wait_for_job_statuses(self, start):
+        """Polls of many jobs should wait until any of them changes."""
+        client = self.app.test_client()
+
+        def post_statuses(versions, wait):
+            rv = client.post('/jobs/status?wait={0}'.format(wait),
+                             data=json.dumps(dict(jobs=versions)),
+                             content_type='application/json')
+            return json.loads(rv.data)['jobs']
+        [job] = post_statuses({self.job.id: None}, 5)
+        versions = {self.job.id: job['version']}
+        # Nothing changes, so the request is held until it times out
+        begin = time.time()
+        assert post_statuses(versions, 0.1) == []
+        assert time.time() - begin >= 0.1
+
+        def start_job():
+            self.job.set_status('started')
+            self.app.job_notifier.notify(self.job.id)
+        timer = threading.Timer(0.05, start_job)
+        timer.start()
+        begin = time.time()
+        [job] = post_statuses(versions, 5)
+        assert time.time() - begin < 5
+        assert job['status'] == 'started'
+        assert self.app.job_notifier.waiting() == 0
+
+    def test_wait_for_completed_job(self, start):
+        """Completed jobs should not be waited on."""
+        self.job.set_status('finished')
+        self.job.ended_at = utcnow()
+        self.job.save()
+        with self.app.test_request_context():
+            assert jobs.wait_for_job(self.job.id, 5)
+
+
+if __name__ == '__main__':
+    unittest2.main()
@@ -0,0 +1,122 @@
+import unittest2
+import mock
+import os
+import pstats
+import shutil
+import sys
+import tempfile
+import flask
+import fakeredis
+import redis
+import jobmonitor
+from jobmonitor import profiling
+from jobmonitor.FlaskWithJobResolvers import FlaskWithJobResolvers
+from tests.test_jobs_blueprint import mocked_resolve_connection
+
+
+@mock.patch('redis.StrictRedis', fakeredis.FakeStrictRedis)
+@mock.patch('rq.queue.resolve_connection', mocked_resolve_connection)
+@mock.patch('rq.job.resolve_connection', mocked_resolve_connection)
+class TestProfiling(unittest2.TestCase):
+    @mock.patch('redis.StrictRedis', fakeredis.FakeStrictRedis)
+    @mock.patch('rq.queue.resolve_connection', mocked_resolve_connection)
+    @mock.patch('rq.job.resolve_connection', mocked_resolve_connection)
+    def setUp(self):
+        self.app = jobmonitor.create_app()
+        self.app.config['TESTING'] = True
+        self.client = self.app.test_client()
+
+    def test_disabled(self):
+        """No profile should be recorded by default."""
+        with self.app.test_request_context():
+            self.app.preprocess_request()
+            assert profiling.current_profile() is None
+        rv = self.client.get('/jobs')
+        assert 'X-Profile' not in rv.headers
+
+    def test_bare_app(self):
+        """Apps without the jobmonitor configuration should be served."""
+        app = FlaskWithJobResolvers(__name__)
+
+        @app.route('/')
+        def index():
+            return 'index'
+        rv = app.test_client().get('/')
+        assert rv.status_code == 200
+        assert rv.data == b'index'
+
+    def test_profile_header(self):
+        """The breakdown should be sent in the X-Profile header."""
+        self.app.config['PROFILING'] = True
+        self.app.config['PROFILE_HEADER'] = True
+        self.app.add_job_resolver(lambda name: 'str')
+        rv = self.client.post('/jobs', data='{"task_name": "foo"}',
+                              content_type='application/json')
+        header = rv.headers['X-Profile']
+        assert header.startswith('total=')
+        assert 'jsonify=' in header
+        assert 'resolve_job=' in header
+        assert 'redis_commands=' in header
+
+    def test_slow_request_log(self):
+        """Requests slower than the threshold should be logged."""
+        self.app.config['SLOW_REQUEST_THRESHOLD'] = 0
+        with mock.patch.object(profiling.logger, 'warning') as warning:
+            self.client.get('/jobs?limit=1')
+            assert warning.call_count == 1
+            message = warning.call_args[0][0]
+            assert message.startswith('Slow request GET /jobs?limit=1: ')
+        self.app.config['SLOW_REQUEST_THRESHOLD'] = 60
+        with mock.patch.object(profiling.logger, 'warning') as warning:
+            self.client.get('/jobs')
+            assert not warning.called
+
+    def test_sampled_profile(self):
+        """Sampled requests should be dumped as pstats files."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.app.config['PROFILE_SAMPLE_RATE'] = 1.0
+        self.app.config['PROFILE_DIRECTORY'] = directory
+        self.client.get('/jobs')
+        [name] = os.listdir(directory)
+        assert name.endswith('-GET-jobs.get_jobs.prof')
+        stats = pstats.Stats(os.path.join(directory, name))
+        assert stats.total_calls > 0
+
+    def test_sampled_profile_error(self):
+        """The profiler should be removed from the thread, and its statistics
+        dumped, when the view raises."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.app.config['PROFILE_SAMPLE_RATE'] = 1.0
+        self.app.config['PROFILE_DIRECTORY'] = directory
+
+        @self.app.route('/error')
+        def error():
+            raise RuntimeError('Failed')
+        self.app.config['TESTING'] = False
+        rv = self.client.get('/error')
+        assert rv.status_code == 500
+        assert sys.getprofile() is None
+        [name] = os.listdir(directory)
+        assert name.endswith('-GET-error.prof')
+
+    def test_instrument_redis(self):
+        """Redis commands and pipelines should be counted in the profile."""
+        # redis.StrictRedis is patched with fakeredis, which does not send
+        # commands through execute_command
+        connection = redis.client.StrictRedis()
+        connection.execute_command = mock.Mock(return_value=b'1')
+        profiling.instrument_redis(connection)
+        connection.get('foo')
+        with self.app.test_request_context():
+            flask.g.profile = profiling.RequestProfile()
+            connection.get('foo')
+            connection.set('foo', 1)
+            assert flask.g.profile.redis_commands == 2
+            assert flask.g.profile.redis_round_trips == 2
+            assert 'redis' in flask.g.profile.timings
+
+
+if __name__ == '__main__':
+    unittest2.main()
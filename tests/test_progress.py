@@ -0,0 +1,113 @@
+import unittest2
+import mock
+import json
+import rq
+import fakeredis
+from rq.utils import utcnow
+import jobmonitor
+from jobmonitor import progress, results, start_worker
+from tests.test_jobs_blueprint import mocked_resolve_connection
+
+
+@mock.patch('redis.StrictRedis', fakeredis.FakeStrictRedis)
+@mock.patch('rq.queue.resolve_connection', mocked_resolve_connection)
+@mock.patch('rq.job.resolve_connection', mocked_resolve_connection)
+class TestProgress(unittest2.TestCase):
+    @mock.patch('redis.StrictRedis', fakeredis.FakeStrictRedis)
+    @mock.patch('rq.queue.resolve_connection', mocked_resolve_connection)
+    @mock.patch('rq.job.resolve_connection', mocked_resolve_connection)
+    def setUp(self):
+        self.app = jobmonitor.create_app()
+        self.app.config['TESTING'] = True
+        self.client = self.app.test_client()
+        self.queue = rq.Queue(connection=start_worker.create_connection())
+        self.job = self.queue.enqueue('str', args=('foo',))
+        self.job.set_status('started')
+        # fakeredis does not support publishing
+        self.job.connection.publish = mock.Mock()
+        progress._last_published = (None, 0)
+
+    def get_job(self, headers=None):
+        rv = self.client.get('/jobs/{0}'.format(self.job.id),
+                             headers=headers)
+        return rv, json.loads(rv.data.decode('utf-8'))['job']
+
+    def test_publish_partial(self):
+        """Partials should be stored encoded, and clients woken up."""
+        value = dict(bins=list(range(50)))
+        assert progress.publish_partial(value, progress=0.5, message='Half',
+                                        job=self.job)
+        partial = progress.fetch_partial(self.job.connection, self.job.id)
+        assert isinstance(partial['result'], results.EncodedResult)
+        assert results.decode(partial['result']) == value
+        assert partial['progress'] == 0.5
+        assert partial['message'] == 'Half'
+        assert partial['sequence'] == 1
+        assert progress.partial_sequence(self.job.connection,
+                                         self.job.id) == 1
+        self.job.connection.publish.assert_called_once_with(
+            start_worker.job_channel(self.job.id), progress.PROGRESS_MESSAGE
+        )
+
+    def test_publish_partial_throttled(self):
+        """Partials should be dropped if published too often."""
+        assert progress.publish_partial(1, job=self.job)
+        assert not progress.publish_partial(2, job=self.job)
+        # The final partial is always published
+        assert progress.publish_partial(3, progress=1, job=self.job)
+        assert progress.publish_partial(4, min_interval=0, job=self.job)
+        partial = progress.fetch_partial(self.job.connection, self.job.id)
+        assert partial['result'] is not None
+        assert results.decode(partial['result']) == 4
+        assert partial['sequence'] == 3
+
+    def test_publish_partial_outside_job(self):
+        """Publishing outside of a job should fail."""
+        with self.assertRaises(RuntimeError):
+            progress.publish_partial(1)
+
+    def test_get_job_partial(self):
+        """Started jobs should be sent with their latest partial."""
+        rv, job = self.get_job()
+        assert 'partial' not in job
+        etag = rv.headers['ETag']
+        progress.publish_partial([1, 2, 3], progress=0.25, job=self.job)
+        rv, job = self.get_job(headers={'If-None-Match': etag})
+        assert rv.status_code == 200
+        assert job['partial']['result'] == [1, 2, 3]
+        assert job['partial']['progress'] == 0.25
+        assert job['partial']['message'] is None
+        etag = rv.headers['ETag']
+        rv = self.client.get('/jobs/{0}'.format(self.job.id),
+                             headers={'If-None-Match': etag})
+        assert rv.status_code == 304
+        # Partials are no longer sent once the job completes
+        self.job.set_status('finished')
+        rv, job = self.get_job()
+        assert 'partial' not in job
+
+    @mock.patch('jobmonitor.jobs.wait_for_job')
+    def test_job_events_partial(self, mocked):
+        """The events stream should send each partial."""
+        def publish(job_id, wait, sequence, poll=False):
+            if sequence is None:
+                progress.publish_partial([1], progress=0.5, job=self.job)
+            else:
+                self.job.set_status('finished')
+                self.job.ended_at = utcnow()
+                self.job.save()
+            return True
+        mocked.side_effect = publish
+        rv = self.client.get('/jobs/{0}/events'.format(self.job.id))
+        events = [json.loads(line[len('data: '):])['job']
+                  for line in rv.data.decode('utf-8').splitlines()
+                  if line.startswith('data: ')]
+        assert [e['status'] for e in events] == \
+            ['started', 'started', 'finished']
+        assert 'partial' not in events[0]
+        assert events[1]['partial']['result'] == [1]
+        assert mocked.call_args[0][2] == 1
+
+
+if __name__ == '__main__':
+    unittest2.main()
@@ -0,0 +1,60 @@
+import unittest2
+from jobmonitor import results
+
+
+class TestResults(unittest2.TestCase):
+    def setUp(self):
+        self.value = {
+            'name': 'histogram',
+            'bins': list(range(100)),
+            'values': [0.5 * i for i in range(100)],
+            'short': [1, 2, 3],
+            'nested': [{'x': [1e12] * 20}]
+        }
+
+    def test_round_trip(self):
+        """Every codec and compression should return the original value."""
+        for codec in ('arrays', 'json', 'pickle'):
+            for compression in results.compressions:
+                encoded = results.encode(self.value, codec, compression)
+                assert encoded.codec == codec
+                assert encoded.compression == compression
+                assert results.decode(encoded) == self.value
+
+    def test_arrays_format(self):
+        """Long lists of numbers should be packed, short ones left as is."""
+        data = results.codecs['arrays'].encode(self.value)
+        assert data[:4] == results.MAGIC
+        assert len(data) % 8 == 0
+        # Packed integers and floats take 4 and 8 bytes per item
+        assert len(data) > 100 * 4 + 100 * 8 + 20 * 8
+
+    def test_pickle_fallback(self):
+        """Values the codec can't encode should be pickled."""
+        encoded = results.encode(set([1, 2]))
+        assert encoded.codec == 'pickle'
+        assert results.decode(encoded) == set([1, 2])
+
+    def test_arrays_fallback(self):
+        """Values the arrays codec would change should be pickled."""
+        for value in [(1, 2), {'bins': tuple(range(100))}, {1: 'a'},
+                      {results.ARRAY_KEY: 'x'}, [{results.ARRAY_KEY: 0}]]:
+            encoded = results.encode(value)
+            assert encoded.codec == 'pickle'
+            decoded = results.decode(encoded)
+            assert decoded == value
+            assert type(decoded) is type(value)
+
+    def test_unknown_compression(self):
+        """Unknown compressions should fall back to gzip."""
+        encoded = results.encode([1], compression='nonexistent')
+        assert encoded.compression == 'gzip'
+
+    def test_decode_unencoded(self):
+        """Values that were not encoded should be passed through."""
+        assert results.decode('foo') == 'foo'
+        assert results.decode(None) is None
+
+
+if __name__ == '__main__':
+    unittest2.main()
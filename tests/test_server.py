@@ -0,0 +1,24 @@
+import unittest2
+import flask
+from jobmonitor import server
+
+
+class TestServer(unittest2.TestCase):
+    def test_parse_args(self):
+        """The app should default to the base jobmonitor app."""
+        options, spec = server.parse_args([])
+        assert spec == 'jobmonitor:create_app'
+        assert options.port == 5000
+        options, spec = server.parse_args(['-p', '8000', 'foo:make_app'])
+        assert spec == 'foo:make_app'
+        assert options.port == 8000
+
+    def test_load_app(self):
+        """Apps should be created by the named function."""
+        assert isinstance(server.load_app('jobmonitor:create_app'),
+                          flask.Flask)
+        assert isinstance(server.load_app('jobmonitor'), flask.Flask)
+
+
+if __name__ == '__main__':
+    unittest2.main()
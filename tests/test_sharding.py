@@ -0,0 +1,203 @@
+import json
+import unittest2
+import mock
+import rq
+from rq.job import unpickle
+import fakeredis
+import jobmonitor
+from jobmonitor import jobs, results, sharding, start_worker
+from jobmonitor.FlaskWithJobResolvers import ResolvedJob
+from tests.test_jobs_blueprint import mocked_resolve_connection
+
+
+def double(x):
+    """Job returning twice its argument."""
+    return 2*x
+
+
+def double_resolver(jname):
+    return ResolvedJob('tests.test_sharding.double')
+
+
+def job_ids_on_shards(count):
+    """Return job IDs such that each of count shards holds one of them."""
+    found = {}
+    i = 0
+    while len(found) < count:
+        found.setdefault(sharding.shard_index(str(i), count), str(i))
+        i += 1
+    return [found[index] for index in range(count)]
+
+
+class TestShards(unittest2.TestCase):
+    def test_shard_index(self):
+        """Jobs should be spread over the shards by their ID, with IDs
+        sharing a prefix on the same shard."""
+        indexes = set(sharding.shard_index('job{0}'.format(i), 3)
+                      for i in range(100))
+        assert indexes == set([0, 1, 2])
+        assert sharding.shard_index('abc', 3) == \
+            sharding.shard_index('abc.12', 3)
+        shards = sharding.Shards([mock.Mock()])
+        assert shards.for_job('abc') is shards.primary
+
+    def test_no_shards(self):
+        with self.assertRaises(ValueError):
+            sharding.Shards([])
+
+    def test_pipelines(self):
+        """Each shard should get a pipeline of the commands for its jobs."""
+        connections = [fakeredis.FakeStrictRedis(db=11),
+                       fakeredis.FakeStrictRedis(db=12)]
+        shards = sharding.Shards(connections)
+        first, second = job_ids_on_shards(2)
+        connections[0].set(first, 'a')
+        connections[1].set(second, 'b')
+        pipelines = shards.pipelines()
+        pipelines.for_job(first).get(first)
+        pipelines.for_job(second).get(second)
+        pipelines.for_job(second).get(first)
+        replies = pipelines.execute()
+        assert list(replies[0]) == [b'a']
+        assert list(replies[1]) == [b'b', None]
+
+    def test_fetch_results(self):
+        """Results should be read from the result store, if there is one,
+        else from the job hashes."""
+        connection = fakeredis.FakeStrictRedis(db=11)
+        store = fakeredis.FakeStrictRedis(db=13)
+        connection.hset(rq.job.Job.key_for('x'), 'result', 'in hash')
+        store.set(sharding.result_key('x'), 'in store')
+        assert sharding.fetch_results(connection, ['x', 'y']) == \
+            [b'in hash', None]
+        assert sharding.fetch_results(connection, ['x', 'y'], store) == \
+            [b'in store', None]
+        assert sharding.fetch_results(connection, []) == []
+
+
+@mock.patch('redis.StrictRedis', fakeredis.FakeStrictRedis)
+@mock.patch('rq.queue.resolve_connection', mocked_resolve_connection)
+@mock.patch('rq.job.resolve_connection', mocked_resolve_connection)
+@mock.patch('rq.connections.patch_connection', lambda connection: connection)
+class TestShardedJobs(unittest2.TestCase):
+    @mock.patch('redis.StrictRedis', fakeredis.FakeStrictRedis)
+    @mock.patch('rq.queue.resolve_connection', mocked_resolve_connection)
+    def setUp(self):
+        self.app = jobmonitor.create_app()
+        self.app.config['TESTING'] = True
+        self.app.add_job_resolver(double_resolver)
+        self.client = self.app.test_client()
+        # These databases are only used by these tests
+        self.connections = [fakeredis.FakeStrictRedis(db=11),
+                            fakeredis.FakeStrictRedis(db=12)]
+        self.store = fakeredis.FakeStrictRedis(db=13)
+        self.store.flushdb()
+        for connection in self.connections:
+            connection.flushdb()
+            mocked_resolve_connection(connection)
+            # fakeredis does not support publishing
+            connection.publish = mock.Mock()
+        self.shards = sharding.Shards(self.connections, self.store)
+        jobs.use_shards(self.app, self.shards)
+        self.queue_key = rq.Queue.redis_queue_namespace_prefix + 'default'
+
+    def submit(self, count):
+        """Submit count jobs, returning their IDs."""
+        data = dict(jobs=[dict(task_name='double', args=dict(x=i))
+                          for i in range(count)])
+        rv = self.client.post('/jobs/batch', data=json.dumps(data),
+                              content_type='application/json')
+        assert rv.status_code == 201
+        return [j['job']['id'] for j in json.loads(rv.data)['jobs']]
+
+    def perform(self, job_id):
+        """Run the job with a worker on its shard, storing its result in the
+        result store."""
+        connection = self.shards.for_job(job_id)
+        job = start_worker.Job.fetch(job_id, connection=connection)
+        worker = start_worker.Worker([], connection=connection)
+        with mock.patch('jobmonitor.start_worker.result_connection',
+                        return_value=self.store):
+            with rq.Connection(connection):
+                assert worker.perform_job(job)
+
+    def test_jobs_on_shards(self):
+        """Jobs should be stored and queued on their own shard only."""
+        job_ids = self.submit(20)
+        for job_id in job_ids:
+            index = self.shards.index(job_id)
+            other = self.connections[1 - index]
+            assert self.connections[index].exists(
+                rq.job.Job.key_for(job_id)
+            )
+            assert not other.exists(rq.job.Job.key_for(job_id))
+            queued = self.connections[index].lrange(self.queue_key, 0, -1)
+            assert job_id.encode('utf-8') in queued
+        lengths = [c.llen(self.queue_key) for c in self.connections]
+        assert sum(lengths) == 20
+        assert all(lengths)
+        rv = self.client.get('/jobs/stats')
+        assert json.loads(rv.data)['queues']['default'] == 20
+
+    def test_list_jobs(self):
+        """Queues should be listed across the shards, one after the other."""
+        job_ids = self.submit(10)
+        queued = []
+        for connection in self.connections:
+            queued.extend(j.decode('utf-8')
+                          for j in connection.lrange(self.queue_key, 0, -1))
+        assert sorted(queued) == sorted(job_ids)
+        listed = []
+        url = '/jobs?limit=3'
+        while url is not None:
+            data = json.loads(self.client.get(url).data)
+            assert data['total'] == 10
+            listed.extend(j['id'] for j in data['jobs'])
+            # The test client ignores the query of absolute URLs
+            url = data['next'] and data['next'].replace('http://localhost',
+                                                        '')
+        assert listed == queued
+
+    def test_results_in_store(self):
+        """Results should be kept in the result store, and served from it.
+        """
+        self.app.config['JOB_RESULT_TTL'] = 60
+        job_id = self.submit(1)[0]
+        self.perform(job_id)
+        connection = self.shards.for_job(job_id)
+        assert connection.hget(rq.job.Job.key_for(job_id), 'result') is None
+        stored = self.store.get(sharding.result_key(job_id))
+        assert results.decode(unpickle(stored)) == 0
+        assert 0 < self.store.ttl(sharding.result_key(job_id)) <= 60
+        rv = self.client.get('/jobs/{0}'.format(job_id))
+        job = json.loads(rv.data)['job']
+        assert job['status'] == 'finished'
+        assert job['result'] == 0
+        rv = self.client.get('/jobs/{0}/result'.format(job_id))
+        assert json.loads(rv.data) == 0
+        # The job was never taken off its queue, so is still listed
+        rv = self.client.get('/jobs?fields=id,result')
+        assert json.loads(rv.data)['jobs'] == [dict(id=job_id, result=0)]
+        rv = self.client.post('/jobs/status',
+                              data=json.dumps(dict(jobs={job_id: None})),
+                              content_type='application/json')
+        assert json.loads(rv.data)['jobs'][0]['result'] == 0
+        # Deleting the job deletes its result
+        assert self.client.delete('/jobs/{0}'.format(job_id)).status_code \
+            == 204
+        assert not self.store.exists(sharding.result_key(job_id))
+
+    def test_cancel_on_shard(self):
+        """Queued jobs should be cancelled on their own shard."""
+        job_id = self.submit(1)[0]
+        rv = self.client.delete('/jobs/{0}'.format(job_id))
+        assert rv.status_code == 200
+        connection = self.shards.for_job(job_id)
+        assert connection.llen(self.queue_key) == 0
+        rv = self.client.get('/jobs/{0}'.format(job_id))
+        assert json.loads(rv.data)['job']['status'] == \
+            start_worker.CANCELLED
+
+
+if __name__ == '__main__':
+    unittest2.main()
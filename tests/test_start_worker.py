@@ -0,0 +1,133 @@
+import time
+import unittest2
+import mock
+import rq
+from rq.job import get_current_job
+import fakeredis
+from jobmonitor import start_worker
+from tests.test_jobs_blueprint import mocked_resolve_connection
+
+
+def cancel_self():
+    """Job that asks for itself to be cancelled, then runs for a while."""
+    # resolve_connection is patched, so pass the connection explicitly
+    job = get_current_job(rq.get_current_connection())
+    start_worker.request_cancel(job.connection, job.id)
+    time.sleep(5)
+
+
+def fail():
+    """Job that always fails."""
+    raise ValueError('Failed')
+
+
+@mock.patch('redis.StrictRedis', fakeredis.FakeStrictRedis)
+@mock.patch('rq.queue.resolve_connection', mocked_resolve_connection)
+@mock.patch('rq.job.resolve_connection', mocked_resolve_connection)
+@mock.patch('rq.connections.patch_connection', lambda connection: connection)
+@mock.patch('jobmonitor.start_worker.CANCEL_CHECK_INTERVAL', 0.01)
+class TestWorker(unittest2.TestCase):
+    def setUp(self):
+        self.connection = fakeredis.FakeStrictRedis()
+        mocked_resolve_connection(self.connection)
+        # fakeredis does not support publishing
+        self.connection.publish = mock.Mock()
+        # The TTL commands of patched connections are broken, but fakeredis
+        # instances share the same data
+        self.ttl = fakeredis.FakeStrictRedis().ttl
+
+    def enqueue(self, func, meta=None):
+        """Return a new job calling func, with the meta."""
+        job = start_worker.Queue(connection=self.connection).enqueue(func)
+        if meta is not None:
+            job.meta.update(meta)
+            job.save()
+        return job
+
+    def perform(self, job):
+        """Perform the job in this process, returning whether it succeeded.
+        """
+        worker = start_worker.Worker([], connection=self.connection)
+        with rq.Connection(self.connection):
+            return worker.perform_job(job)
+
+    def test_perform_job(self):
+        """Jobs should run, with their status published."""
+        job = self.enqueue('time.time')
+        assert self.perform(job)
+        assert job.get_status() == 'finished'
+        self.connection.publish.assert_called_once_with(
+            start_worker.job_channel(job.id), 'finished'
+        )
+
+    def test_finished_with_result(self):
+        """Jobs should only be saved as finished with their result."""
+        job = self.enqueue('time.time')
+        saved = []
+
+        def encode(*args):
+            saved.append(self.connection.hmget(job.key,
+                                               ['status', 'ended_at']))
+            return args[0]
+        with mock.patch('jobmonitor.results.encode', encode):
+            assert self.perform(job)
+        assert saved == [[b'started', None]]
+        status, ended_at, result = self.connection.hmget(
+            job.key, ['status', 'ended_at', 'result']
+        )
+        assert status == b'finished'
+        assert ended_at is not None
+        assert result is not None
+
+    def test_cancel_queued_job(self):
+        """Jobs cancelled before they start should not run."""
+        job = self.enqueue(fail)
+        start_worker.request_cancel(self.connection, job.id)
+        assert not self.perform(job)
+        assert job.get_status() == start_worker.CANCELLED
+        assert 0 < self.ttl(job.key) <= \
+            start_worker.JOB_CANCELLED_TTL
+        assert not self.connection.exists(start_worker.cancel_key(job.id))
+
+    def test_cancel_running_job(self):
+        """Running jobs should be interrupted once cancelled."""
+        job = self.enqueue(cancel_self)
+        start = time.time()
+        assert not self.perform(job)
+        assert time.time() - start < 5
+        assert job.get_status() == start_worker.CANCELLED
+        failed_queue = rq.get_failed_queue(connection=self.connection)
+        assert job.id not in failed_queue.job_ids
+
+    def test_idle_job(self):
+        """Jobs with an idle timeout that nobody polled should be
+        cancelled."""
+        job = self.enqueue('time.time', dict(idle_timeout=10))
+        assert not self.perform(job)
+        assert job.get_status() == start_worker.CANCELLED
+        job = self.enqueue('time.time', dict(idle_timeout=10))
+        self.connection.set(start_worker.poll_key(job.id), 1, ex=10)
+        assert self.perform(job)
+        assert not self.connection.exists(start_worker.poll_key(job.id))
+
+    def test_inflight_job(self):
+        """Completed jobs should no longer be pending for their client."""
+        key = start_worker.inflight_key('test-inflight')
+        job = self.enqueue('time.time', dict(client='test-inflight'))
+        self.connection.zadd(key, time.time(), job.id)
+        assert self.perform(job)
+        assert self.connection.zcard(key) == 0
+
+    def test_failure_ttl(self):
+        """Failed jobs should expire after their failure TTL."""
+        job = self.enqueue(fail)
+        assert not self.perform(job)
+        assert self.ttl(job.key) is None
+        job = self.enqueue(fail, dict(failure_ttl=100))
+        assert not self.perform(job)
+        assert job.get_status() == 'failed'
+        assert 0 < self.ttl(job.key) <= 100
+
+
+if __name__ == '__main__':
+    unittest2.main()
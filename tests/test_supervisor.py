@@ -0,0 +1,86 @@
+import time
+import unittest2
+import mock
+from jobmonitor import supervisor
+
+
+def exit_immediately():
+    """Worker target that stops as soon as it starts."""
+    pass
+
+
+def sleep_forever():
+    """Worker target that runs until it is killed."""
+    while True:
+        time.sleep(1)
+
+
+class TestSupervisor(unittest2.TestCase):
+    def wait_for_workers(self, sup, timeout=5):
+        """Reap the supervisor's workers until none are running."""
+        deadline = time.time() + timeout
+        while sup.workers and time.time() < deadline:
+            sup.reap()
+            time.sleep(0.01)
+
+    def test_worker_count(self):
+        """`auto` should be the number of cores, else a positive number."""
+        assert supervisor.worker_count('auto') >= 1
+        assert supervisor.worker_count('3') == 3
+        with self.assertRaises(ValueError):
+            supervisor.worker_count('0')
+
+    def test_backoff(self):
+        """Restart delays should double with each crash, up to a maximum."""
+        assert supervisor.backoff(0) == 0
+        assert supervisor.backoff(1) == supervisor.BASE_BACKOFF
+        assert supervisor.backoff(2) == 2 * supervisor.BASE_BACKOFF
+        assert supervisor.backoff(100) == supervisor.MAX_BACKOFF
+
+    def test_parse_args(self):
+        """Queues and preloaded modules should accumulate."""
+        options = supervisor.parse_args(['-n', '2', '-q', 'high', '-q', 'low',
+                                         '--preload', 'os'])
+        assert options.workers == 2
+        assert options.queues == ['high', 'low']
+        assert options.modules == ['os']
+        assert not options.in_process
+        options = supervisor.parse_args([])
+        assert options.queues == ['high', 'default', 'low']
+        options = supervisor.parse_args(['--in-process'])
+        assert options.in_process
+        options = supervisor.parse_args(['--redis-url', 'redis://a',
+                                         '--redis-url', 'redis://b'])
+        assert options.redis_urls == ['redis://a', 'redis://b']
+
+    def test_parse_args_shards(self):
+        """Every Redis server should get at least one worker."""
+        urls = ['--redis-url', 'redis://a', '--redis-url', 'redis://b']
+        with mock.patch('sys.stderr'):
+            with self.assertRaises(SystemExit):
+                supervisor.parse_args(['-n', '1'] + urls)
+        assert supervisor.parse_args(['-n', '2'] + urls).workers == 2
+        with mock.patch('multiprocessing.cpu_count', return_value=1):
+            assert supervisor.parse_args(urls).workers == 2
+
+    def test_restart_crashed_worker(self):
+        """A worker exiting unexpectedly should be scheduled for restart."""
+        sup = supervisor.Supervisor(1, exit_immediately)
+        sup.spawn(0)
+        self.wait_for_workers(sup)
+        assert sup.crashes[0] == 1
+        assert sup.restart_at[0] is not None
+
+    def test_stop(self):
+        """Stopping should end the workers without restarting them."""
+        sup = supervisor.Supervisor(2, sleep_forever)
+        sup.spawn(0)
+        sup.spawn(1)
+        sup.stop()
+        self.wait_for_workers(sup)
+        assert not sup.workers
+        assert sup.restart_at == [None, None]
+
+
+if __name__ == '__main__':
+    unittest2.main()